@@ -33,12 +33,14 @@ to access that functionality. The same design is then used in the Crazyflie
 firmware which makes the mapping 1:1 in most cases.
 """
 import datetime
+import heapq
+import itertools
 import logging
 import time
 from collections import namedtuple
+from threading import Condition
 from threading import Lock
 from threading import Thread
-from threading import Timer
 
 import cflib.crtp
 from .appchannel import Appchannel
@@ -71,12 +73,30 @@ class State:
 class Crazyflie():
     """The Crazyflie class"""
 
-    def __init__(self, link=None, ro_cache=None, rw_cache=None):
+    # Stages of the connection setup, used as keys in setup_timing
+    STAGE_PLATFORM = 'platform'
+    STAGE_LOG_TOC = 'log_toc'
+    STAGE_MEMORIES = 'memories'
+    STAGE_PARAM_TOC = 'param_toc'
+    STAGE_SETUP = 'setup'
+    STAGE_PARAM_VALUES = 'param_values'
+
+    def __init__(self, link=None, ro_cache=None, rw_cache=None,
+                 parallel_setup=False, cache_param_values=False,
+                 resend_backoff=1.0, max_resends=None):
         """
         Create the objects from this module and register callbacks.
 
         ro_cache -- Path to read-only cache (string)
         rw_cache -- Path to read-write cache (string)
+        parallel_setup -- Fetch the log TOC, param TOC and memories
+                          concurrently when connecting (bool)
+        cache_param_values -- Store the parameter values in the read-write
+                              cache and use them when connecting (bool)
+        resend_backoff -- Factor the resend timeout is multiplied with for
+                          each resend of a packet without answer (float)
+        max_resends -- Max number of resends of a packet without answer,
+                       None for no limit (int)
         """
 
         # Called on disconnect, no matter the reason
@@ -120,6 +140,8 @@ class Crazyflie():
         self.mem = Memory(self)
         self.platform = PlatformService(self)
         self.appchannel = Appchannel(self)
+        self.param.all_updated.add_callback(self._all_params_updated_cb)
+        self.param.use_value_cache = cache_param_values
 
         self.link_uri = ''
 
@@ -127,12 +149,29 @@ class Crazyflie():
         self.packet_received.add_callback(self._check_for_initial_packet_cb)
         self.packet_received.add_callback(self._check_for_answers)
 
+        # Expected answers indexed on header: {header: {pattern: resend}}
         self._answer_patterns = {}
+        self._answer_pattern_max_len = {}
+
+        # One scheduler handles the resending of all packets without answer
+        self._resend_scheduler = _ResendScheduler()
+        self.resend_backoff = resend_backoff
+        self.max_resends = max_resends
+        # Number of resent packets per port
+        self.resend_counts = {}
 
         self._send_lock = Lock()
+        # Protects the answer patterns and the resend scheduler
+        self._answer_lock = Lock()
 
         self.connected_ts = None
 
+        self._parallel_setup = parallel_setup
+        self._setup_stages_left = set()
+        self._setup_stage_start = {}
+        # Duration in seconds of each stage of the last connection setup
+        self.setup_timing = {}
+
         # Connect callbacks to logger
         self.disconnected.add_callback(
             lambda uri: logger.info('Callback->Disconnected from [%s]', uri))
@@ -156,32 +195,106 @@ class Crazyflie():
         """ Callback when disconnected."""
         self.connected_ts = None
 
+    def _cancel_resends(self):
+        with self._answer_lock:
+            for patterns in self._answer_patterns.values():
+                for resend in patterns.values():
+                    resend.cancel()
+            self._answer_patterns = {}
+            self._answer_pattern_max_len = {}
+            # Stop the scheduler thread, a new one is started when needed
+            self._resend_scheduler.stop()
+            self._resend_scheduler = _ResendScheduler()
+
+    def _start_setup_stage(self, stage):
+        self._setup_stage_start[stage] = time.time()
+
+    def _setup_stage_done(self, stage):
+        self.setup_timing[stage] = time.time() - \
+            self._setup_stage_start[stage]
+        logger.info('Connection setup stage [%s] took %.3f s', stage,
+                    self.setup_timing[stage])
+
     def _start_connection_setup(self):
         """Start the connection setup by refreshing the TOCs"""
         logger.info('We are connected[%s], request connection setup',
                     self.link_uri)
+        self.setup_timing = {}
+        self._start_setup_stage(self.STAGE_SETUP)
+        self._start_setup_stage(self.STAGE_PLATFORM)
         self.platform.fetch_platform_informations(self._platform_info_fetched)
 
     def _platform_info_fetched(self):
+        self._setup_stage_done(self.STAGE_PLATFORM)
+        if self._parallel_setup:
+            # The log, param and memory subsystems use different ports and
+            # can be set up at the same time
+            self._setup_stages_left = {self.STAGE_LOG_TOC,
+                                       self.STAGE_MEMORIES,
+                                       self.STAGE_PARAM_TOC}
+            self._start_log_toc_refresh()
+            self._start_mem_refresh()
+            self._start_param_toc_refresh()
+        else:
+            self._start_log_toc_refresh()
+
+    def _start_log_toc_refresh(self):
+        self._start_setup_stage(self.STAGE_LOG_TOC)
         self.log.refresh_toc(self._log_toc_updated_cb, self._toc_cache)
 
-    def _param_toc_updated_cb(self):
-        """Called when the param TOC has been fully updated"""
-        logger.info('Param TOC finished updating')
+    def _start_mem_refresh(self):
+        self._start_setup_stage(self.STAGE_MEMORIES)
+        self.mem.refresh(self._mems_updated_cb)
+
+    def _start_param_toc_refresh(self):
+        self._start_setup_stage(self.STAGE_PARAM_TOC)
+        self.param.refresh_toc(self._param_toc_updated_cb, self._toc_cache)
+
+    def _parallel_setup_stage_done(self, stage):
+        self._setup_stages_left.discard(stage)
+        if len(self._setup_stages_left) == 0:
+            self._connection_setup_finished()
+
+    def _connection_setup_finished(self):
+        self._setup_stage_done(self.STAGE_SETUP)
         self.connected_ts = datetime.datetime.now()
         self.connected.call(self.link_uri)
         # Trigger the update for all the parameters
+        self._start_setup_stage(self.STAGE_PARAM_VALUES)
         self.param.request_update_of_all_params()
 
+    def _all_params_updated_cb(self):
+        """Called when all the parameter values have been fetched"""
+        if self.STAGE_PARAM_VALUES in self._setup_stage_start:
+            self._setup_stage_done(self.STAGE_PARAM_VALUES)
+            del self._setup_stage_start[self.STAGE_PARAM_VALUES]
+
+    def _param_toc_updated_cb(self):
+        """Called when the param TOC has been fully updated"""
+        logger.info('Param TOC finished updating')
+        self._setup_stage_done(self.STAGE_PARAM_TOC)
+        if self._parallel_setup:
+            self._parallel_setup_stage_done(self.STAGE_PARAM_TOC)
+        else:
+            self._connection_setup_finished()
+
     def _mems_updated_cb(self):
         """Called when the memories have been identified"""
         logger.info('Memories finished updating')
-        self.param.refresh_toc(self._param_toc_updated_cb, self._toc_cache)
+        self._setup_stage_done(self.STAGE_MEMORIES)
+        if self._parallel_setup:
+            self._parallel_setup_stage_done(self.STAGE_MEMORIES)
+        else:
+            self._start_param_toc_refresh()
 
     def _log_toc_updated_cb(self):
         """Called when the log TOC has been fully updated"""
         logger.info('Log TOC finished updating')
-        self.mem.refresh(self._mems_updated_cb)
+        self._setup_stage_done(self.STAGE_LOG_TOC)
+        if self._parallel_setup:
+            self._parallel_setup_stage_done(self.STAGE_LOG_TOC)
+        else:
+            self._start_mem_refresh()
 
     def _link_error_cb(self, errmsg):
         """Called from the link driver when there's an error"""
@@ -261,7 +374,7 @@ class Crazyflie():
         if (self.link is not None):
             self.link.close()
             self.link = None
-        self._answer_patterns = {}
+        self._cancel_resends()
         self.disconnected.call(self.link_uri)
 
     """Check if the communication link is open or not."""
@@ -277,11 +390,30 @@ class Crazyflie():
         """Remove the callback cb on port"""
         self.incoming.remove_port_callback(port, cb)
 
-    def _no_answer_do_retry(self, pk, pattern):
+    def _no_answer_do_retry(self, resend):
         """Resend packets that we have not gotten answers to"""
-        logger.info('Resending for pattern %s', pattern)
-        # Set the timer to None before trying to send again
-        self.send_packet(pk, expected_reply=pattern, resend=True)
+        with self._answer_lock:
+            pattern = resend.pattern
+            patterns = self._answer_patterns.get(pattern[0], {})
+            if patterns.get(pattern) is not resend or self.link is None:
+                # Answered or replaced by a new request in the mean time
+                return
+
+            if self.max_resends is not None and \
+                    resend.count >= self.max_resends:
+                logger.warning('No answer for pattern %s after %d resends, '
+                               'giving up', pattern, resend.count)
+                del patterns[pattern]
+                return
+
+            logger.info('Resending for pattern %s', pattern)
+            resend.count += 1
+            port = resend.pk.port
+            self.resend_counts[port] = self.resend_counts.get(port, 0) + 1
+
+            resend.timeout *= self.resend_backoff
+            self._resend_scheduler.schedule(resend)
+        self._send_to_link(resend.pk)
 
     def _check_for_answers(self, pk):
         """
@@ -289,65 +421,156 @@ class Crazyflie():
         waiting for an answer on this port. If so, then cancel the retry
         timer.
         """
-        longest_match = ()
-        if len(self._answer_patterns) > 0:
+        with self._answer_lock:
+            patterns = self._answer_patterns.get(pk.header)
+            if not patterns:
+                return
+
+            # The patterns are indexed on header, look for the longest
+            # pattern that is a prefix of the packet
             data = (pk.header,) + tuple(pk.data)
-            for p in list(self._answer_patterns.keys()):
-                logger.debug('Looking for pattern match on %s vs %s', p, data)
-                if len(p) <= len(data):
-                    if p == data[0:len(p)]:
-                        match = data[0:len(p)]
-                        if len(match) >= len(longest_match):
-                            logger.debug('Found new longest match %s', match)
-                            longest_match = match
-        if len(longest_match) > 0:
-            self._answer_patterns[longest_match].cancel()
-            del self._answer_patterns[longest_match]
-
-    def send_packet(self, pk, expected_reply=(), resend=False, timeout=0.2):
+            max_len = min(len(data),
+                          self._answer_pattern_max_len[pk.header])
+            for length in range(max_len, 0, -1):
+                match = data[0:length]
+                resend = patterns.pop(match, None)
+                if resend is not None:
+                    logger.debug('Found pattern match %s', match)
+                    resend.cancel()
+                    return
+
+    def _add_answer_pattern(self, pattern, resend):
+        header = pattern[0]
+        if header not in self._answer_patterns:
+            self._answer_patterns[header] = {}
+            self._answer_pattern_max_len[header] = 0
+        previous = self._answer_patterns[header].get(pattern)
+        if previous is not None:
+            previous.cancel()
+        self._answer_patterns[header][pattern] = resend
+        if len(pattern) > self._answer_pattern_max_len[header]:
+            self._answer_pattern_max_len[header] = len(pattern)
+
+    def send_packet(self, pk, expected_reply=(), resend=False, timeout=0.2,
+                    resend_until_answered=True):
         """
         Send a packet through the link interface.
 
         pk -- Packet to send
-        expect_answer -- True if a packet from the Crazyflie is expected to
-                         be sent back, otherwise false
+        expected_reply -- Start of the data of the packet the Crazyflie is
+                          expected to send back, empty if no answer is
+                          expected
+        resend -- True if the packet is a resend of a packet that is already
+                  waiting for the expected reply, otherwise false
+        timeout -- Time in seconds to wait for the expected reply before
+                   resending the packet
+        resend_until_answered -- True if the packet should be resent until
+                                 the expected reply is received, otherwise
+                                 false
 
         """
 
         if not pk.is_data_size_valid():
             raise Exception('Data part of packet is too large')
 
-        self._send_lock.acquire()
-        if self.link is not None:
-            if len(expected_reply) > 0 and not resend and \
-                    self.link.needs_resending:
-                pattern = (pk.header,) + expected_reply
-                logger.debug(
-                    'Sending packet and expecting the %s pattern back',
-                    pattern)
-                new_timer = Timer(timeout,
-                                  lambda: self._no_answer_do_retry(pk,
-                                                                   pattern))
-                self._answer_patterns[pattern] = new_timer
-                new_timer.start()
-            elif resend:
-                # Check if we have gotten an answer, if not try again
-                pattern = expected_reply
-                if pattern in self._answer_patterns:
-                    logger.debug('We want to resend and the pattern is there')
-                    if self._answer_patterns[pattern]:
-                        new_timer = Timer(timeout,
-                                          lambda:
-                                          self._no_answer_do_retry(
-                                              pk, pattern))
-                        self._answer_patterns[pattern] = new_timer
-                        new_timer.start()
-                else:
-                    logger.debug('Resend requested, but no pattern found: %s',
-                                 self._answer_patterns)
-            self.link.send_packet(pk)
-            self.packet_sent.call(pk)
-        self._send_lock.release()
+        link = self.link
+        if link is None:
+            return
+
+        if len(expected_reply) > 0 and not resend and \
+                resend_until_answered and link.needs_resending:
+            pattern = (pk.header,) + expected_reply
+            logger.debug(
+                'Sending packet and expecting the %s pattern back',
+                pattern)
+            new_resend = _Resend(pk, pattern, timeout,
+                                 self._no_answer_do_retry)
+            with self._answer_lock:
+                self._add_answer_pattern(pattern, new_resend)
+                self._resend_scheduler.schedule(new_resend)
+        self._send_to_link(pk)
+
+    def _send_to_link(self, pk):
+        # Sending can block when the queue of the link is full, the answer
+        # patterns are not locked meanwhile so answers can be handled
+        with self._send_lock:
+            if self.link is not None:
+                self.link.send_packet(pk)
+                self.packet_sent.call(pk)
+
+
+class _Resend:
+    """A packet that is resent until the expected answer is received"""
+
+    def __init__(self, pk, pattern, timeout, callback):
+        self.pk = pk
+        self.pattern = pattern
+        self.timeout = timeout
+        self.callback = callback
+        self.count = 0
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _ResendScheduler(Thread):
+    """
+    Calls the callback of resends when their timeout expires, unless they
+    have been cancelled. One thread and a heap ordered on deadline is used
+    for all resends instead of one timer thread per packet.
+    """
+
+    def __init__(self):
+        Thread.__init__(self)
+        self.daemon = True
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = Condition()
+        self._stopped = False
+
+    def schedule(self, resend):
+        deadline = time.monotonic() + resend.timeout
+        with self._condition:
+            if not self.is_alive():
+                self.start()
+            heapq.heappush(self._heap,
+                           (deadline, next(self._sequence), resend))
+            if self._heap[0][2] is resend:
+                self._condition.notify()
+
+    def stop(self):
+        """Drop all scheduled resends and stop the thread"""
+        with self._condition:
+            self._stopped = True
+            self._heap = []
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+                    # Drop cancelled resends without waiting for them
+                    while self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                resend = heapq.heappop(self._heap)[2]
+
+            try:
+                resend.callback(resend)
+            except Exception:  # pylint: disable=W0703
+                import traceback
+
+                logger.error('Exception while resending packet\n\n%s',
+                             traceback.format_exc())
 
 
 _CallbackContainer = namedtuple('CallbackConstainer',
@@ -361,6 +584,10 @@ class _IncomingPacketHandler(Thread):
         Thread.__init__(self)
         self.cf = cf
         self.cb = []
+        self._cb_lock = Lock()
+        # Callbacks for each port/channel combination, indexed on
+        # port << 2 | channel. Rebuilt when callbacks are added or removed.
+        self._dispatch_table = [()] * 64
 
     def add_port_callback(self, port, cb):
         """Add a callback for data that comes on a specific port"""
@@ -370,9 +597,11 @@ class _IncomingPacketHandler(Thread):
     def remove_port_callback(self, port, cb):
         """Remove a callback for data that comes on a specific port"""
         logger.debug('Removing callback on port [%d] to [%s]', port, cb)
-        for port_callback in self.cb:
-            if port_callback.port == port and port_callback.callback == cb:
-                self.cb.remove(port_callback)
+        with self._cb_lock:
+            self.cb = [port_callback for port_callback in self.cb
+                       if not (port_callback.port == port and
+                               port_callback.callback == cb)]
+            self._rebuild_dispatch_table()
 
     def add_header_callback(self, cb, port, channel, port_mask=0xFF,
                             channel_mask=0xFF):
@@ -381,8 +610,40 @@ class _IncomingPacketHandler(Thread):
         possibility to add a mask for channel and port for multiple
         hits for same callback.
         """
-        self.cb.append(_CallbackContainer(port, port_mask,
-                                          channel, channel_mask, cb))
+        with self._cb_lock:
+            self.cb.append(_CallbackContainer(port, port_mask,
+                                              channel, channel_mask, cb))
+            self._rebuild_dispatch_table()
+
+    def _rebuild_dispatch_table(self):
+        table = []
+        for index in range(64):
+            port = index >> 2
+            channel = index & 0x03
+            table.append(tuple(
+                cb for cb in self.cb
+                if cb.port == (port & cb.port_mask) and
+                cb.channel == (channel & cb.channel_mask)))
+        self._dispatch_table = table
+
+    def dispatch(self, pk):
+        """Send a received packet to the callbacks registered for it"""
+        # All-packet callbacks
+        self.cf.packet_received.call(pk)
+
+        for cb in self._dispatch_table[(pk.port & 0x0f) << 2 |
+                                       (pk.channel & 0x03)]:
+            try:
+                cb.callback(pk)
+            except Exception:  # pylint: disable=W0703
+                # Disregard pylint warning since we want to catch all
+                # exceptions and we can't know what will happen in
+                # the callbacks.
+                import traceback
+
+                logger.error('Exception while doing callback on port'
+                             ' [%d]\n\n%s', pk.port,
+                             traceback.format_exc())
 
     def run(self):
         while True:
@@ -394,26 +655,4 @@ class _IncomingPacketHandler(Thread):
             if pk is None:
                 continue
 
-            # All-packet callbacks
-            self.cf.packet_received.call(pk)
-
-            found = False
-            for cb in (cb for cb in self.cb
-                       if cb.port == (pk.port & cb.port_mask) and
-                       cb.channel == (pk.channel & cb.channel_mask)):
-                try:
-                    cb.callback(pk)
-                except Exception:  # pylint: disable=W0703
-                    # Disregard pylint warning since we want to catch all
-                    # exceptions and we can't know what will happen in
-                    # the callbacks.
-                    import traceback
-
-                    logger.error('Exception while doing callback on port'
-                                 ' [%d]\n\n%s', pk.port,
-                                 traceback.format_exc())
-                if cb.port != 0xFF:
-                    found = True
-
-            if not found:
-                pass
+            self.dispatch(pk)
@@ -63,6 +63,7 @@ States of a configuration:
 import errno
 import logging
 import struct
+from collections import namedtuple
 
 from .toc import Toc
 from .toc import TocFetcher
@@ -146,9 +147,23 @@ class LogConfig(object):
     # Maximum log payload length (4 bytes are used for block id and timestamp)
     MAX_LEN = 26
 
-    def __init__(self, name, period_in_ms):
-        """Initialize the entry"""
+    # Formats of the data passed to data_received_cb
+    DATA_FORMAT_DICT = 'dict'
+    DATA_FORMAT_TUPLE = 'tuple'
+    DATA_FORMAT_NAMEDTUPLE = 'namedtuple'
+
+    def __init__(self, name, period_in_ms, data_format=DATA_FORMAT_DICT):
+        """Initialize the entry
+
+        data_format - Format of the data passed to data_received_cb. By
+                      default a dict keyed on variable name is used. A tuple
+                      (in variable order) or a namedtuple avoids creating a
+                      new dict for every received packet.
+        """
         self.data_received_cb = Caller()
+        # Called with the raw log data before it is unpacked. The data is only
+        # valid for the duration of the call.
+        self.raw_data_received_cb = Caller()
         self.error_cb = Caller()
         self.started_cb = Caller()
         self.added_cb = Caller()
@@ -168,6 +183,12 @@ class LogConfig(object):
         self.variables = []
         self.default_fetch_as = []
         self.name = name
+        self.data_format = data_format
+
+        # Compiled decoder for the log data, built when the block is added
+        self._unpacker = None
+        self._names = None
+        self._data_type = None
 
     def add_variable(self, name, fetch_as=None):
         """Add a new variable to the configuration.
@@ -181,6 +202,7 @@ class LogConfig(object):
         Crazyflie)."""
         if fetch_as:
             self.variables.append(LogVariable(name, fetch_as))
+            self._unpacker = None
         else:
             # We cannot determine the default type until we have connected. So
             # save the name and we will add these once we are connected.
@@ -198,6 +220,7 @@ class LogConfig(object):
         """
         self.variables.append(LogVariable(name, fetch_as, LogVariable.MEM_TYPE,
                                           stored_as, address))
+        self._unpacker = None
 
     def _set_added(self, added):
         if added != self._added:
@@ -342,20 +365,39 @@ class LogConfig(object):
                 self.cf.send_packet(
                     pk, expected_reply=(CMD_DELETE_BLOCK, self.id))
 
+    def _compile_unpacker(self):
+        """Build the decoder used to unpack the log data of this entry. All
+        the variables are unpacked in one go using a pre-compiled struct."""
+        unpack_string = '<' + ''.join(
+            LogTocElement.get_unpack_string_from_id(var.fetch_as)[1:]
+            for var in self.variables)
+        self._unpacker = struct.Struct(unpack_string)
+        self._names = [var.name for var in self.variables]
+
+        if self.data_format == LogConfig.DATA_FORMAT_NAMEDTUPLE:
+            field_names = [name.replace('.', '_') for name in self._names]
+            self._data_type = namedtuple('LogData', field_names, rename=True)
+        else:
+            self._data_type = None
+
     def unpack_log_data(self, log_data, timestamp):
         """Unpack received logging data so it represent real values according
         to the configuration in the entry"""
-        ret_data = {}
-        data_index = 0
-        for var in self.variables:
-            size = LogTocElement.get_size_from_id(var.fetch_as)
-            name = var.name
-            unpackstring = LogTocElement.get_unpack_string_from_id(
-                var.fetch_as)
-            value = struct.unpack(
-                unpackstring, log_data[data_index:data_index + size])[0]
-            data_index += size
-            ret_data[name] = value
+        self.raw_data_received_cb.call(timestamp, log_data, self)
+        if not self.data_received_cb.callbacks:
+            return
+
+        if self._unpacker is None:
+            self._compile_unpacker()
+
+        values = self._unpacker.unpack_from(log_data)
+
+        if self.data_format == LogConfig.DATA_FORMAT_TUPLE:
+            ret_data = values
+        elif self.data_format == LogConfig.DATA_FORMAT_NAMEDTUPLE:
+            ret_data = self._data_type._make(values)
+        else:
+            ret_data = dict(zip(self._names, values))
         self.data_received_cb.call(timestamp, ret_data, self)
 
 
@@ -510,6 +552,7 @@ class Log():
             logconf.cf = self.cf
             logconf.id = self._config_id_counter
             logconf.useV2 = self._useV2
+            logconf._compile_unpacker()
             self._config_id_counter = (self._config_id_counter + 1) % 255
             self.log_blocks.append(logconf)
             self.block_added_cb.call(logconf)
@@ -533,6 +576,14 @@ class Log():
         pk.data = (CMD_RESET_LOGGING,)
         self.cf.send_packet(pk, expected_reply=(CMD_RESET_LOGGING,))
 
+    def _update_downlink_period(self):
+        """Tell the link how often the started log blocks send data"""
+        periods = [block.period_in_ms for block in self.log_blocks
+                   if block.started]
+        period = min(periods) / 1000 if periods else None
+        if self.cf.link is not None:
+            self.cf.link.set_downlink_period(period)
+
     def _find_block(self, id):
         for block in self.log_blocks:
             if block.id == id:
@@ -621,14 +672,15 @@ class Log():
                                              self._toc_cache)
                     toc_fetcher.start()
 
+            if cmd in (CMD_START_LOGGING, CMD_STOP_LOGGING, CMD_DELETE_BLOCK,
+                       CMD_RESET_LOGGING):
+                self._update_downlink_period()
+
         if (chan == CHAN_LOGDATA):
-            chan = packet.channel
             id = packet.data[0]
             block = self._find_block(id)
-            timestamps = struct.unpack('<BBB', packet.data[1:4])
-            timestamp = (
-                timestamps[0] | timestamps[1] << 8 | timestamps[2] << 16)
-            logdata = packet.data[4:]
+            timestamp = int.from_bytes(packet.data[1:4], 'little')
+            logdata = memoryview(packet.data)[4:]
             if (block is not None):
                 block.unpack_log_data(logdata, timestamp)
             else:
@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+"""
+This class records log data from the Crazyflie into pre-allocated columnar
+NumPy ring buffers.
+
+The raw log data is copied straight into a structured array with one column
+per variable plus the firmware timestamp, no dict or queue is involved per
+sample. The recorded data can be read at any time as array views, without
+locking, or exported with to_numpy() or save().
+
+The SwarmLogRecorder records the same log configurations from all
+Crazyflies in a swarm into shared buffers, with the firmware timestamps
+converted to one common host time.
+"""
+import concurrent.futures
+import copy
+import logging
+import struct
+import threading
+import time
+
+import numpy as np
+
+from cflib.crazyflie.log import LogConfig
+from cflib.crazyflie.log import LogTocElement
+from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
+from cflib.crtp.crtpstack import CRTPPacket
+from cflib.crtp.crtpstack import CRTPPort
+
+__author__ = 'Bitcraze AB'
+__all__ = ['LogRecorder', 'SwarmLogRecorder']
+
+logger = logging.getLogger(__name__)
+
+# NumPy types for the log variable types, the log data is little endian
+_NP_TYPES = {
+    'uint8_t': '<u1',
+    'uint16_t': '<u2',
+    'uint32_t': '<u4',
+    'int8_t': '<i1',
+    'int16_t': '<i2',
+    'int32_t': '<i4',
+    'FP16': '<f2',
+    'float': '<f4',
+}
+
+TIMESTAMP = 'timestamp'
+URI = 'uri'
+RECEIVED = 'received'
+TIME = 't'
+
+# The firmware timestamp in log data is a 24 bit ms counter
+_TIMESTAMP_WRAP = 1 << 24
+
+_LINK_ECHO_CH = 0
+
+
+class _RingBuffer:
+    """
+    A ring buffer of log samples for one log configuration.
+
+    Every sample is written twice, at index i and i + capacity, which makes
+    the last capacity samples always available as one contiguous slice.
+    Samples are written by one thread only and the sample count is updated
+    after the sample has been written, readers can therefore take views
+    without locking.
+    """
+
+    def __init__(self, log_config, capacity):
+        fields = [(TIMESTAMP, '<u4')]
+        for var in log_config.variables:
+            ctype = LogTocElement.get_cstring_from_id(var.fetch_as)
+            fields.append((var.name, _NP_TYPES[ctype]))
+        self.dtype = np.dtype(fields)
+
+        self.capacity = capacity
+        self.count = 0
+        self._data = np.zeros(2 * capacity, dtype=self.dtype)
+        self._timestamps = self._data[TIMESTAMP]
+        self._raw = self._data.view(np.uint8).reshape(
+            2 * capacity, self.dtype.itemsize)
+        self._payload_size = self.dtype.itemsize - 4
+
+    def add(self, timestamp, log_data):
+        if len(log_data) < self._payload_size:
+            logger.warning('Log data too short for recorder, dropping sample')
+            return
+
+        payload = np.frombuffer(log_data, dtype=np.uint8,
+                                count=self._payload_size)
+        index = self.count % self.capacity
+        mirror = index + self.capacity
+
+        self._raw[index, 4:] = payload
+        self._raw[mirror, 4:] = payload
+        self._timestamps[index] = timestamp
+        self._timestamps[mirror] = timestamp
+
+        self.count += 1
+
+    def snapshot(self, samples=None):
+        count = self.count
+        available = min(count, self.capacity)
+        if samples is None or samples > available:
+            samples = available
+
+        if count == 0:
+            return self._data[:0]
+
+        end = (count - 1) % self.capacity + 1 + self.capacity
+        return self._data[end - samples:end]
+
+
+class LogRecorder:
+    """
+    Records log data from one or more log configurations into columnar ring
+    buffers.
+    """
+
+    def __init__(self, crazyflie, log_config, capacity=10000):
+        """
+        Construct an instance of a LogRecorder
+
+        Takes an Crazyflie or SyncCrazyflie instance and one log configuration
+        or an array of log configurations. capacity is the number of samples
+        that is kept for each log configuration, when the buffer is full the
+        oldest samples are overwritten.
+        """
+        if isinstance(crazyflie, SyncCrazyflie):
+            self._cf = crazyflie.cf
+        else:
+            self._cf = crazyflie
+
+        if isinstance(log_config, list):
+            self._log_config = log_config
+        else:
+            self._log_config = [log_config]
+
+        self._capacity = capacity
+        self._buffers = {}
+
+        self._is_connected = False
+
+    def connect(self):
+        if self._is_connected:
+            raise Exception('Already connected')
+
+        self._cf.disconnected.add_callback(self._disconnected)
+        for config in self._log_config:
+            self._cf.log.add_config(config)
+            # The types of the variables are known once the config is added
+            self._buffers[config.name] = _RingBuffer(config, self._capacity)
+            config.raw_data_received_cb.add_callback(self._log_callback)
+            config.start()
+
+        self._is_connected = True
+
+    def disconnect(self):
+        if self._is_connected:
+            for config in self._log_config:
+                config.stop()
+                config.delete()
+
+                config.raw_data_received_cb.remove_callback(
+                    self._log_callback)
+
+            self._cf.disconnected.remove_callback(self._disconnected)
+
+            self._is_connected = False
+
+    def is_connected(self):
+        return self._is_connected
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disconnect()
+
+    def sample_count(self, name):
+        """Return the total number of samples received for a log config"""
+        return self._buffers[name].count
+
+    def snapshot(self, name, samples=None):
+        """
+        Return a view of the last recorded samples of a log configuration, in
+        chronological order. All samples in the buffer are returned if
+        samples is None.
+
+        The view is not a copy, samples older than capacity will be
+        overwritten while recording continues. Copy the view if the data must
+        be kept.
+        """
+        return self._buffers[name].snapshot(samples)
+
+    def to_numpy(self, copy=True):
+        """
+        Return the recorded samples of all log configurations as a dict of
+        structured arrays keyed on log configuration name. Views into the
+        buffers are returned if copy is False.
+        """
+        result = {}
+        for name, buffer in self._buffers.items():
+            data = buffer.snapshot()
+            result[name] = data.copy() if copy else data
+        return result
+
+    def save(self, file):
+        """Save the recorded samples to a .npz file"""
+        np.savez(file, **self.to_numpy(copy=False))
+
+    def _log_callback(self, ts, data, logblock):
+        self._buffers[logblock.name].add(ts, data)
+
+    def _disconnected(self, link_uri):
+        self.disconnect()
+
+
+class _TimestampUnwrapper:
+    """Extends the wrapping firmware timestamps of one log block to 64 bits"""
+
+    def __init__(self):
+        self._last = None
+        self._offset = 0
+
+    def unwrap(self, timestamp):
+        if self._last is not None and \
+                timestamp < self._last - _TIMESTAMP_WRAP // 2:
+            self._offset += _TIMESTAMP_WRAP
+        self._last = timestamp
+        return self._offset + timestamp
+
+
+class _SwarmBuffer:
+    """
+    A ring buffer of log samples for one log configuration, written by the
+    incoming packet threads of all Crazyflies in a swarm.
+    """
+
+    _HEADER = [(URI, '<u2'), (TIMESTAMP, '<u8'), (RECEIVED, '<f8')]
+
+    def __init__(self, log_config, capacity):
+        fields = list(self._HEADER)
+        for var in log_config.variables:
+            ctype = LogTocElement.get_cstring_from_id(var.fetch_as)
+            fields.append((var.name, _NP_TYPES[ctype]))
+        self.dtype = np.dtype(fields)
+
+        self.capacity = capacity
+        self.count = 0
+        self._data = np.zeros(capacity, dtype=self.dtype)
+        self._uris = self._data[URI]
+        self._timestamps = self._data[TIMESTAMP]
+        self._received = self._data[RECEIVED]
+        self._raw = self._data.view(np.uint8).reshape(
+            capacity, self.dtype.itemsize)
+        self._header_size = np.dtype(self._HEADER).itemsize
+        self._payload_size = self.dtype.itemsize - self._header_size
+        self._lock = threading.Lock()
+
+    def add(self, uri_index, timestamp, received, log_data):
+        if len(log_data) < self._payload_size:
+            logger.warning('Log data too short for recorder, dropping sample')
+            return
+
+        payload = np.frombuffer(log_data, dtype=np.uint8,
+                                count=self._payload_size)
+        with self._lock:
+            index = self.count % self.capacity
+            self._raw[index, self._header_size:] = payload
+            self._uris[index] = uri_index
+            self._timestamps[index] = timestamp
+            self._received[index] = received
+            self.count += 1
+
+    def snapshot(self):
+        """A copy of the samples in the buffer, oldest first"""
+        with self._lock:
+            if self.count <= self.capacity:
+                return self._data[:self.count].copy()
+            index = self.count % self.capacity
+            return np.concatenate((self._data[index:], self._data[:index]))
+
+
+class SwarmLogRecorder:
+    """
+    Records the same log configurations from all Crazyflies in a swarm into
+    one columnar buffer per log configuration.
+
+    The 24 bit firmware timestamps are extended to 64 bits for each
+    Crazyflie. They are also converted to a common host time, in
+    time.perf_counter() seconds, using an estimate of the clock offset of
+    each Crazyflie. The offset is the shortest time from a sample is
+    taken until it is received, which is measured for every sample, minus
+    half of the shortest link round trip measured with echo packets when
+    recording starts.
+    """
+
+    def __init__(self, cfs, log_config, capacity=100000, echo_count=10):
+        """
+        :param cfs: A dictionary of SyncCrazyflie or Crazyflie instances
+         keyed on URI
+        :param log_config: A log configuration or a list of log
+         configurations used as templates, a copy of each is added to all
+         Crazyflies
+        :param capacity: Number of samples kept for each log configuration,
+         for all Crazyflies together
+        :param echo_count: Number of echo packets used to measure the round
+         trip of each link
+        """
+        self.uris = list(cfs)
+        self._cfs = [scf.cf if isinstance(scf, SyncCrazyflie) else scf
+                     for scf in cfs.values()]
+
+        if isinstance(log_config, list):
+            self._templates = log_config
+        else:
+            self._templates = [log_config]
+
+        self._capacity = capacity
+        self._echo_count = echo_count
+        self._buffers = {}
+        self._configs = []
+        self._min_delay = [np.inf] * len(self.uris)
+        self.round_trips = [None] * len(self.uris)
+
+        self._is_connected = False
+
+    @staticmethod
+    def _copy_config(template):
+        config = LogConfig(template.name, template.period_in_ms,
+                           template.data_format)
+        config.variables = [copy.copy(var) for var in template.variables]
+        config.default_fetch_as = list(template.default_fetch_as)
+        return config
+
+    def connect(self):
+        if self._is_connected:
+            raise Exception('Already connected')
+
+        # Measure all links at the same time, a Crazyflie that does not
+        # answer takes a while to give up on
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, len(self._cfs))) as executor:
+            self.round_trips = list(
+                executor.map(self._measure_round_trip, self._cfs))
+
+        for uri_index, cf in enumerate(self._cfs):
+            unwrappers = {}
+            callback = self._create_callback(uri_index, unwrappers)
+            for template in self._templates:
+                config = self._copy_config(template)
+                cf.log.add_config(config)
+                if config.name not in self._buffers:
+                    # The types of the variables are known once the config
+                    # is added
+                    self._buffers[config.name] = _SwarmBuffer(
+                        config, self._capacity)
+                unwrappers[config.name] = _TimestampUnwrapper()
+                config.raw_data_received_cb.add_callback(callback)
+                self._configs.append((config, callback))
+
+        for config, _ in self._configs:
+            config.start()
+
+        self._is_connected = True
+
+    def disconnect(self):
+        if self._is_connected:
+            for config, callback in self._configs:
+                config.stop()
+                config.delete()
+                config.raw_data_received_cb.remove_callback(callback)
+            self._configs = []
+
+            self._is_connected = False
+
+    def is_connected(self):
+        return self._is_connected
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disconnect()
+
+    def _create_callback(self, uri_index, unwrappers):
+        def log_callback(ts, data, logblock):
+            received = time.perf_counter()
+            timestamp = unwrappers[logblock.name].unwrap(ts)
+            delay = received - timestamp / 1000
+            if delay < self._min_delay[uri_index]:
+                self._min_delay[uri_index] = delay
+            self._buffers[logblock.name].add(uri_index, timestamp, received,
+                                             data)
+        return log_callback
+
+    def _measure_round_trip(self, cf):
+        """The shortest round trip of echo packets over the link"""
+        answered = threading.Event()
+        expected = [None]
+
+        def echo_received(pk):
+            if pk.channel == _LINK_ECHO_CH and bytes(pk.data) == expected[0]:
+                answered.set()
+
+        round_trip = None
+        cf.add_port_callback(CRTPPort.LINKCTRL, echo_received)
+        try:
+            for sequence in range(self._echo_count):
+                expected[0] = struct.pack('<4sI', b'SLRT', sequence)
+                answered.clear()
+                pk = CRTPPacket()
+                pk.set_header(CRTPPort.LINKCTRL, _LINK_ECHO_CH)
+                pk.data = expected[0]
+                start = time.perf_counter()
+                cf.send_packet(pk)
+                if answered.wait(0.5):
+                    elapsed = time.perf_counter() - start
+                    if round_trip is None or elapsed < round_trip:
+                        round_trip = elapsed
+        finally:
+            cf.remove_port_callback(CRTPPort.LINKCTRL, echo_received)
+
+        if round_trip is None:
+            logger.warning('No echo answers, the clock offset will include '
+                           'the link latency')
+        return round_trip
+
+    def clock_offsets(self):
+        """
+        The estimated host time, in time.perf_counter() seconds, when the
+        firmware timestamp of each Crazyflie was 0, keyed on URI. None for
+        Crazyflies that have not sent any data yet.
+        """
+        return {uri: offset if np.isfinite(offset) else None
+                for uri, offset in zip(self.uris, self._offsets())}
+
+    def _offsets(self):
+        offsets = np.array(self._min_delay)
+        for uri_index, round_trip in enumerate(self.round_trips):
+            if round_trip is not None:
+                offsets[uri_index] -= round_trip / 2
+        return offsets
+
+    def sample_count(self, name):
+        """Return the total number of samples received for a log config"""
+        return self._buffers[name].count
+
+    def to_numpy(self, name, uri=None):
+        """
+        Return the recorded samples of a log configuration as a structured
+        array sorted on host time. The 'uri' column is an index into uris,
+        't' is the host time of the sample in time.perf_counter() seconds,
+        'timestamp' the unwrapped firmware timestamp in ms and 'received'
+        the host time when the sample was received. Only the samples of one
+        Crazyflie are returned if uri is set.
+        """
+        data = self._buffers[name].snapshot()
+        if uri is not None:
+            data = data[data[URI] == self.uris.index(uri)]
+
+        fields = [(URI, '<u2'), (TIME, '<f8')] + \
+            [(field, data.dtype[field]) for field in data.dtype.names
+             if field != URI]
+        result = np.empty(len(data), dtype=fields)
+        for field in data.dtype.names:
+            result[field] = data[field]
+        result[TIME] = data[TIMESTAMP] / 1000 + self._offsets()[data[URI]]
+
+        return result[np.argsort(result[TIME], kind='stable')]
+
+    def save(self, file):
+        """Save the recorded samples of all log configurations to a .npz
+        file, the URIs are saved as 'uris'"""
+        arrays = {name: self.to_numpy(name) for name in self._buffers}
+        np.savez(file, uris=np.array(self.uris), **arrays)
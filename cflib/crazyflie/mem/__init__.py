@@ -31,6 +31,7 @@ Enables access to the Crazyflie memory subsystem.
 import errno
 import logging
 import struct
+import time
 from threading import Lock
 
 from .deck_memory import DeckMemoryManager
@@ -44,6 +45,7 @@ from .lighthouse_memory import LighthouseMemory
 from .loco_memory import LocoMemory
 from .loco_memory_2 import LocoMemory2
 from .memory_element import MemoryElement
+from .memory_mirror import MemoryMirror
 from .memory_tester import MemoryTester
 from .ow_element import OWElement
 from .trajectory_memory import Poly4D
@@ -53,7 +55,7 @@ from cflib.crtp.crtpstack import CRTPPort
 from cflib.utils.callbacks import Caller
 
 __author__ = 'Bitcraze AB'
-__all__ = ['Memory', 'Poly4D', 'MemoryElement',
+__all__ = ['Memory', 'Poly4D', 'MemoryElement', 'MemoryMirror',
            'LighthouseBsGeometry', 'LighthouseBsCalibration', 'LighthouseMemHelper',
            'DeckMemoryManager']
 
@@ -73,142 +75,225 @@ logger = logging.getLogger(__name__)
 class _ReadRequest:
     """
     Class used to handle memory reads that will split up the read in multiple
-    packets if necessary
+    packets if necessary. Up to window chunks are requested at the same time
+    and the replies are put in place by address, so the order they arrive in
+    does not matter.
     """
     MAX_DATA_LENGTH = 20
+    DEFAULT_WINDOW = 4
 
-    def __init__(self, mem, addr, length, cf):
+    def __init__(self, mem, addr, length, cf, window=DEFAULT_WINDOW):
         """Initialize the object with good defaults"""
         self.mem = mem
         self.addr = addr
-        self._bytes_left = length
-        self.data = bytearray()
+        self.length = length
+        self.data = bytearray(length)
         self.cf = cf
+        self.window = max(1, window)
+
+        self._next_addr = addr
+        self._bytes_left = length
+        # Outstanding chunks, {addr: length}
+        self._in_flight = {}
 
-        self._current_addr = addr
+        self.start_time = None
+        self.end_time = None
 
     def start(self):
         """Start the fetching of the data"""
-        self._request_new_chunk()
+        self.start_time = time.perf_counter()
+        if self.length == 0:
+            self._in_flight[self.addr] = 0
+            self._request_chunk(self.addr, 0)
+        self._fill_window()
 
     def resend(self):
-        logger.debug('Sending write again...')
-        self._request_new_chunk()
-
-    def _request_new_chunk(self):
+        logger.debug('Sending read again...')
+        for addr, length in list(self._in_flight.items()):
+            self._request_chunk(addr, length)
+
+    def _fill_window(self):
+        end = self.addr + self.length
+        while len(self._in_flight) < self.window and self._next_addr < end:
+            new_len = min(end - self._next_addr, _ReadRequest.MAX_DATA_LENGTH)
+            self._in_flight[self._next_addr] = new_len
+            self._request_chunk(self._next_addr, new_len)
+            self._next_addr += new_len
+
+    def _request_chunk(self, addr, length):
         """
-        Called to request a new chunk of data to be read from the Crazyflie
+        Called to request a chunk of data to be read from the Crazyflie
         """
-        # Figure out the length of the next request
-        new_len = self._bytes_left
-        if new_len > _ReadRequest.MAX_DATA_LENGTH:
-            new_len = _ReadRequest.MAX_DATA_LENGTH
-
         logger.debug('Requesting new chunk of {}bytes at 0x{:X}'.format(
-            new_len, self._current_addr))
+            length, addr))
 
-        # Request the data for the next address
+        # Request the data for the address
         pk = CRTPPacket()
         pk.set_header(CRTPPort.MEM, CHAN_READ)
-        pk.data = struct.pack('<BIB', self.mem.id, self._current_addr, new_len)
+        pk.data = struct.pack('<BIB', self.mem.id, addr, length)
         reply = struct.unpack('<BBBBB', pk.data[:-1])
         self.cf.send_packet(pk, expected_reply=reply, timeout=1)
 
+    def is_waiting_for(self, addr):
+        """True if a chunk at the address has been requested but not read"""
+        return addr in self._in_flight
+
     def add_data(self, addr, data):
         """Callback when data is received from the Crazyflie"""
-        data_len = len(data)
-        if not addr == self._current_addr:
-            logger.warning(
-                'Address did not match when adding data to read request!')
-            return
-
-        # Add the data and calculate the next address to fetch
-        self.data += data
+        length = self._in_flight.pop(addr, None)
+        if length is None:
+            # Late answer to a resent request, or not ours
+            logger.debug(
+                'Address 0x{:X} did not match an outstanding read'.format(
+                    addr))
+            return False
+
+        data_len = min(len(data), length)
+        offset = addr - self.addr
+        self.data[offset:offset + data_len] = data[:data_len]
         self._bytes_left -= data_len
-        self._current_addr += data_len
+        if data_len < length:
+            # Short answer, ask for the rest of the chunk
+            self._in_flight[addr + data_len] = length - data_len
+            self._request_chunk(addr + data_len, length - data_len)
 
         if self._bytes_left > 0:
-            self._request_new_chunk()
+            self._fill_window()
             return False
         else:
+            self.end_time = time.perf_counter()
             return True
 
+    def bytes_per_second(self):
+        """Read throughput of the finished request, None if not done"""
+        if self.end_time is None:
+            return None
+        elapsed = self.end_time - self.start_time
+        if elapsed <= 0:
+            return None
+        return self.length / elapsed
+
 
 class _WriteRequest:
     """
-    Class used to handle memory reads that will split up the read in multiple
-    packets in necessary
+    Class used to handle memory writes that will split up the write in
+    multiple packets if necessary. Up to window chunks are written at the
+    same time, the acknowledgements are matched on address and a chunk that
+    fails is written again, up to MAX_RETRIES times.
     """
     MAX_DATA_LENGTH = 25
+    DEFAULT_WINDOW = 4
+    MAX_RETRIES = 2
 
-    def __init__(self, mem, addr, data, cf):
+    def __init__(self, mem, addr, data, cf, window=DEFAULT_WINDOW):
         """Initialize the object with good defaults"""
         self.mem = mem
         self.addr = addr
-        self._bytes_left = len(data)
-        self._data = data
-        self.data = bytearray()
+        if isinstance(data, (list, tuple)):
+            data = bytes(data)
+        # The chunks are sent from a view of the data, no copies are made
+        self._data = memoryview(data).cast('B')
+        self.length = len(self._data)
         self.cf = cf
+        self.window = max(1, window)
 
-        self._current_addr = addr
-
-        self._sent_packet = None
-        self._sent_reply = None
+        self._next_offset = 0
+        self._bytes_written = 0
+        # Outstanding chunks, {addr: [packet, reply, length, retries]}
+        self._in_flight = {}
 
-        self._addr_add = 0
+        self.start_time = None
+        self.end_time = None
 
     def start(self):
-        """Start the fetching of the data"""
-        self._write_new_chunk()
+        """Start the writing of the data"""
+        self.start_time = time.perf_counter()
+        if self.length == 0:
+            self._write_chunk(0, 0)
+        self._fill_window()
 
     def resend(self):
         logger.debug('Sending write again...')
-        self.cf.send_packet(
-            self._sent_packet, expected_reply=self._sent_reply, timeout=1)
-
-    def _write_new_chunk(self):
+        for pk, reply, _, _ in list(self._in_flight.values()):
+            self.cf.send_packet(pk, expected_reply=reply, timeout=1)
+
+    def _fill_window(self):
+        while len(self._in_flight) < self.window and \
+                self._next_offset < self.length:
+            new_len = min(self.length - self._next_offset,
+                          _WriteRequest.MAX_DATA_LENGTH)
+            self._write_chunk(self._next_offset, new_len)
+            self._next_offset += new_len
+
+    def _write_chunk(self, offset, length):
         """
-        Called to request a new chunk of data to be read from the Crazyflie
+        Called to write a chunk of data to the Crazyflie
         """
-        # Figure out the length of the next request
-        new_len = len(self._data)
-        if new_len > _WriteRequest.MAX_DATA_LENGTH:
-            new_len = _WriteRequest.MAX_DATA_LENGTH
-
+        addr = self.addr + offset
         logger.debug('Writing new chunk of {}bytes at 0x{:X}'.format(
-            new_len, self._current_addr))
-
-        data = self._data[:new_len]
-        self._data = self._data[new_len:]
+            length, addr))
 
         pk = CRTPPacket()
         pk.set_header(CRTPPort.MEM, CHAN_WRITE)
-        pk.data = struct.pack('<BI', self.mem.id, self._current_addr)
+        header = struct.pack('<BI', self.mem.id, addr)
         # Create a tuple used for matching the reply using id and address
-        reply = struct.unpack('<BBBBB', pk.data)
-        self._sent_reply = reply
-        # Add the data
-        pk.data += struct.pack('B' * len(data), *data)
-        self._sent_packet = pk
+        reply = struct.unpack('<BBBBB', header)
+        pk.data = header + self._data[offset:offset + length]
+        self._in_flight[addr] = [pk, reply, length, 0]
         self.cf.send_packet(pk, expected_reply=reply, timeout=1)
 
-        self._addr_add = len(data)
-
     def write_done(self, addr):
-        """Callback when data is received from the Crazyflie"""
-        if not addr == self._current_addr:
-            logger.warning(
-                'Address did not match when adding data to read request!')
-            return
-
-        if len(self._data) > 0:
-            self._current_addr += self._addr_add
-            self._write_new_chunk()
+        """Callback when a write is acknowledged by the Crazyflie"""
+        chunk = self._in_flight.pop(addr, None)
+        if chunk is None:
+            # Late answer to a resent chunk, or not ours
+            logger.debug(
+                'Address 0x{:X} did not match an outstanding write'.format(
+                    addr))
+            return False
+
+        self._bytes_written += chunk[2]
+
+        if self._in_flight or self._next_offset < self.length:
+            self._fill_window()
             return False
         else:
             logger.debug('This write request is done')
+            self.end_time = time.perf_counter()
             return True
 
+    def write_failed(self, addr):
+        """
+        Callback when the Crazyflie fails to write a chunk. The chunk is
+        written again if it has retries left. Returns True if the request
+        has failed.
+        """
+        chunk = self._in_flight.get(addr)
+        if chunk is None:
+            return False
+
+        if chunk[3] >= _WriteRequest.MAX_RETRIES:
+            return True
+
+        logger.debug('Writing chunk at 0x{:X} again'.format(addr))
+        chunk[3] += 1
+        self.cf.send_packet(chunk[0], expected_reply=chunk[1], timeout=1)
+        return False
+
+    def bytes_written(self):
+        """Number of bytes acknowledged by the Crazyflie"""
+        return self._bytes_written
+
+    def bytes_per_second(self):
+        """Write throughput so far, None before the first acknowledgement"""
+        end = self.end_time
+        if end is None:
+            end = time.perf_counter()
+        elapsed = end - self.start_time
+        if self._bytes_written == 0 or elapsed <= 0:
+            return None
+        return self._bytes_written / elapsed
+
 
 class Memory():
     """Access memories on the Crazyflie"""
@@ -230,6 +315,11 @@ class Memory():
         self.cf.add_port_callback(CRTPPort.MEM, self._new_packet_cb)
         self.cf.disconnected.add_callback(self._disconnected)
         self._write_requests_lock = Lock()
+        self._read_requests_lock = Lock()
+        # Number of chunks requested at the same time when reading
+        self.read_window = _ReadRequest.DEFAULT_WINDOW
+        # Number of chunks written at the same time
+        self.write_window = _WriteRequest.DEFAULT_WINDOW
 
         self._clear_state()
 
@@ -243,6 +333,10 @@ class Memory():
         self.mem_read_failed_cb = Caller()
         self.mem_write_cb = Caller()
         self.mem_write_failed_cb = Caller()
+        # Called when a chunk of a write is acknowledged with the memory,
+        # the address of the write, the number of bytes written so far, the
+        # total number of bytes and the throughput in bytes/s
+        self.mem_write_progress_cb = Caller()
 
         self._refresh_callback = None
         self._fetch_id = 0
@@ -251,6 +345,9 @@ class Memory():
         self._elem_data = ()
         self._read_requests = {}
         self._write_requests = {}
+        # Throughput in bytes/s of the last finished read and write
+        self.last_read_rate = None
+        self.last_write_rate = None
         self._ow_mems_left_to_update = []
         self._getting_count = False
 
@@ -295,38 +392,42 @@ class Memory():
         return None
 
     def write(self, memory, addr, data, flush_queue=False):
-        """Write the specified data to the given memory at the given address"""
-        wreq = _WriteRequest(memory, addr, data, self.cf)
+        """
+        Write the specified data to the given memory at the given address.
+        The data can be any bytes-like object, it is sent without being
+        copied and must not be changed until the write is done.
+        """
+        wreq = _WriteRequest(memory, addr, data, self.cf,
+                             window=self.write_window)
         if memory.id not in self._write_requests:
             self._write_requests[memory.id] = []
 
         # Workaround until we secure the uplink and change messages for
         # mems to non-blocking
-        self._write_requests_lock.acquire()
-        if flush_queue:
-            self._write_requests[memory.id] = self._write_requests[
-                memory.id][:1]
-        self._write_requests[memory.id].append(wreq)
-        if len(self._write_requests[memory.id]) == 1:
-            wreq.start()
-        self._write_requests_lock.release()
+        with self._write_requests_lock:
+            if flush_queue:
+                self._write_requests[memory.id] = self._write_requests[
+                    memory.id][:1]
+            self._write_requests[memory.id].append(wreq)
+            if len(self._write_requests[memory.id]) == 1:
+                wreq.start()
 
         return True
 
     def read(self, memory, addr, length):
         """
         Read the specified amount of bytes from the given memory at the given
-        address
+        address. Reads of a memory that already has a read ongoing are queued
+        and started when the previous one is done.
         """
-        if memory.id in self._read_requests:
-            logger.warning('There is already a read operation ongoing for '
-                           'memory id {}'.format(memory.id))
-            return False
-
-        rreq = _ReadRequest(memory, addr, length, self.cf)
-        self._read_requests[memory.id] = rreq
-
-        rreq.start()
+        rreq = _ReadRequest(memory, addr, length, self.cf,
+                            window=self.read_window)
+        with self._read_requests_lock:
+            if memory.id not in self._read_requests:
+                self._read_requests[memory.id] = []
+            self._read_requests[memory.id].append(rreq)
+            if len(self._read_requests[memory.id]) == 1:
+                rreq.start()
 
         return True
 
@@ -513,36 +614,37 @@ class Memory():
                 'WRITE: Mem={}, addr=0x{:X}, status=0x{}'.format(
                     id, addr, status))
             # Find the read request
-            if id in self._write_requests:
-                self._write_requests_lock.acquire()
+            if self._write_requests.get(id):
                 do_call_sucess_cb = False
                 do_call_fail_cb = False
-                wreq = self._write_requests[id][0]
-                if status == 0:
-                    if wreq.write_done(addr):
-                        # self._write_requests.pop(id, None)
-                        # Remove the first item
-                        self._write_requests[id].pop(0)
-                        do_call_sucess_cb = True
-
-                        # Get a new one to start (if there are any)
-                        if len(self._write_requests[id]) > 0:
-                            self._write_requests[id][0].start()
-                else:
-                    logger.debug(
-                        'Status {}: write failed.'.format(status))
-                    # Remove from queue
-                    self._write_requests[id].pop(0)
-                    do_call_fail_cb = True
+                with self._write_requests_lock:
+                    wreq = self._write_requests[id][0]
+                    written = wreq.bytes_written()
+                    if status == 0:
+                        if wreq.write_done(addr):
+                            # Remove the first item
+                            self._write_requests[id].pop(0)
+                            self.last_write_rate = wreq.bytes_per_second()
+                            do_call_sucess_cb = True
+                    else:
+                        logger.debug(
+                            'Status {}: write failed.'.format(status))
+                        if wreq.write_failed(addr):
+                            # Remove from queue
+                            self._write_requests[id].pop(0)
+                            do_call_fail_cb = True
 
                     # Get a new one to start (if there are any)
-                    if len(self._write_requests[id]) > 0:
+                    if (do_call_sucess_cb or do_call_fail_cb) and \
+                            len(self._write_requests[id]) > 0:
                         self._write_requests[id][0].start()
 
-                self._write_requests_lock.release()
-
                 # Call callbacks after the lock has been released to alow for new writes
                 # to be initiated from the callback.
+                if wreq.bytes_written() != written:
+                    self.mem_write_progress_cb.call(
+                        wreq.mem, wreq.addr, wreq.bytes_written(),
+                        wreq.length, wreq.bytes_per_second())
                 if do_call_sucess_cb:
                     self.mem_write_cb.call(wreq.mem, wreq.addr)
                 if do_call_fail_cb:
@@ -555,17 +657,37 @@ class Memory():
             logger.debug('READ: Mem={}, addr=0x{:X}, status=0x{}, '
                          'data={}'.format(id, addr, status, data))
             # Find the read request
-            if id in self._read_requests:
+            if self._read_requests.get(id):
                 logger.debug(
                     'READING: We are still interested in request for '
                     'mem {}'.format(id))
-                rreq = self._read_requests[id]
-                if status == 0:
-                    if rreq.add_data(addr, payload[5:]):
-                        self._read_requests.pop(id, None)
-                        self.mem_read_cb.call(rreq.mem, rreq.addr, rreq.data)
-                else:
-                    logger.debug('Status {}: read failed.'.format(status))
-                    self._read_requests.pop(id, None)
+                do_call_sucess_cb = False
+                do_call_fail_cb = False
+                with self._read_requests_lock:
+                    rreq = self._read_requests[id][0]
+                    if status == 0:
+                        if rreq.add_data(addr, payload[5:]):
+                            self._read_requests[id].pop(0)
+                            self.last_read_rate = rreq.bytes_per_second()
+                            do_call_sucess_cb = True
+                    elif rreq.is_waiting_for(addr):
+                        logger.debug('Status {}: read failed.'.format(status))
+                        self._read_requests[id].pop(0)
+                        do_call_fail_cb = True
+                    else:
+                        # Late error for a request that is already done
+                        logger.debug(
+                            'Status {} for address 0x{:X} that is not '
+                            'read'.format(status, addr))
+
+                    if (do_call_sucess_cb or do_call_fail_cb) and \
+                            len(self._read_requests[id]) > 0:
+                        self._read_requests[id][0].start()
+
+                # Call callbacks after the lock has been released to allow for
+                # new reads to be initiated from the callback.
+                if do_call_sucess_cb:
+                    self.mem_read_cb.call(rreq.mem, rreq.addr, rreq.data)
+                if do_call_fail_cb:
                     self.mem_read_failed_cb.call(
                         rreq.mem, rreq.addr, rreq.data)
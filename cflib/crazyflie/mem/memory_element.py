@@ -21,6 +21,8 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 import logging
 
+from .memory_mirror import MemoryMirror
+
 logger = logging.getLogger(__name__)
 
 
@@ -72,6 +74,13 @@ class MemoryElement(object):
     def new_data(self, mem, addr, data):
         logger.debug('New data, but not OW mem')
 
+    def mirror(self, addr=0, size=None):
+        """
+        Create a host side mirror of the memory, or of size bytes starting
+        at addr, that only writes the bytes that changed and caches reads
+        """
+        return MemoryMirror(self, addr=addr, size=size)
+
     def __str__(self):
         """Generate debug string for memory"""
         return ('Memory: id={}, type={}, size={}'.format(
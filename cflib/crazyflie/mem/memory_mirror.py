@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+#
+# ,---------,       ____  _ __
+# |  ,-^-,  |      / __ )(_) /_______________ _____  ___
+# | (  O  ) |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+# | / ,--'  |    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#    +------`   /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+# Copyright (C) 2023 Bitcraze AB
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, in version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import logging
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class _RangeSet:
+    """A set of byte ranges, kept as a sorted list of [start, end)"""
+
+    def __init__(self):
+        self.ranges = []
+
+    def add(self, start, end):
+        """Add a range, overlapping and adjacent ranges are merged"""
+        if start >= end:
+            return
+        result = []
+        for r_start, r_end in self.ranges:
+            if r_end < start or r_start > end:
+                result.append((r_start, r_end))
+            else:
+                start = min(start, r_start)
+                end = max(end, r_end)
+        result.append((start, end))
+        result.sort()
+        self.ranges = result
+
+    def remove(self, start, end):
+        """Remove a range, ranges that overlap it are cut"""
+        result = []
+        for r_start, r_end in self.ranges:
+            if r_end <= start or r_start >= end:
+                result.append((r_start, r_end))
+                continue
+            if r_start < start:
+                result.append((r_start, start))
+            if r_end > end:
+                result.append((end, r_end))
+        self.ranges = result
+
+    def contains(self, start, end):
+        """True if the whole range is in the set"""
+        for r_start, r_end in self.ranges:
+            if r_start <= start and end <= r_end:
+                return True
+        return start >= end
+
+    def clear(self):
+        self.ranges = []
+
+
+class MemoryMirror:
+    """
+    Host side copy of a part of a memory on the Crazyflie.
+
+    Writes are made to the local copy and the changed byte ranges are
+    written to the Crazyflie when flush() is called, ranges close to each
+    other are merged into one write. Only the bytes that differ from what is
+    known to be in the Crazyflie are marked as changed. Reads are answered
+    from the local copy when the range has been read or written before,
+    invalidate() forces the next read to go to the Crazyflie.
+    """
+
+    # Ranges closer than this are written as one range when flushing. A
+    # write packet has a 5 byte header so a small gap is cheaper to write
+    # than to split.
+    DEFAULT_MERGE_GAP = 8
+
+    def __init__(self, mem, addr=0, size=None,
+                 merge_gap=DEFAULT_MERGE_GAP):
+        """
+        Mirror size bytes of the memory mem, starting at addr. The whole
+        memory is mirrored if size is None.
+        """
+        self.mem = mem
+        self.addr = addr
+        if size is None:
+            size = mem.size - addr
+        self.size = size
+        self.merge_gap = merge_gap
+
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+        self._lock = Lock()
+        # Ranges, relative to addr, where the content of the Crazyflie is
+        # known and ranges changed locally but not written yet
+        self._valid = _RangeSet()
+        self._dirty = _RangeSet()
+
+        # Writes and reads in progress, {memory address: (start, end)}
+        self._writing = {}
+        self._reading = {}
+        self._flush_done_cb = None
+        self._flush_failed_cb = None
+        self._flush_failed = False
+        self._read_cbs = {}
+
+        self._handler = mem.mem_handler
+        self._handler.mem_write_cb.add_callback(self._write_done)
+        self._handler.mem_write_failed_cb.add_callback(self._write_failed)
+        self._handler.mem_read_cb.add_callback(self._read_done)
+        self._handler.mem_read_failed_cb.add_callback(self._read_failed)
+
+    def close(self):
+        """Stop tracking the reads and writes of the memory"""
+        self._handler.mem_write_cb.remove_callback(self._write_done)
+        self._handler.mem_write_failed_cb.remove_callback(self._write_failed)
+        self._handler.mem_read_cb.remove_callback(self._read_done)
+        self._handler.mem_read_failed_cb.remove_callback(self._read_failed)
+
+    def _check_range(self, offset, length):
+        if offset < 0 or length < 0 or offset + length > self.size:
+            raise Exception('Range 0x{:X}+{} is outside of the mirror'.format(
+                self.addr + offset, length))
+
+    def write(self, addr, data):
+        """
+        Write data to the local copy at the memory address addr and mark the
+        bytes that changed to be written by the next flush()
+        """
+        offset = addr - self.addr
+        data = memoryview(data).cast('B')
+        length = len(data)
+        self._check_range(offset, length)
+
+        with self._lock:
+            end = offset + length
+            if self._valid.contains(offset, end):
+                if self.view[offset:end] == data:
+                    return
+                # Only the bytes that differ need to be written
+                first = 0
+                while first < length and \
+                        self.buffer[offset + first] == data[first]:
+                    first += 1
+                last = length
+                while last > first and \
+                        self.buffer[offset + last - 1] == data[last - 1]:
+                    last -= 1
+            else:
+                first = 0
+                last = length
+
+            self.view[offset:end] = data
+            self._dirty.add(offset + first, offset + last)
+            self._valid.add(offset, end)
+
+    def dirty_ranges(self):
+        """The memory address ranges waiting to be written, [(start, end)]"""
+        with self._lock:
+            return [(self.addr + start, self.addr + end)
+                    for start, end in self._merged_dirty()]
+
+    def is_dirty(self):
+        return len(self._dirty.ranges) > 0
+
+    def _unflushed(self):
+        """Ranges changed locally that are not acknowledged by the Crazyflie"""
+        return sorted(self._dirty.ranges + list(self._writing.values()))
+
+    def _merged_dirty(self):
+        merged = []
+        for start, end in self._dirty.ranges:
+            if merged and start - merged[-1][1] <= self.merge_gap:
+                merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return merged
+
+    def flush(self, flush_done_cb=None, flush_failed_cb=None):
+        """
+        Write the changed ranges to the Crazyflie. flush_done_cb(mirror) is
+        called when all ranges have been written, or directly if nothing has
+        changed. If a range fails it is kept as changed and
+        flush_failed_cb(mirror) is called when the other writes are done.
+        """
+        with self._lock:
+            if self._writing:
+                raise Exception('Flush already ongoing')
+            ranges = self._merged_dirty()
+            self._dirty.clear()
+            self._flush_done_cb = flush_done_cb
+            self._flush_failed_cb = flush_failed_cb
+            self._flush_failed = False
+            for start, end in ranges:
+                self._writing[self.addr + start] = (start, end)
+            # Copy the ranges, the local copy may change before they are sent
+            writes = [(self.addr + start, bytes(self.view[start:end]))
+                      for start, end in ranges]
+
+        if not writes:
+            if flush_done_cb:
+                flush_done_cb(self)
+            return
+
+        for addr, data in writes:
+            logger.debug('Flushing {} bytes at 0x{:X}'.format(len(data), addr))
+            self._handler.write(self.mem, addr, data)
+
+    def _write_done(self, mem, addr):
+        self._write_finished(mem, addr, False)
+
+    def _write_failed(self, mem, addr):
+        self._write_finished(mem, addr, True)
+
+    def _write_finished(self, mem, addr, failed):
+        if mem.id != self.mem.id:
+            return
+        with self._lock:
+            written = self._writing.pop(addr, None)
+            if written is None:
+                return
+            if failed:
+                self._dirty.add(*written)
+                self._flush_failed = True
+            if self._writing:
+                return
+            if self._flush_failed:
+                cb = self._flush_failed_cb
+            else:
+                cb = self._flush_done_cb
+            self._flush_done_cb = None
+            self._flush_failed_cb = None
+
+        if cb:
+            cb(self)
+
+    def read(self, addr, length, read_done_cb, read_failed_cb=None):
+        """
+        Read length bytes at the memory address addr. The range is read from
+        the Crazyflie unless it is known from an earlier read or write, then
+        read_done_cb(mirror, addr, data) is called directly. data is a view
+        of the local copy. read_failed_cb(mirror, addr) is called if the read
+        fails.
+        """
+        offset = addr - self.addr
+        self._check_range(offset, length)
+
+        with self._lock:
+            cached = self._valid.contains(offset, offset + length)
+            if not cached:
+                if addr in self._reading:
+                    raise Exception(
+                        'Read at 0x{:X} already ongoing'.format(addr))
+                self._reading[addr] = (offset, offset + length)
+                self._read_cbs[addr] = (read_done_cb, read_failed_cb)
+
+        if cached:
+            read_done_cb(self, addr, self.view[offset:offset + length])
+        else:
+            self._handler.read(self.mem, addr, length)
+
+    def _read_done(self, mem, addr, data):
+        if mem.id != self.mem.id:
+            return
+        with self._lock:
+            read = self._reading.pop(addr, None)
+            if read is None:
+                return
+            start, end = read
+            # Keep local changes that are not written yet, or are being
+            # written
+            data = memoryview(data)
+            position = start
+            for d_start, d_end in self._unflushed() + [(end, end)]:
+                d_start = min(max(d_start, start), end)
+                if d_start > position:
+                    self.view[position:d_start] = \
+                        data[position - start:d_start - start]
+                position = max(position, min(d_end, end))
+            self._valid.add(start, end)
+            done_cb, _ = self._read_cbs.pop(addr)
+
+        done_cb(self, addr, self.view[start:end])
+
+    def _read_failed(self, mem, addr, data):
+        if mem.id != self.mem.id:
+            return
+        with self._lock:
+            if self._reading.pop(addr, None) is None:
+                return
+            _, failed_cb = self._read_cbs.pop(addr)
+
+        if failed_cb:
+            failed_cb(self, addr)
+
+    def invalidate(self, addr=None, length=None):
+        """
+        Forget the cached content of a range, or of the whole mirror if no
+        range is given, so that the next read goes to the Crazyflie. Changes
+        that are not flushed are kept.
+        """
+        with self._lock:
+            if addr is None:
+                self._valid.clear()
+            else:
+                offset = addr - self.addr
+                self._valid.remove(offset, offset + length)
+            for start, end in self._unflushed():
+                self._valid.add(start, end)
@@ -19,8 +19,10 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
+import hashlib
 import logging
-import struct
+
+import numpy as np
 
 from .memory_element import MemoryElement
 
@@ -42,9 +44,17 @@ class Poly4D:
 
 class TrajectoryMemory(MemoryElement):
     """
-    Memory interface for trajectories used by the high level commander
+    Memory interface for trajectories used by the high level commander.
+
+    The trajectory to write is set in poly4Ds, either as a list of Poly4D
+    objects or as an (N, 33) float32 array with one segment per row, in the
+    same order as in the memory of the Crazyflie: 8 coefficients each for x,
+    y, z and yaw followed by the duration.
     """
 
+    # Number of floats per segment
+    SEGMENT_LENGTH = 33
+
     def __init__(self, id, type, size, mem_handler):
         """Initialize trajectory memory"""
         super(TrajectoryMemory, self).__init__(id=id, type=type, size=size,
@@ -52,25 +62,75 @@ class TrajectoryMemory(MemoryElement):
         self._write_finished_cb = None
         self._write_failed_cb = None
 
-        # A list of Poly4D objects to write to the Crazyflie
+        # A list of Poly4D objects, or an (N, 33) array, to write to the
+        # Crazyflie
         self.poly4Ds = []
 
-    def write_data(self, write_finished_cb, write_failed_cb=None):
-        """Write trajectory data to the Crazyflie"""
-        self._write_finished_cb = write_finished_cb
-        self._write_failed_cb = write_failed_cb
-        data = bytearray()
+        # Hash of the trajectory in the memory of the Crazyflie, if known
+        self.uploaded_hash = None
+        self._pending_hash = None
+
+    @staticmethod
+    def to_array(poly4Ds):
+        """Convert a list of Poly4D objects to an (N, 33) float32 array"""
+        rows = [(*p.x.values, *p.y.values, *p.z.values, *p.yaw.values,
+                 p.duration) for p in poly4Ds]
+        return np.array(rows, dtype='<f4').reshape(
+            (len(rows), TrajectoryMemory.SEGMENT_LENGTH))
 
-        for poly4D in self.poly4Ds:
-            data += struct.pack('<ffffffff', *poly4D.x.values)
-            data += struct.pack('<ffffffff', *poly4D.y.values)
-            data += struct.pack('<ffffffff', *poly4D.z.values)
-            data += struct.pack('<ffffffff', *poly4D.yaw.values)
-            data += struct.pack('<f', poly4D.duration)
+    @staticmethod
+    def pack(poly4Ds):
+        """
+        Pack a trajectory, a list of Poly4D objects or an (N, 33) array, to
+        the format used in the memory of the Crazyflie
+        """
+        if isinstance(poly4Ds, np.ndarray):
+            array = poly4Ds
+            if array.ndim != 2 or \
+                    array.shape[1] != TrajectoryMemory.SEGMENT_LENGTH:
+                raise Exception('Trajectory must have the shape (N, {}), '
+                                'not {}'.format(
+                                    TrajectoryMemory.SEGMENT_LENGTH,
+                                    array.shape))
+        else:
+            array = TrajectoryMemory.to_array(poly4Ds)
+        return np.ascontiguousarray(array, dtype='<f4').tobytes()
 
+    @staticmethod
+    def content_hash(data):
+        """Hash of packed trajectory data"""
+        return hashlib.sha256(data).hexdigest()
+
+    def write_data(self, write_finished_cb, write_failed_cb=None,
+                   force=False):
+        """
+        Write trajectory data to the Crazyflie. If the same trajectory has
+        been written before in this connection the write is skipped and
+        write_finished_cb is called directly, unless force is True.
+        """
+        data = self.pack(self.poly4Ds)
+        data_hash = self.content_hash(data)
+
+        if not force and data_hash == self.uploaded_hash:
+            logger.debug('Trajectory already in the Crazyflie')
+            if write_finished_cb:
+                write_finished_cb(self, 0x00)
+            return
+
+        self._write_finished_cb = write_finished_cb
+        self._write_failed_cb = write_failed_cb
+        self.uploaded_hash = None
+        self._pending_hash = data_hash
         self.mem_handler.write(self, 0x00, data, flush_queue=True)
 
     def write_done(self, mem, addr):
+        if mem.id == self.id:
+            if addr == 0x00 and self._pending_hash is not None:
+                self.uploaded_hash = self._pending_hash
+                self._pending_hash = None
+            else:
+                # Other writes to the memory make the content unknown
+                self.uploaded_hash = None
         if self._write_finished_cb and mem.id == self.id:
             logger.debug('Write trajectory data done')
             self._write_finished_cb(self, addr)
@@ -79,6 +139,8 @@ class TrajectoryMemory(MemoryElement):
 
     def write_failed(self, mem, addr):
         if mem.id == self.id:
+            self.uploaded_hash = None
+            self._pending_hash = None
             if self._write_failed_cb:
                 logger.debug('Write of trajectory data failed')
                 self._write_failed_cb(self, addr)
@@ -87,3 +149,5 @@ class TrajectoryMemory(MemoryElement):
 
     def disconnect(self):
         self._write_finished_cb = None
+        self.uploaded_hash = None
+        self._pending_hash = None
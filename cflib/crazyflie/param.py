@@ -31,10 +31,13 @@ When a Crazyflie is connected it's possible to download a TableOfContent of all
 the parameters that can be written/read.
 
 """
+import collections
 import logging
 import struct
-from queue import Queue
+from threading import Condition
+from threading import Event
 from threading import Lock
+from threading import RLock
 from threading import Thread
 
 from .toc import Toc
@@ -134,26 +137,66 @@ class Param():
         self.is_updated = False
 
         self.values = {}
+        self._nbr_of_values = 0
+
+        # Opt-in cache of the parameter values, stored in the TOC cache
+        self.use_value_cache = False
+        # Parameters that are fetched from the Crazyflie also when the values
+        # are found in the cache. If empty, all parameters are fetched.
+        self.volatile_params = set()
+        self._toc_cache = None
 
     def request_update_of_all_params(self):
-        """Request an update of all the parameters in the TOC"""
+        """Request an update of all the parameters in the TOC. If the value
+        cache is used and contains the values for this TOC and Crazyflie, the
+        values are set from the cache first and all_updated is called right
+        away. The values are then fetched from the Crazyflie in the
+        background, or only the volatile parameters if there are any."""
+        if self.use_value_cache and self._load_cached_values():
+            if self.volatile_params:
+                for complete_name in self.volatile_params:
+                    if self.toc.get_element_by_complete_name(complete_name):
+                        self.request_param_update(complete_name)
+                return
+
         for group in self.toc.toc:
             for name in self.toc.toc[group]:
                 complete_name = '%s.%s' % (group, name)
                 self.request_param_update(complete_name)
 
-    def _check_if_all_updated(self):
-        """Check if all parameters from the TOC has at least been fetched
-        once"""
-        for g in self.toc.toc:
-            if g not in self.values:
-                return False
-            for n in self.toc.toc[g]:
-                if n not in self.values[g]:
+    def _load_cached_values(self):
+        """Set the values from the value cache, returns True if values were
+        found for all the parameters in the TOC"""
+        if self._toc_cache is None or self.toc.crc is None:
+            return False
+
+        cached_values = self._toc_cache.fetch_param_values(
+            self.toc.crc, self.cf.link_uri)
+        if not cached_values:
+            return False
+
+        for group in self.toc.toc:
+            for name in self.toc.toc[group]:
+                if name not in cached_values.get(group, {}):
                     return False
 
+        logger.info('Parameter values found in cache')
+        for group in self.toc.toc:
+            for name, element in self.toc.toc[group].items():
+                self._value_updated(element, cached_values[group][name])
         return True
 
+    def _store_cached_values(self):
+        if self.use_value_cache and self._toc_cache is not None and \
+                self.toc.crc is not None and self._check_if_all_updated():
+            self._toc_cache.insert_param_values(
+                self.toc.crc, self.cf.link_uri, self.values)
+
+    def _check_if_all_updated(self):
+        """Check if all parameters from the TOC has at least been fetched
+        once"""
+        return self._nbr_of_values >= self.toc.nbr_of_elements()
+
     def _param_updated(self, pk):
         """Callback with data for an updated parameter"""
         if self._useV2:
@@ -167,31 +210,40 @@ class Param():
             else:
                 s = struct.unpack(element.pytype, pk.data[1:])[0]
             s = s.__str__()
-            complete_name = '%s.%s' % (element.group, element.name)
-
-            # Save the value for synchronous access
-            if element.group not in self.values:
-                self.values[element.group] = {}
-            self.values[element.group][element.name] = s
-
-            logger.debug('Updated parameter [%s]' % complete_name)
-            if complete_name in self.param_update_callbacks:
-                self.param_update_callbacks[complete_name].call(
-                    complete_name, s)
-            if element.group in self.group_update_callbacks:
-                self.group_update_callbacks[element.group].call(
-                    complete_name, s)
-            self.all_update_callback.call(complete_name, s)
-
-            # Once all the parameters are updated call the
-            # callback for "everything updated" (after all the param
-            # updated callbacks)
-            if self._check_if_all_updated() and not self.is_updated:
-                self.is_updated = True
-                self.all_updated.call()
+            was_updated = self.is_updated
+            self._value_updated(element, s)
+            if self.is_updated and not was_updated:
+                self._store_cached_values()
         else:
             logger.debug('Variable id [%d] not found in TOC', var_id)
 
+    def _value_updated(self, element, s):
+        """Save a new value for a parameter and call the callbacks"""
+        complete_name = '%s.%s' % (element.group, element.name)
+
+        # Save the value for synchronous access
+        if element.group not in self.values:
+            self.values[element.group] = {}
+        if element.name not in self.values[element.group]:
+            self._nbr_of_values += 1
+        self.values[element.group][element.name] = s
+
+        logger.debug('Updated parameter [%s]' % complete_name)
+        if complete_name in self.param_update_callbacks:
+            self.param_update_callbacks[complete_name].call(
+                complete_name, s)
+        if element.group in self.group_update_callbacks:
+            self.group_update_callbacks[element.group].call(
+                complete_name, s)
+        self.all_update_callback.call(complete_name, s)
+
+        # Once all the parameters are updated call the
+        # callback for "everything updated" (after all the param
+        # updated callbacks)
+        if self._check_if_all_updated() and not self.is_updated:
+            self.is_updated = True
+            self.all_updated.call()
+
     def remove_update_callback(self, group, name=None, cb=None):
         """Remove the supplied callback for a group or a group.name"""
         if not cb:
@@ -227,6 +279,7 @@ class Param():
         Initiate a refresh of the parameter TOC.
         """
         self._useV2 = self.cf.platform.get_protocol_version() >= 4
+        self._toc_cache = toc_cache
         toc_fetcher = TocFetcher(self.cf, ParamTocElement,
                                  CRTPPort.PARAM, self.toc,
                                  refresh_done_callback, toc_cache)
@@ -235,10 +288,12 @@ class Param():
     def _disconnected(self, uri):
         """Disconnected callback from Crazyflie API"""
         self.param_updater.close()
+        self._store_cached_values()
         self.is_updated = False
         # Clear all values from the previous Crazyflie
         self.toc = Toc()
         self.values = {}
+        self._nbr_of_values = 0
 
     def request_param_update(self, complete_name):
         """
@@ -247,10 +302,78 @@ class Param():
         self.param_updater.request_param_update(
             self.toc.get_element_id(complete_name))
 
-    def set_value(self, complete_name, value):
+    def get_values(self, complete_names, timeout=None):
         """
-        Set the value for the supplied parameter.
+        Request an update of the values for the supplied parameters and wait
+        until all of them have been received. Returns a dict with the values
+        keyed on complete name.
+
+        Must not be called from a callback from the Crazyflie API since the
+        replies are delivered from the same thread.
         """
+        for complete_name in complete_names:
+            if not self.toc.get_element_by_complete_name(complete_name):
+                raise KeyError('{} not in param TOC'.format(complete_name))
+
+        return self._request_and_wait(
+            complete_names, self.request_param_update, timeout)
+
+    def set_values(self, values, timeout=None):
+        """
+        Set the values for the supplied parameters, values is a dict keyed on
+        complete name. Waits until all of the values have been acknowledged by
+        the Crazyflie and returns a dict with the updated values.
+
+        Must not be called from a callback from the Crazyflie API since the
+        replies are delivered from the same thread.
+        """
+        for complete_name in values:
+            self._get_writable_element(complete_name)
+
+        return self._request_and_wait(
+            values, lambda name: self.set_value(name, values[name]), timeout)
+
+    def _request_and_wait(self, complete_names, request, timeout):
+        remaining = set(complete_names)
+        # The number of finished requests per var id once the reply to our
+        # request is delivered, earlier replies are skipped
+        expected = {}
+        result = {}
+        lock = Lock()
+        done = Event()
+
+        def updated_cb(complete_name, value):
+            with lock:
+                if complete_name in remaining and complete_name in expected:
+                    var_id, finished = expected[complete_name]
+                    if self.param_updater.finished(var_id) < finished:
+                        return
+                    remaining.discard(complete_name)
+                    result[complete_name] = value
+                    if len(remaining) == 0:
+                        done.set()
+
+        if len(remaining) == 0:
+            return result
+
+        self.all_update_callback.add_callback(updated_cb)
+        try:
+            for complete_name in complete_names:
+                var_id = self.toc.get_element_id(complete_name)
+                with self.param_updater.outstanding_lock:
+                    with lock:
+                        expected[complete_name] = (
+                            var_id, self.param_updater.requested(var_id) + 1)
+                    request(complete_name)
+            if not done.wait(timeout):
+                raise Exception('Timeout while waiting for parameters: '
+                                '{}'.format(', '.join(sorted(remaining))))
+        finally:
+            self.all_update_callback.remove_callback(updated_cb)
+
+        return result
+
+    def _get_writable_element(self, complete_name):
         element = self.toc.get_element_by_complete_name(complete_name)
 
         if not element:
@@ -261,56 +384,133 @@ class Param():
             logger.debug('[%s] is read only, no trying to set value',
                          complete_name)
             raise AttributeError('{} is read-only!'.format(complete_name))
+
+        return element
+
+    def set_value(self, complete_name, value):
+        """
+        Set the value for the supplied parameter.
+        """
+        element = self._get_writable_element(complete_name)
+
+        varid = element.ident
+        pk = CRTPPacket()
+        pk.set_header(CRTPPort.PARAM, WRITE_CHANNEL)
+        if self._useV2:
+            pk.data = struct.pack('<H', varid)
         else:
-            varid = element.ident
-            pk = CRTPPacket()
-            pk.set_header(CRTPPort.PARAM, WRITE_CHANNEL)
-            if self._useV2:
-                pk.data = struct.pack('<H', varid)
-            else:
-                pk.data = struct.pack('<B', varid)
+            pk.data = struct.pack('<B', varid)
 
-            try:
-                value_nr = eval(value)
-            except TypeError:
-                value_nr = value
+        try:
+            value_nr = eval(value)
+        except TypeError:
+            value_nr = value
 
-            pk.data += struct.pack(element.pytype, value_nr)
-            self.param_updater.request_param_setvalue(pk)
+        pk.data += struct.pack(element.pytype, value_nr)
+        self.param_updater.request_param_setvalue(pk)
 
 
 class _ParamUpdater(Thread):
     """This thread will update params through a queue to make sure that we
-    get back values"""
+    get back values. Up to window_size requests are kept in flight, replies
+    are matched to the requests by var id."""
+
+    # Max number of param requests that are waiting for a reply
+    WINDOW_SIZE = 8
 
-    def __init__(self, cf, useV2, updated_callback):
+    def __init__(self, cf, useV2, updated_callback, window_size=WINDOW_SIZE):
         """Initialize the thread"""
         Thread.__init__(self)
         self.setDaemon(True)
-        self.wait_lock = Lock()
         self.cf = cf
         self._useV2 = useV2
         self.updated_callback = updated_callback
-        self.request_queue = Queue()
         self.cf.add_port_callback(CRTPPort.PARAM, self._new_packet_cb)
         self._should_close = False
-        self._req_param = -1
+        self._window_size = window_size
+        # Requests to send, in order, as (var id, packet). Only one request
+        # per var id is sent at a time since the replies can not be told
+        # apart, the others wait in the backlog of the var id.
+        self._requests = collections.deque()
+        self._backlog = {}
+        # Var ids with a request in _requests or waiting for a reply
+        self._busy = set()
+        # Var ids of the requests that are waiting for a reply
+        self._pending = set()
+        self._pending_condition = Condition()
+        # Number of requests per var id that have been queued and that have
+        # been answered or dropped
+        self._requested = {}
+        self._finished = {}
+        self.outstanding_lock = RLock()
 
     def close(self):
-        # First empty the queue from all packets
-        while not self.request_queue.empty():
-            self.request_queue.get()
-        # Then force an unlock of the mutex if we are waiting for a packet
-        # we didn't get back due to a disconnect for example.
-        try:
-            self.wait_lock.release()
-        except Exception:
-            pass
+        # Forget about the queued requests and the requests we are waiting
+        # for, we will not get the replies back due to a disconnect for
+        # example.
+        with self._pending_condition:
+            self._requests.clear()
+            self._backlog.clear()
+            self._busy.clear()
+            self._pending.clear()
+            self._pending_condition.notify_all()
+        with self.outstanding_lock:
+            self._finished.update(self._requested)
+
+    def outstanding_requests(self, var_id):
+        """Get the number of requests for a var id that have not been answered
+        yet. Replies are delivered in request order for each var id."""
+        with self.outstanding_lock:
+            return self._requested.get(var_id, 0) - \
+                self._finished.get(var_id, 0)
+
+    def requested(self, var_id):
+        """Get the number of requests that have been queued for a var id.
+        The reply to the next request is the one that makes finished()
+        reach this number plus one."""
+        return self._requested.get(var_id, 0)
+
+    def finished(self, var_id):
+        """Get the number of requests for a var id that have been answered
+        or dropped. While the updated callback is called this includes the
+        reply being delivered."""
+        return self._finished.get(var_id, 0)
+
+    def _queue_request(self, var_id, pk):
+        with self.outstanding_lock:
+            self._requested[var_id] = self._requested.get(var_id, 0) + 1
+            with self._pending_condition:
+                if var_id in self._busy:
+                    self._backlog.setdefault(
+                        var_id, collections.deque()).append(pk)
+                else:
+                    self._busy.add(var_id)
+                    self._requests.append((var_id, pk))
+                    self._pending_condition.notify_all()
+
+    def _request_done(self, var_id):
+        with self.outstanding_lock:
+            self._finished[var_id] = self._finished.get(var_id, 0) + 1
+        with self._pending_condition:
+            self._pending.discard(var_id)
+            backlog = self._backlog.get(var_id)
+            if backlog:
+                self._requests.append((var_id, backlog.popleft()))
+                if not backlog:
+                    del self._backlog[var_id]
+            else:
+                self._busy.discard(var_id)
+            self._pending_condition.notify_all()
 
     def request_param_setvalue(self, pk):
         """Place a param set value request on the queue. When this is sent to
         the Crazyflie it will answer with the update param value. """
-        self.request_queue.put(pk)
+        self._useV2 = self.cf.platform.get_protocol_version() >= 4
+        if self._useV2:
+            var_id = struct.unpack('<H', pk.data[:2])[0]
+        else:
+            var_id = pk.data[0]
+        self._queue_request(var_id, pk)
 
     def _new_packet_cb(self, pk):
         """Callback for newly arrived packets"""
@@ -321,14 +521,11 @@ class _ParamUpdater(Thread):
                     pk.data = pk.data[:2] + pk.data[3:]
             else:
                 var_id = pk.data[0]
-            if (pk.channel != TOC_CHANNEL and self._req_param == var_id and
-                    pk is not None):
+            if var_id in self._pending:
+                # Count the reply before delivering it, the callbacks are
+                # called without holding any lock
+                self._request_done(var_id)
                 self.updated_callback(pk)
-                self._req_param = -1
-                try:
-                    self.wait_lock.release()
-                except Exception:
-                    pass
 
     def request_param_update(self, var_id):
         """Place a param update request on the queue"""
@@ -340,20 +537,24 @@ class _ParamUpdater(Thread):
         else:
             pk.data = struct.pack('<B', var_id)
         logger.debug('Requesting request to update param [%d]', var_id)
-        self.request_queue.put(pk)
+        self._queue_request(var_id, pk)
 
     def run(self):
         while not self._should_close:
-            pk = self.request_queue.get()  # Wait for request update
-            self.wait_lock.acquire()
+            # Wait for a request and a free slot in the window
+            with self._pending_condition:
+                while not self._requests or \
+                        len(self._pending) >= self._window_size:
+                    self._pending_condition.wait()
+                var_id, pk = self._requests.popleft()
+                self._pending.add(var_id)
+
+            if self._useV2:
+                expected_reply = tuple(pk.data[:2])
+            else:
+                expected_reply = tuple(pk.data[:1])
+
             if self.cf.link:
-                if self._useV2:
-                    self._req_param = struct.unpack('<H', pk.data[:2])[0]
-                    self.cf.send_packet(
-                        pk, expected_reply=(tuple(pk.data[:2])))
-                else:
-                    self._req_param = pk.data[0]
-                    self.cf.send_packet(
-                        pk, expected_reply=(tuple(pk.data[:1])))
+                self.cf.send_packet(pk, expected_reply=expected_reply)
             else:
-                self.wait_lock.release()
+                self._request_done(var_id)
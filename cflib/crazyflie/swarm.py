@@ -21,10 +21,44 @@
 #  along with this program; if not, write to the Free Software
 #  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 #  MA  02110-1301, USA.
-from threading import Thread
+import collections
+import concurrent.futures
+import functools
+import itertools
+import logging
+import re
+import threading
+import time
+from threading import Event
+from threading import Lock
+from threading import Semaphore
+
+import numpy as np
 
 from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.localization import Localization
+from cflib.crazyflie.logRecorder import SwarmLogRecorder
+from cflib.crazyflie.mem import MemoryElement
+from cflib.crazyflie.mem import TrajectoryMemory
 from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
+from cflib.crtp.crtpstack import CRTPPacket
+from cflib.crtp.crtpstack import CRTPPort
+from cflib.crtp.packetqueue import PacketQueue
+from cflib.utils.histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+_DONGLE = re.compile('^radio://([0-9a-fA-F]+)/')
+
+# The swarm whose worker is running in the current thread
+_worker = threading.local()
+
+
+def _dongle(uri):
+    """The Crazyradio used by a radio URI, the URI itself for other links"""
+    match = _DONGLE.match(uri)
+    return match.group(1) if match else uri
 
 
 class _Factory:
@@ -39,15 +73,18 @@ class _Factory:
 class CachedCfFactory:
     """
     Factory class that creates Crazyflie instances with TOC caching
-    to reduce connection time.
+    to reduce connection time. Parameter values can also be cached in the
+    read-write cache by setting cache_param_values.
     """
 
-    def __init__(self, ro_cache=None, rw_cache=None):
+    def __init__(self, ro_cache=None, rw_cache=None, cache_param_values=False):
         self.ro_cache = ro_cache
         self.rw_cache = rw_cache
+        self.cache_param_values = cache_param_values
 
     def construct(self, uri):
-        cf = Crazyflie(ro_cache=self.ro_cache, rw_cache=self.rw_cache)
+        cf = Crazyflie(ro_cache=self.ro_cache, rw_cache=self.rw_cache,
+                       cache_param_values=self.cache_param_values)
         return SyncCrazyflie(uri, cf=cf)
 
 
@@ -59,6 +96,11 @@ class Swarm:
     When the swarm is connected, a link is opened to each Crazyflie through
     SyncCrazyflie instances. The instances are maintained by the class and are
     passed in as the first argument in swarm wide actions.
+
+    Parallel actions are run by a pool of worker threads, one per Crazyflie,
+    that is kept until the links are closed. A function executed in parallel
+    should not itself wait for another parallel action on the same swarm,
+    since all workers may be busy.
     """
 
     def __init__(self, uris, factory=_Factory()):
@@ -73,24 +115,114 @@ class Swarm:
         """
         self._cfs = {}
         self._is_open = False
+        self.connect_report = {}
+        self._executor = None
+        self._executor_lock = Lock()
+        self._trajectory_distributor = None
 
         for uri in uris:
             self._cfs[uri] = factory.construct(uri)
 
-    def open_links(self):
+    def open_links(self, max_concurrency=None, group_by_dongle=False,
+                   retries=0, retry_delay=0.5, retry_backoff=2.0,
+                   wait_for_params=False, param_timeout=10.0):
         """
         Open links to all individuals in the swarm
+
+        Connecting many Crazyflies at the same time over one Crazyradio can
+        saturate the radio so that connections fail. The number of
+        connections that are set up at the same time can be limited, and
+        failed connections can be retried.
+
+        :param max_concurrency: Max number of connections set up at the same
+         time, None for no limit
+        :param group_by_dongle: Apply max_concurrency to each Crazyradio
+         instead of to the whole swarm
+        :param retries: Number of times a failed connection is retried
+        :param retry_delay: Seconds to wait before the first retry
+        :param retry_backoff: Factor the delay is multiplied with for each
+         retry
+        :param wait_for_params: Count the fetching of all parameter values,
+         after the link is open, as part of the connection setup
+        :param param_timeout: Max seconds to wait for the parameter values
+        :returns: A report keyed on URI with the number of attempts, the
+         time waiting for a connection slot and the total time in seconds,
+         the duration of each setup stage (see Crazyflie.setup_timing) and
+         the error of the last failed attempt. The report is also available
+         in connect_report.
         """
         if self._is_open:
             raise Exception('Already opened')
 
+        slots = {}
+        self.connect_report = {}
+        args_dict = {}
+        for uri in self._cfs:
+            key = _dongle(uri) if group_by_dongle else None
+            if max_concurrency is not None and key not in slots:
+                slots[key] = Semaphore(max_concurrency)
+            self.connect_report[uri] = {'attempts': 0, 'wait': 0.0,
+                                        'latency': None, 'stages': {},
+                                        'error': None}
+            args_dict[uri] = [slots.get(key), self.connect_report[uri],
+                              retries, retry_delay, retry_backoff,
+                              param_timeout if wait_for_params else None]
+
         try:
-            self.parallel_safe(lambda scf: scf.open_link())
+            self.parallel_safe(self._open_link, args_dict)
             self._is_open = True
         except Exception as e:
             self.close_links()
             raise e
 
+        return self.connect_report
+
+    @staticmethod
+    def _open_link(scf, slot, report, retries, retry_delay, retry_backoff,
+                   param_timeout):
+        start = time.time()
+        delay = retry_delay
+        for attempt in range(retries + 1):
+            report['attempts'] = attempt + 1
+            if slot:
+                wait_start = time.time()
+                slot.acquire()
+                report['wait'] += time.time() - wait_start
+            try:
+                scf.open_link()
+                if param_timeout is not None:
+                    Swarm._wait_for_params(scf.cf, param_timeout)
+                break
+            except Exception as e:
+                report['error'] = str(e)
+                if attempt == retries:
+                    raise e
+                scf.close_link()
+            finally:
+                if slot:
+                    slot.release()
+            time.sleep(delay)
+            delay *= retry_backoff
+
+        report['latency'] = time.time() - start
+        cf = getattr(scf, 'cf', None)
+        if cf is not None:
+            report['stages'] = dict(cf.setup_timing)
+
+    @staticmethod
+    def _wait_for_params(cf, timeout):
+        updated = Event()
+
+        def all_updated():
+            updated.set()
+
+        cf.param.all_updated.add_callback(all_updated)
+        try:
+            if not cf.param.is_updated and not updated.wait(timeout):
+                raise Exception('Timeout while waiting for parameter values')
+        finally:
+            cf.param.all_updated.remove_callback(all_updated)
+
     def close_links(self):
         """
         Close all open links
@@ -100,6 +232,42 @@ class Swarm:
 
         self._is_open = False
 
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def extpos_publisher(self, uris=None):
+        """
+        Create an ExtposPublisher sending external positions to the
+        Crazyflies in the swarm. The rows of the poses passed to the
+        publisher are in the order of the uris, by default the order the
+        swarm was created with.
+        """
+        return ExtposPublisher(self._cfs, uris)
+
+    def log_recorder(self, log_config, capacity=100000):
+        """
+        Create a SwarmLogRecorder recording the log configuration, or list
+        of log configurations, from all Crazyflies in the swarm into one
+        time aligned buffer per log configuration.
+        """
+        return SwarmLogRecorder(self._cfs, log_config, capacity)
+
+    def upload_trajectories(self, trajectories, max_concurrency=None,
+                            group_by_dongle=True, timeout=10.0):
+        """
+        Upload trajectories to the Crazyflies in the swarm and define them in
+        the high level commander. Trajectories that are already in the
+        memory of a Crazyflie, from an earlier upload while the link has been
+        open, are not uploaded again. See TrajectoryDistributor.upload()
+        """
+        if self._trajectory_distributor is None:
+            self._trajectory_distributor = TrajectoryDistributor(self)
+        return self._trajectory_distributor.upload(
+            trajectories, max_concurrency=max_concurrency,
+            group_by_dongle=group_by_dongle, timeout=timeout)
+
     def __enter__(self):
         self.open_links()
         return self
@@ -136,63 +304,138 @@ class Swarm:
             args = self._process_args_dict(cf, uri, args_dict)
             func(*args)
 
-    def parallel(self, func, args_dict=None):
+    def parallel(self, func, args_dict=None, timeout=None):
         """
         Execute a function for all Crazyflies in the swarm, in parallel.
-        One thread per Crazyflie is started to execute the function. The
-        threads are joined at the end. Exceptions raised by the threads are
-        ignored.
+        The function is executed by the worker threads of the swarm and
+        this call waits until all are done. Exceptions raised by the
+        function are ignored.
 
-        For a description of the arguments, see sequential()
+        For a description of the arguments, see parallel_safe()
 
-        :param func:
-        :param args_dict:
+        :returns: The results keyed on URI of the Crazyflies for which the
+         function returned within the timeout without raising an exception
         """
-        try:
-            self.parallel_safe(func, args_dict)
-        except Exception:
-            pass
+        futures = self.submit_all(func, args_dict)
+        concurrent.futures.wait(futures.values(), timeout)
+        self._abandon(futures)
+        return {uri: future.result() for uri, future in futures.items()
+                if future.done() and future.exception() is None}
 
-    def parallel_safe(self, func, args_dict=None):
+    def parallel_safe(self, func, args_dict=None, timeout=None):
         """
         Execute a function for all Crazyflies in the swarm, in parallel.
-        One thread per Crazyflie is started to execute the function. The
-        threads are joined at the end and if one or more of the threads raised
-        an exception this function will also raise an exception.
+        The function is executed by the worker threads of the swarm and
+        this call waits until all are done. If the function raised an
+        exception for one or more Crazyflies, or did not return within the
+        timeout, this function will also raise an exception.
 
-        For a description of the arguments, see sequential()
+        Calls that are not done within the timeout are cancelled if they
+        have not started yet. Calls that are still running are left to
+        finish on their own and new worker threads are used for the
+        following calls.
+
+        When called from a function that is executed by the swarm, the
+        function is executed for all Crazyflies in the calling thread, one
+        at a time, since the workers of the swarm may all be busy.
 
-        :param func:
-        :param args_dict:
+        For a description of func and args_dict, see sequential()
+
+        :param func: the function to execute
+        :param args_dict: parameters to pass to the function
+        :param timeout: Max seconds to wait, None to wait until done
+        :returns: The return values of the function keyed on URI
         """
-        threads = []
-        reporter = self.Reporter()
+        futures = self.submit_all(func, args_dict)
+        try:
+            return self.wait_all(futures, timeout)
+        finally:
+            self._abandon(futures)
 
-        for uri, scf in self._cfs.items():
-            args = [func, reporter] + \
-                self._process_args_dict(scf, uri, args_dict)
+    def submit_all(self, func, args_dict=None):
+        """
+        Start executing a function for all Crazyflies in the swarm, in
+        parallel, without waiting for it to finish.
 
-            thread = Thread(target=self._thread_function_wrapper, args=args)
-            threads.append(thread)
-            thread.start()
+        For a description of the arguments, see sequential()
 
-        for thread in threads:
-            thread.join()
+        :returns: A dictionary with a concurrent.futures.Future for each
+         Crazyflie, keyed on URI
+        """
+        if getattr(_worker, 'swarm', None) is self:
+            return {uri: self._call_inline(
+                        func, self._process_args_dict(scf, uri, args_dict))
+                    for uri, scf in self._cfs.items()}
+
+        executor = self._get_executor()
+        return {uri: executor.submit(
+                    self._call_in_worker, func,
+                    self._process_args_dict(scf, uri, args_dict))
+                for uri, scf in self._cfs.items()}
+
+    @staticmethod
+    def wait_all(futures, timeout=None):
+        """
+        Wait for futures returned by submit_all() and collect the results.
+        Raises an exception if a future raised an exception or is not done
+        within the timeout.
 
-        if reporter.is_error_reported():
-            first_error = reporter.errors[0]
-            raise Exception('One or more threads raised an exception when '
-                            'executing parallel task') from first_error
+        :param futures: The futures keyed on URI
+        :param timeout: Max seconds to wait, None to wait until done
+        :returns: The results keyed on URI
+        """
+        _, not_done = concurrent.futures.wait(futures.values(), timeout)
+        if not_done:
+            uris = [uri for uri, future in futures.items()
+                    if future in not_done]
+            raise Exception('Parallel task not done within {} s for {}'.format(
+                timeout, ', '.join(uris)))
+
+        for future in futures.values():
+            error = future.exception()
+            if error is not None:
+                raise Exception('One or more threads raised an exception '
+                                'when executing parallel task') from error
+
+        return {uri: future.result() for uri, future in futures.items()}
+
+    def _call_in_worker(self, func, args):
+        _worker.swarm = self
+        try:
+            return func(*args)
+        finally:
+            _worker.swarm = None
 
-    def _thread_function_wrapper(self, *args):
-        reporter = None
+    @staticmethod
+    def _call_inline(func, args):
+        future = concurrent.futures.Future()
         try:
-            func = args[0]
-            reporter = args[1]
-            func(*args[2:])
+            future.set_result(func(*args))
         except Exception as e:
-            if reporter:
-                reporter.report_error(e)
+            future.set_exception(e)
+        return future
+
+    def _abandon(self, futures):
+        """
+        Cancel the calls that are not done. Workers that are still busy
+        with a call are left behind and a new pool is used for the next
+        calls.
+        """
+        running = [future for future in futures.values()
+                   if not future.done() and not future.cancel()]
+        if running:
+            with self._executor_lock:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                    self._executor = None
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max(1, len(self._cfs)),
+                    thread_name_prefix='Swarm')
+            return self._executor
 
     def _process_args_dict(self, scf, uri, args_dict):
         args = [scf]
@@ -202,18 +445,387 @@ class Swarm:
 
         return args
 
-    class Reporter:
-        def __init__(self):
-            self.error_reported = False
-            self._errors = []
 
-        @property
-        def errors(self):
-            return self._errors
+class ExtposPublisher:
+    """
+    Sends external positions from a motion capture system to all Crazyflies
+    in a swarm, one frame at a time.
+
+    The poses of a frame are passed as one array with one row per Crazyflie,
+    either positions (x, y, z) or poses (x, y, z, qx, qy, qz, qw). All
+    packets of the frame are packed in one pass and the sends alternate
+    between the Crazyradios so that all radios get work at the start of the
+    frame. Rows that are not finite, for instance NaN for a lost track, are
+    not sent.
+
+    The staleness of a pose is the time from the frame was captured until
+    the link driver takes the packet off its queue to send it. A newer pose
+    replaces the packet if it has not been sent yet, the replaced pose is
+    then never recorded. Links without a PacketQueue, like the simulated
+    link, record the staleness when the packet is handed to the link.
+    """
 
-        def report_error(self, e):
-            self.error_reported = True
-            self._errors.append(e)
+    def __init__(self, cfs, uris=None):
+        """
+        :param cfs: A dictionary of SyncCrazyflie instances keyed on URI
+        :param uris: The URIs in the order of the rows in the poses, by
+         default the order of cfs
+        """
+        if uris is None:
+            uris = list(cfs)
+        self.uris = list(uris)
+        self._cfs = [cfs[uri] for uri in self.uris]
+        self._order = self._interleave_dongles(self.uris)
+
+        self.staleness = LatencyHistogram()
+        # Staleness of the last sent pose of each row, NaN until it is sent
+        self.last_staleness = np.full(len(self._cfs), np.nan)
+        self.frames = 0
+        self.skipped = 0
+
+        self._lock = Lock()
+        # The packet and capture time of the pose waiting in each queue
+        self._queued = [None] * len(self._cfs)
+        # The PacketQueue of each link and its packet_taken callback
+        self._watched = [None] * len(self._cfs)
+
+    @classmethod
+    def _interleave_dongles(cls, uris):
+        """Order the rows so that consecutive sends use different radios"""
+        groups = collections.OrderedDict()
+        for row, uri in enumerate(uris):
+            groups.setdefault(_dongle(uri), []).append(row)
+        rounds = itertools.zip_longest(*groups.values())
+        return [row for row in itertools.chain(*rounds) if row is not None]
+
+    @staticmethod
+    def pack(poses):
+        """
+        Pack the data of the extpos or extpose packets for all rows of poses
+        in one pass, returns the channel and a list with the data of each
+        packet
+        """
+        poses = np.asarray(poses)
+        if poses.ndim != 2 or poses.shape[1] not in (3, 7):
+            raise Exception('Poses must be an (N, 3) or (N, 7) array')
+
+        if poses.shape[1] == 3:
+            channel = Localization.POSITION_CH
+            packed = np.ascontiguousarray(poses, dtype='<f4')
+        else:
+            channel = Localization.GENERIC_CH
+            packed = np.empty(len(poses), dtype=[('type', 'u1'),
+                                                 ('pose', '<f4', (7,))])
+            packed['type'] = Localization.EXT_POSE
+            packed['pose'] = poses
+
+        buffer = packed.tobytes()
+        size = packed.itemsize if packed.ndim == 1 else packed.strides[0]
+        return channel, [buffer[i:i + size]
+                         for i in range(0, len(buffer), size)]
+
+    def publish(self, poses, timestamp=None):
+        """
+        Send one frame of poses, one row per Crazyflie. The staleness of
+        each pose is recorded in staleness and last_staleness when it is
+        sent.
+
+        :param poses: Array of shape (N, 3) with positions or (N, 7) with
+         positions and attitude quaternions
+        :param timestamp: When the frame was captured, in time.perf_counter()
+         seconds. Defaults to now.
+        :returns: The number of poses handed to the links
+        """
+        poses = np.asarray(poses, dtype=float)
+        if len(poses) != len(self._cfs):
+            raise Exception('Expected poses for {} Crazyflies, got {}'.format(
+                len(self._cfs), len(poses)))
+        if timestamp is None:
+            timestamp = time.perf_counter()
+
+        channel, data = self.pack(poses)
+        valid = np.isfinite(poses).all(axis=1)
+        header = (CRTPPort.LOCALIZATION & 0x0F) << 4 | channel
+        sent = 0
+
+        for row in self._order:
+            if not valid[row]:
+                self.skipped += 1
+                continue
+            cf = self._cfs[row].cf
+            pk = CRTPPacket(header, data[row])
+            if self._watch(row, getattr(cf.link, 'out_queue', None)):
+                with self._lock:
+                    self._queued[row] = (pk, timestamp)
+                cf.send_packet(pk)
+            else:
+                cf.send_packet(pk)
+                self._record(row, timestamp)
+            sent += 1
+
+        self.frames += 1
+        return sent
+
+    def close(self):
+        """Stop watching the queues of the links"""
+        for row in range(len(self._cfs)):
+            self._watch(row, None)
+
+    def _watch(self, row, out_queue):
+        """
+        Watch the queue of the link of a row, returns False if the link does
+        not have a PacketQueue
+        """
+        if not isinstance(out_queue, PacketQueue):
+            out_queue = None
+        watched = self._watched[row]
+        if watched is not None and watched[0] is not out_queue:
+            watched[0].packet_taken.remove_callback(watched[1])
+            watched = self._watched[row] = None
+        if watched is None and out_queue is not None:
+            callback = functools.partial(self._packet_taken, row)
+            out_queue.packet_taken.add_callback(callback)
+            self._watched[row] = (out_queue, callback)
+        return out_queue is not None
+
+    def _packet_taken(self, row, pk, enqueued):
+        with self._lock:
+            queued = self._queued[row]
+            if queued is None or queued[0] is not pk:
+                return
+            self._queued[row] = None
+        self._record(row, queued[1])
+
+    def _record(self, row, timestamp):
+        staleness = time.perf_counter() - timestamp
+        with self._lock:
+            self.last_staleness[row] = staleness
+            self.staleness.add(staleness)
+
+
+class _TrajectoryLayout:
+    """
+    The trajectories in the trajectory memory of one Crazyflie. Writes to
+    the memory that are not made through the layout call
+    overwritten_cb(layout), since the content is no longer known.
+    """
+
+    def __init__(self, mem_handler, mem, overwritten_cb):
+        self.mem = mem
+        # {hash: (offset, n_pieces)}
+        self.entries = {}
+        self.end = 0
+        # Trajectory ids defined in the high level commander, {id: hash}
+        self.defined = {}
+        # Address of the write made by the distributor, if any
+        self.own_write = None
+
+        self._mem_handler = mem_handler
+        self._overwritten_cb = overwritten_cb
+        mem_handler.mem_write_cb.add_callback(self._write_finished)
+        mem_handler.mem_write_failed_cb.add_callback(self._write_finished)
+
+    def close(self):
+        for caller in [self._mem_handler.mem_write_cb,
+                       self._mem_handler.mem_write_failed_cb]:
+            if self._write_finished in caller.callbacks:
+                caller.remove_callback(self._write_finished)
+
+    def _write_finished(self, mem, addr):
+        if mem.id == self.mem.id and addr != self.own_write:
+            self._overwritten_cb(self)
+
+
+class TrajectoryDistributor:
+    """
+    Uploads trajectories to the Crazyflies in a swarm.
+
+    The packed trajectories are identified by a hash of their content. The
+    hashes that are in the trajectory memory of each Crazyflie, and at which
+    offset, are remembered while the link is open. Only trajectories that
+    are missing are uploaded, after the ones already in the memory, and the
+    memory is rewritten from the start when it is full. A trajectory shared
+    by many Crazyflies is packed only once.
+
+    Any other write to the trajectory memory, for instance through
+    TrajectoryMemory.write_data(), makes the distributor forget what is in
+    the memory of that Crazyflie, and the next upload starts over.
+    """
+
+    def __init__(self, swarm):
+        self._swarm = swarm
+        self._layouts = {}
+        self._lock = Lock()
 
-        def is_error_reported(self):
-            return self.error_reported
+    def forget(self, uri=None):
+        """
+        Forget what is in the trajectory memory of a Crazyflie, or of all
+        Crazyflies, so that the trajectories are uploaded again
+        """
+        with self._lock:
+            if uri is None:
+                layouts = list(self._layouts.values())
+                self._layouts = {}
+            else:
+                layouts = [self._layouts.pop(uri, None)]
+        for layout in layouts:
+            if layout is not None:
+                layout.close()
+
+    def _overwritten(self, uri, layout):
+        with self._lock:
+            if self._layouts.get(uri) is not layout:
+                return
+            del self._layouts[uri]
+        logger.debug('Trajectory memory of {} written by someone else'.format(
+            uri))
+        layout.close()
+
+    def upload(self, trajectories, max_concurrency=None,
+               group_by_dongle=True, timeout=10.0):
+        """
+        Upload trajectories and define them in the high level commander.
+
+        :param trajectories: The trajectories keyed on URI, each a dictionary
+         of trajectories keyed on trajectory id. A trajectory is a list of
+         Poly4D or an (N, 33) array, see TrajectoryMemory.
+        :param max_concurrency: Max number of uploads at the same time, None
+         for no limit
+        :param group_by_dongle: Apply max_concurrency to each Crazyradio
+         instead of to the whole swarm
+        :param timeout: Max seconds to wait for the upload to one Crazyflie
+        :returns: A report keyed on URI with the number of bytes uploaded,
+         the number of trajectories that were already in the memory, the
+         upload time in seconds and a list of stale trajectory ids
+
+        When the trajectories do not fit after the ones already in the
+        memory, the memory is written again from the start. Trajectory ids
+        that were defined by earlier uploads, but are not part of this one,
+        then point to overwritten memory. They are listed as 'stale' in the
+        report and must be uploaded again before they are used.
+        """
+        packed = {}
+        slots = {}
+        report = {}
+        args_dict = {}
+        for uri in self._swarm._cfs:
+            items = []
+            for trajectory_id, trajectory in trajectories.get(uri,
+                                                              {}).items():
+                if id(trajectory) not in packed:
+                    data = TrajectoryMemory.pack(trajectory)
+                    packed[id(trajectory)] = (
+                        TrajectoryMemory.content_hash(data), data,
+                        len(trajectory))
+                items.append((trajectory_id,) + packed[id(trajectory)])
+
+            key = _dongle(uri) if group_by_dongle else None
+            if max_concurrency is not None and key not in slots:
+                slots[key] = Semaphore(max_concurrency)
+            report[uri] = {'uploaded': 0, 'reused': 0, 'time': 0.0,
+                           'stale': []}
+            args_dict[uri] = [uri, items, slots.get(key), report[uri],
+                              timeout]
+
+        self._swarm.parallel_safe(self._upload, args_dict)
+        return report
+
+    def _upload(self, scf, uri, items, slot, report, timeout):
+        if not items:
+            return
+        start = time.time()
+        cf = scf.cf
+        mem = cf.mem.get_mems(MemoryElement.TYPE_TRAJ)[0]
+
+        with self._lock:
+            layout = self._layouts.get(uri)
+            old_layout = None
+            if layout is None or layout.mem is not mem:
+                # A new connection, or the memory has been written by
+                # someone else, the content of the memory is unknown
+                old_layout = layout
+                layout = _TrajectoryLayout(
+                    cf.mem, mem,
+                    lambda overwritten: self._overwritten(uri, overwritten))
+                self._layouts[uri] = layout
+        if old_layout is not None:
+            old_layout.close()
+
+        missing = collections.OrderedDict()
+        for _, data_hash, data, _ in items:
+            if data_hash not in layout.entries:
+                missing[data_hash] = data
+        needed = sum(len(data) for data in missing.values())
+        if layout.end + needed > mem.size:
+            # Full, start over from the beginning
+            ids = set(trajectory_id for trajectory_id, _, _, _ in items)
+            report['stale'] = sorted(trajectory_id for trajectory_id in
+                                     layout.defined if trajectory_id not in ids)
+            layout.entries = {}
+            layout.end = 0
+            layout.defined = {}
+            missing = collections.OrderedDict(
+                (data_hash, data) for _, data_hash, data, _ in items)
+            needed = sum(len(data) for data in missing.values())
+            if needed > mem.size:
+                raise Exception('Trajectories for {} do not fit in the '
+                                'trajectory memory'.format(uri))
+
+        report['reused'] = sum(1 for _, data_hash, _, _ in items
+                               if data_hash not in missing)
+        if missing:
+            offset = layout.end
+            if slot:
+                slot.acquire()
+            try:
+                self._write(cf, layout, offset, b''.join(missing.values()),
+                            timeout)
+            except Exception as e:
+                self.forget(uri)
+                raise e
+            finally:
+                if slot:
+                    slot.release()
+            for _, data_hash, _, n_pieces in items:
+                if data_hash in missing:
+                    layout.entries[data_hash] = (offset, n_pieces)
+                    offset += len(missing.pop(data_hash))
+            layout.end = offset
+            report['uploaded'] = needed
+
+        for trajectory_id, data_hash, _, n_pieces in items:
+            offset, _ = layout.entries[data_hash]
+            cf.high_level_commander.define_trajectory(trajectory_id, offset,
+                                                      n_pieces)
+            layout.defined[trajectory_id] = data_hash
+        report['time'] = time.time() - start
+
+    @staticmethod
+    def _write(cf, layout, addr, data, timeout):
+        mem = layout.mem
+        done = Event()
+        result = []
+
+        def write_done(written_mem, written_addr):
+            if written_mem.id == mem.id and written_addr == addr:
+                result.append(True)
+                done.set()
+
+        def write_failed(written_mem, written_addr):
+            if written_mem.id == mem.id and written_addr == addr:
+                result.append(False)
+                done.set()
+
+        cf.mem.mem_write_cb.add_callback(write_done)
+        cf.mem.mem_write_failed_cb.add_callback(write_failed)
+        layout.own_write = addr
+        try:
+            cf.mem.write(mem, addr, data)
+            if not done.wait(timeout):
+                raise Exception('Timeout while uploading trajectories')
+            if not result[0]:
+                raise Exception('Failed to upload trajectories')
+        finally:
+            layout.own_write = None
+            cf.mem.mem_write_cb.remove_callback(write_done)
+            cf.mem.mem_write_failed_cb.remove_callback(write_failed)
@@ -56,34 +56,62 @@ class Toc:
     """Container for TocElements."""
 
     def __init__(self):
-        self.toc = {}
+        # CRC of the TOC as reported by the Crazyflie, if known
+        self.crc = None
+        self._toc = {}
+        self._elements_by_id = []
+        self._elements_by_name = {}
 
     def clear(self):
         """Clear the TOC"""
         self.toc = {}
 
+    def _get_toc(self):
+        return self._toc
+
+    def _set_toc(self, toc):
+        """Replace the content of the TOC, for instance with a TOC loaded from
+        the cache, and rebuild the indexes"""
+        self._toc = toc
+        self._elements_by_id = []
+        self._elements_by_name = {}
+        for group in toc.values():
+            for element in group.values():
+                self._index_element(element)
+
+    toc = property(_get_toc, _set_toc)
+
+    def _index_element(self, element):
+        ident = element.ident
+        if ident >= len(self._elements_by_id):
+            self._elements_by_id.extend(
+                [None] * (ident + 1 - len(self._elements_by_id)))
+        self._elements_by_id[ident] = element
+        self._elements_by_name[
+            '%s.%s' % (element.group, element.name)] = element
+
     def add_element(self, element):
         """Add a new TocElement to the TOC container."""
         try:
-            self.toc[element.group][element.name] = element
+            self._toc[element.group][element.name] = element
         except KeyError:
-            self.toc[element.group] = {}
-            self.toc[element.group][element.name] = element
+            self._toc[element.group] = {}
+            self._toc[element.group][element.name] = element
+        self._index_element(element)
+
+    def nbr_of_elements(self):
+        """Get the number of elements in the container."""
+        return len(self._elements_by_name)
 
     def get_element_by_complete_name(self, complete_name):
         """Get a TocElement element identified by complete name from the
         container."""
-        try:
-            return self.get_element_by_id(self.get_element_id(complete_name))
-        except ValueError:
-            # Item not found
-            return None
+        return self._elements_by_name.get(complete_name)
 
     def get_element_id(self, complete_name):
         """Get the TocElement element id-number of the element with the
         supplied name."""
-        [group, name] = complete_name.split('.')
-        element = self.get_element(group, name)
+        element = self._elements_by_name.get(complete_name)
         if element:
             return element.ident
         else:
@@ -94,25 +122,30 @@ class Toc:
         """Get a TocElement element identified by name and group from the
         container."""
         try:
-            return self.toc[group][name]
+            return self._toc[group][name]
         except KeyError:
             return None
 
     def get_element_by_id(self, ident):
         """Get a TocElement element identified by index number from the
         container."""
-        for group in list(self.toc.keys()):
-            for name in list(self.toc[group].keys()):
-                if self.toc[group][name].ident == ident:
-                    return self.toc[group][name]
-        return None
+        try:
+            if ident < 0:
+                return None
+            return self._elements_by_id[ident]
+        except (IndexError, TypeError):
+            return None
 
 
 class TocFetcher:
     """Fetches TOC entries from the Crazyflie"""
 
+    # Number of TOC item requests that are kept in flight when using the V2
+    # protocol. The V1 protocol always fetches one item at a time.
+    WINDOW_SIZE = 16
+
     def __init__(self, crazyflie, element_class, port, toc_holder,
-                 finished_callback, toc_cache):
+                 finished_callback, toc_cache, window_size=WINDOW_SIZE):
         self.cf = crazyflie
         self.port = port
         self._crc = 0
@@ -124,6 +157,8 @@ class TocFetcher:
         self.finished_callback = finished_callback
         self.element_class = element_class
         self._useV2 = False
+        self._window_size = window_size
+        self._received_indexes = set()
 
     def start(self):
         """Initiate fetching of the TOC."""
@@ -168,40 +203,59 @@ class TocFetcher:
                     '<BI', payload[:5])
             logger.debug('[%d]: Got TOC CRC, %d items and crc=0x%08X',
                          self.port, self.nbr_of_items, self._crc)
+            self.toc.crc = self._crc
 
             cache_data = self._toc_cache.fetch(self._crc)
             if (cache_data):
                 self.toc.toc = cache_data
                 logger.info('TOC for port [%s] found in cache' % self.port)
                 self._toc_fetch_finished()
+            elif self.nbr_of_items == 0:
+                self._toc_cache.insert(self._crc, self.toc.toc)
+                self._toc_fetch_finished()
             else:
                 self.state = GET_TOC_ELEMENT
-                self.requested_index = 0
-                self._request_toc_element(self.requested_index)
+                self._received_indexes = set()
+                self.requested_index = -1
+
+                # Only the V2 protocol supports out of order replies, fall
+                # back to one request at a time for older firmware
+                window_size = self._window_size if self._useV2 else 1
+                for _ in range(min(window_size, self.nbr_of_items)):
+                    self._request_next_toc_element()
 
         elif (self.state == GET_TOC_ELEMENT):
-            # Always add new element, but only request new if it's not the
-            # last one.
             if self._useV2:
                 ident = struct.unpack('<H', payload[:2])[0]
             else:
                 ident = payload[0]
 
-            if ident != self.requested_index:
+            # Ignore replies we did not ask for and duplicates caused by
+            # resending of requests
+            if ident > self.requested_index or \
+                    ident in self._received_indexes:
                 return
             if self._useV2:
                 self.toc.add_element(self.element_class(ident, payload[2:]))
             else:
                 self.toc.add_element(self.element_class(ident, payload[1:]))
+            self._received_indexes.add(ident)
             logger.debug('Added element [%s]', ident)
-            if (self.requested_index < (self.nbr_of_items - 1)):
-                logger.debug('[%d]: More variables, requesting index %d',
-                             self.port, self.requested_index + 1)
-                self.requested_index = self.requested_index + 1
-                self._request_toc_element(self.requested_index)
-            else:  # No more variables in TOC
+
+            if len(self._received_indexes) == self.nbr_of_items:
+                # No more variables in TOC
+                self.state = IDLE
                 self._toc_cache.insert(self._crc, self.toc.toc)
                 self._toc_fetch_finished()
+            elif self.requested_index < (self.nbr_of_items - 1):
+                self._request_next_toc_element()
+
+    def _request_next_toc_element(self):
+        """Request the next item that has not been requested yet"""
+        self.requested_index = self.requested_index + 1
+        logger.debug('[%d]: More variables, requesting index %d',
+                     self.port, self.requested_index)
+        self._request_toc_element(self.requested_index)
 
     def _request_toc_element(self, index):
         """Request information about a specific item in the TOC"""
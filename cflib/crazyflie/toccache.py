@@ -27,20 +27,50 @@
 """
 Access the TOC cache for reading/writing. It supports both user
 cache and dist cache.
+
+TOCs are saved in a compact binary format, one file per TOC named after the
+CRC. Files in the older JSON format are still read. Decoded TOCs are kept in a
+process wide LRU cache, shared by all TocCache instances, so that the files
+only have to be parsed once when connecting to many Crazyflies.
 """
 import json
 import logging
 import os
+import re
+import struct
+import threading
+from collections import OrderedDict
 from glob import glob
 
-from .log import LogTocElement  # noqa
-from .param import ParamTocElement  # noqa
+from .log import LogTocElement
+from .param import ParamTocElement
 
 __author__ = 'Bitcraze AB'
 __all__ = ['TocCache']
 
 logger = logging.getLogger(__name__)
 
+# The TOC element classes that can be stored in the cache
+_ELEMENT_CLASSES = {
+    0: LogTocElement,
+    1: ParamTocElement,
+}
+_ELEMENT_CLASS_IDS = {cls: class_id for class_id, cls in _ELEMENT_CLASSES.items()}
+_ELEMENT_CLASS_NAMES = {cls.__name__: cls for cls in _ELEMENT_CLASSES.values()}
+
+BINARY_EXTENSION = '.toc'
+JSON_EXTENSION = '.json'
+
+# Binary format: header followed by the elements. Each element is stored as
+# ident and access followed by group, name, ctype and pytype as length
+# prefixed ISO-8859-1 strings.
+_MAGIC = b'CFTC'
+_VERSION = 1
+_HEADER = struct.Struct('<4sBBH')
+_ELEMENT = struct.Struct('<HB')
+
+_CACHE_FILE_PATTERN = re.compile(r'^([0-9A-F]{8})\.(toc|json)$')
+
 
 class TocCache():
     """
@@ -48,71 +78,195 @@ class TocCache():
     don't supply any directories.
     """
 
+    # Max number of decoded TOCs kept in memory
+    MAX_DECODED_TOCS = 16
+
+    _decoded_tocs = OrderedDict()
+    _decoded_tocs_lock = threading.Lock()
+
     def __init__(self, ro_cache=None, rw_cache=None):
         self._cache_files = []
         if (ro_cache):
-            self._cache_files += glob(ro_cache + '/*.json')
+            self._cache_files += glob(ro_cache + '/*' + JSON_EXTENSION)
+            self._cache_files += glob(ro_cache + '/*' + BINARY_EXTENSION)
         if (rw_cache):
-            self._cache_files += glob(rw_cache + '/*.json')
+            self._cache_files += glob(rw_cache + '/*' + JSON_EXTENSION)
+            self._cache_files += glob(rw_cache + '/*' + BINARY_EXTENSION)
             if not os.path.exists(rw_cache):
                 os.makedirs(rw_cache)
 
         self._rw_cache = rw_cache
 
+        # CRC -> file, binary files are preferred over JSON files
+        self._index = {}
+        for name in self._cache_files:
+            self._add_to_index(name)
+
+    def _add_to_index(self, filename):
+        match = _CACHE_FILE_PATTERN.match(os.path.basename(filename))
+        if match:
+            crc = int(match.group(1), 16)
+            current = self._index.get(crc)
+            if current is None or not current.endswith(BINARY_EXTENSION) or \
+                    filename.endswith(BINARY_EXTENSION):
+                self._index[crc] = filename
+
     def fetch(self, crc):
         """ Try to get a hit in the cache, return None otherwise """
-        cache_data = None
-        pattern = '%08X.json' % crc
-        hit = None
-
-        for name in self._cache_files:
-            if (name.endswith(pattern)):
-                hit = name
+        hit = self._index.get(crc)
+        if not hit:
+            return None
 
-        if (hit):
+        key = os.path.abspath(hit)
+        toc = self._get_decoded(key)
+        if toc is None:
             try:
-                cache = open(hit)
-                cache_data = json.load(cache,
-                                       object_hook=self._decoder)
-                cache.close()
+                if hit.endswith(BINARY_EXTENSION):
+                    toc = self._read_binary(hit)
+                else:
+                    toc = self._read_json(hit)
             except Exception as exp:
                 logger.warning('Error while parsing cache file [%s]:%s',
                                hit, str(exp))
+                return None
+            self._put_decoded(key, toc)
 
-        return cache_data
+        return self._copy(toc)
 
     def insert(self, crc, toc):
         """ Save a new cache to file """
         if self._rw_cache:
+            filename = '%s/%08X%s' % (self._rw_cache, crc, BINARY_EXTENSION)
             try:
-                filename = '%s/%08X.json' % (self._rw_cache, crc)
-                cache = open(filename, 'w')
-                cache.write(json.dumps(toc, indent=2,
-                                       default=self._encoder))
-                cache.close()
+                with open(filename, 'wb') as cache:
+                    cache.write(self._encode(toc))
                 logger.info('Saved cache to [%s]', filename)
                 self._cache_files += [filename]
+                self._index[crc] = filename
+                self._put_decoded(os.path.abspath(filename), self._copy(toc))
             except Exception as exp:
                 logger.warning('Could not save cache to file [%s]: %s',
                                filename, str(exp))
         else:
             logger.warning('Could not save cache, no writable directory')
 
-    def _encoder(self, obj):
-        """ Encode a toc element leaf-node """
-        return {'__class__': obj.__class__.__name__,
-                'ident': obj.ident,
-                'group': obj.group,
-                'name': obj.name,
-                'ctype': obj.ctype,
-                'pytype': obj.pytype,
-                'access': obj.access}
-        raise TypeError(repr(obj) + ' is not JSON serializable')
+    def _param_values_filename(self, cache_dir, crc, uri):
+        safe_uri = re.sub('[^0-9A-Za-z]+', '_', uri)
+        return '%s/%08X_%s_values.json' % (cache_dir, crc, safe_uri)
+
+    def fetch_param_values(self, crc, uri):
+        """ Get the cached parameter values for a param TOC and a Crazyflie,
+        return None if there are no values in the cache """
+        if not self._rw_cache:
+            return None
+
+        filename = self._param_values_filename(self._rw_cache, crc, uri)
+        if not os.path.exists(filename):
+            return None
+
+        try:
+            with open(filename) as cache:
+                return json.load(cache)
+        except Exception as exp:
+            logger.warning('Error while parsing cache file [%s]:%s',
+                           filename, str(exp))
+        return None
+
+    def insert_param_values(self, crc, uri, values):
+        """ Save the parameter values for a param TOC and a Crazyflie """
+        if self._rw_cache:
+            filename = self._param_values_filename(self._rw_cache, crc, uri)
+            try:
+                with open(filename, 'w') as cache:
+                    json.dump(values, cache)
+                logger.info('Saved parameter values to [%s]', filename)
+            except Exception as exp:
+                logger.warning('Could not save cache to file [%s]: %s',
+                               filename, str(exp))
+        else:
+            logger.warning('Could not save cache, no writable directory')
+
+    @classmethod
+    def _get_decoded(cls, key):
+        with cls._decoded_tocs_lock:
+            toc = cls._decoded_tocs.get(key)
+            if toc is not None:
+                cls._decoded_tocs.move_to_end(key)
+            return toc
+
+    @classmethod
+    def _put_decoded(cls, key, toc):
+        with cls._decoded_tocs_lock:
+            cls._decoded_tocs[key] = toc
+            cls._decoded_tocs.move_to_end(key)
+            while len(cls._decoded_tocs) > cls.MAX_DECODED_TOCS:
+                cls._decoded_tocs.popitem(last=False)
+
+    @classmethod
+    def clear_decoded(cls):
+        """ Forget all decoded TOCs, the files are read again on next fetch """
+        with cls._decoded_tocs_lock:
+            cls._decoded_tocs.clear()
+
+    def _copy(self, toc):
+        """ Copy the group dicts, the elements are shared since they are not
+        modified after they have been created """
+        return {group: dict(elements) for group, elements in toc.items()}
+
+    def _encode(self, toc):
+        """ Encode a TOC to the binary format """
+        elements = [element for group in toc.values()
+                    for element in group.values()]
+        class_id = 0
+        if elements:
+            class_id = _ELEMENT_CLASS_IDS[type(elements[0])]
+
+        data = bytearray(_HEADER.pack(_MAGIC, _VERSION, class_id,
+                                      len(elements)))
+        for element in elements:
+            data += _ELEMENT.pack(element.ident, element.access)
+            for text in (element.group, element.name, element.ctype,
+                         element.pytype):
+                encoded = text.encode('ISO-8859-1')
+                data.append(len(encoded))
+                data += encoded
+        return bytes(data)
+
+    def _read_binary(self, filename):
+        """ Read a TOC in the binary format """
+        with open(filename, 'rb') as cache:
+            data = cache.read()
+
+        magic, version, class_id, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION:
+            raise Exception('Unknown cache file format')
+        element_class = _ELEMENT_CLASSES[class_id]
+
+        toc = {}
+        offset = _HEADER.size
+        for _ in range(count):
+            elem = element_class()
+            elem.ident, elem.access = _ELEMENT.unpack_from(data, offset)
+            offset += _ELEMENT.size
+            texts = []
+            for _ in range(4):
+                length = data[offset]
+                texts.append(
+                    data[offset + 1:offset + 1 + length].decode('ISO-8859-1'))
+                offset += 1 + length
+            elem.group, elem.name, elem.ctype, elem.pytype = texts
+            toc.setdefault(elem.group, {})[elem.name] = elem
+        return toc
+
+    def _read_json(self, filename):
+        """ Read a TOC in the JSON format """
+        with open(filename) as cache:
+            return json.load(cache, object_hook=self._decoder)
 
     def _decoder(self, obj):
         """ Decode a toc element leaf-node """
         if '__class__' in obj:
-            elem = eval(obj['__class__'])()
+            elem = _ELEMENT_CLASS_NAMES[obj['__class__']]()
             elem.ident = obj['ident']
             elem.group = str(obj['group'])
             elem.name = str(obj['name'])
@@ -33,6 +33,7 @@ from .exceptions import WrongUriType
 from .prrtdriver import PrrtDriver
 from .radiodriver import RadioDriver
 from .serialdriver import SerialDriver
+from .simdriver import SimDriver
 from .udpdriver import UdpDriver
 from .usbdriver import UsbDriver
 
@@ -55,6 +56,10 @@ def init_drivers(enable_debug_driver=False, enable_serial_driver=False):
     def append_python():
         CLASSES.extend([RadioDriver, UsbDriver])
 
+    # The simulator and UDP drivers go first since the cflinkcpp driver does
+    # not reject URIs it does not handle
+    CLASSES.extend([SimDriver, UdpDriver])
+
     env = os.getenv('USE_CFLINK')
     if env is None:  # this is default behavior
         mach = platform.machine()  # cflinkcpp only supports x86_64
@@ -77,7 +82,7 @@ def init_drivers(enable_debug_driver=False, enable_serial_driver=False):
     if enable_serial_driver:
         CLASSES.append(SerialDriver)
 
-    CLASSES.extend([UdpDriver, PrrtDriver])
+    CLASSES.append(PrrtDriver)
 
 
 def scan_interfaces(address=None):
@@ -64,6 +64,13 @@ class CRTPDriver:
         @return One CRTP packet or None if no packet has been received.
         """
 
+    def set_downlink_period(self, period):
+        """Hint about the shortest period, in seconds, with which the
+        Crazyflie sends data without being asked, or None if it does not.
+        Drivers that poll for downlink data can use it to set their polling
+        rate.
+        """
+
     def get_status(self):
         """
         Return a status string from the interface.
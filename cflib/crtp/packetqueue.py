@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2023 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+"""
+Outgoing packet queue shared by the link drivers.
+
+Packets are put in one of four classes, each with its own depth. Setpoints
+and external positions are streams where only the latest packet is of any
+use to the Crazyflie, so a new one replaces a queued packet of the same kind
+and they are sent before other packets. All other packets, like high level
+commands and param and memory writes, are sent in the order they were
+queued.
+"""
+import collections
+import queue
+import threading
+import time
+
+from .crtpstack import CRTPPort
+from cflib.utils.callbacks import Caller
+
+__author__ = 'Bitcraze AB'
+__all__ = ['PacketQueue']
+
+DEFAULT_DEPTH = 20
+
+# Localization channels and packet types, see Localization
+_POSITION_CH = 0
+_GENERIC_CH = 1
+_EXT_POSE = 8
+
+
+class PacketQueue:
+    """
+    Bounded priority queue of outgoing CRTP packets. The depth is the max
+    number of packets in each class, put() blocks like queue.Queue.put() when
+    the class of the packet is full.
+
+    Packets in a class are taken in the order they were queued. When the
+    first packet of a class is a setpoint or an external position it is taken
+    before the packets of the other classes, in the order of the classes.
+    Other packets are taken in the order they were queued across all
+    classes, a high level takeoff never overtakes a param write that was
+    queued before it.
+
+    The packet_taken callbacks are called with the packet and the time it was
+    queued when a driver takes the packet to send it.
+    """
+
+    SETPOINT = 0
+    HIGH_LEVEL = 1
+    LOCALIZATION = 2
+    BULK = 3
+
+    CLASS_NAMES = ('setpoint', 'high_level', 'localization', 'bulk')
+
+    def __init__(self, depth=DEFAULT_DEPTH):
+        if depth < 1:
+            raise Exception('The queue depth must be at least 1')
+        self.depth = depth
+        self._queues = [collections.deque() for _ in self.CLASS_NAMES]
+        self._superseded = [0] * len(self.CLASS_NAMES)
+        self._dropped = [0] * len(self.CLASS_NAMES)
+        self._max_depth = [0] * len(self.CLASS_NAMES)
+        self._size = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self.packet_taken = Caller()
+
+    @staticmethod
+    def packet_class(pk):
+        """Get the priority class of a packet"""
+        if pk.port in (CRTPPort.COMMANDER, CRTPPort.COMMANDER_GENERIC):
+            return PacketQueue.SETPOINT
+        if pk.port == CRTPPort.SETPOINT_HL:
+            return PacketQueue.HIGH_LEVEL
+        if pk.port == CRTPPort.LOCALIZATION:
+            return PacketQueue.LOCALIZATION
+        return PacketQueue.BULK
+
+    @staticmethod
+    def _is_stream(pk):
+        """True if pk is a setpoint or an external position"""
+        if pk.port in (CRTPPort.COMMANDER, CRTPPort.COMMANDER_GENERIC):
+            # Channel 0 carries the setpoints, the other channels on the
+            # commander ports have commands that must not be dropped
+            return pk.channel == 0
+        if pk.port == CRTPPort.LOCALIZATION:
+            if pk.channel == _POSITION_CH:
+                return True
+            # The generic channel also carries emergency stops and other
+            # messages, only external poses are replaced
+            return pk.channel == _GENERIC_CH and \
+                pk.data[:1] == bytes((_EXT_POSE,))
+        return False
+
+    @staticmethod
+    def _supersedes(pk, queued):
+        """True if pk makes the queued packet useless"""
+        return pk.header == queued.header and \
+            PacketQueue._is_stream(pk) and PacketQueue._is_stream(queued)
+
+    def put(self, pk, block=True, timeout=None):
+        """
+        Queue a packet. Raises queue.Full if the class of the packet is still
+        full after the timeout, the packet is then counted as dropped.
+        """
+        packet_class = self.packet_class(pk)
+        class_queue = self._queues[packet_class]
+        with self._not_full:
+            for i, (queued, _, sequence) in enumerate(class_queue):
+                if self._supersedes(pk, queued):
+                    class_queue[i] = (pk, time.perf_counter(), sequence)
+                    self._superseded[packet_class] += 1
+                    return
+
+            if not self._not_full.wait_for(
+                    lambda: len(class_queue) < self.depth,
+                    timeout if block else 0):
+                self._dropped[packet_class] += 1
+                raise queue.Full
+
+            class_queue.append((pk, time.perf_counter(), self._sequence))
+            self._sequence += 1
+            self._max_depth[packet_class] = max(
+                self._max_depth[packet_class], len(class_queue))
+            self._size += 1
+            self._not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        """
+        Take the next packet to send, returns a tuple with the packet and
+        the time.perf_counter() when it was queued. Raises queue.Empty if no
+        packet is queued within the timeout.
+        """
+        with self._not_empty:
+            if not self._not_empty.wait_for(lambda: self._size > 0,
+                                            timeout if block else 0):
+                raise queue.Empty
+
+            first = None
+            for class_queue in self._queues:
+                if not class_queue:
+                    continue
+                if self._is_stream(class_queue[0][0]):
+                    first = class_queue
+                    break
+                if first is None or class_queue[0][2] < first[0][2]:
+                    first = class_queue
+            pk, enqueued, _ = first.popleft()
+            item = (pk, enqueued)
+            self._size -= 1
+            self._not_full.notify_all()
+
+        if self.packet_taken.callbacks:
+            self.packet_taken.call(*item)
+        return item
+
+    def empty(self):
+        return self._size == 0
+
+    def qsize(self):
+        return self._size
+
+    def clear(self):
+        """Remove all queued packets"""
+        with self._lock:
+            for class_queue in self._queues:
+                class_queue.clear()
+            self._size = 0
+            self._not_full.notify_all()
+
+    def get_statistics(self):
+        """
+        Get a dictionary keyed on class name with the current and max number
+        of queued packets and the number of superseded and dropped packets
+        for each class.
+        """
+        with self._lock:
+            return {name: {'depth': len(self._queues[i]),
+                           'max_depth': self._max_depth[i],
+                           'superseded': self._superseded[i],
+                           'dropped': self._dropped[i]}
+                    for i, name in enumerate(self.CLASS_NAMES)}
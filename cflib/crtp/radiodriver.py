@@ -33,11 +33,13 @@ USB dongle.
 import array
 import binascii
 import collections
+import itertools
 import logging
 import queue
 import re
 import struct
 import threading
+import time
 from enum import Enum
 from queue import Queue
 from threading import Semaphore
@@ -52,8 +54,11 @@ from typing import Union
 import cflib.drivers.crazyradio as crazyradio
 from .crtpstack import CRTPPacket
 from .exceptions import WrongUriType
+from .packetqueue import DEFAULT_DEPTH
+from .packetqueue import PacketQueue
 from cflib.crtp.crtpdriver import CRTPDriver
 from cflib.drivers.crazyradio import Crazyradio
+from cflib.utils.histogram import LatencyHistogram
 
 
 __author__ = 'Bitcraze AB'
@@ -67,6 +72,14 @@ _nr_of_arc_retries = 3
 DEFAULT_ADDR_A = [0xe7, 0xe7, 0xe7, 0xe7, 0xe7]
 DEFAULT_ADDR = 0xE7E7E7E7E7
 
+_DATARATES = {'250K': Crazyradio.DR_250KPS,
+              '1M': Crazyradio.DR_1MPS,
+              '2M': Crazyradio.DR_2MPS}
+
+# Number of channels scanned in one go by a radio during a scan. Links
+# sharing the radio can only send between the chunks.
+_SCAN_CHUNK = 16
+
 
 class _RadioCommands(Enum):
     STOP = 0
@@ -76,14 +89,110 @@ class _RadioCommands(Enum):
     SCAN_CHANNELS = 4
 
 
+# Priority of null packets sent by the shared radio, after the packet classes
+# of PacketQueue
+_PRIORITY_POLL = len(PacketQueue.CLASS_NAMES)
+
+
+def _packet_priority(data) -> int:
+    """Get the priority class of a raw packet sent to the radio"""
+    header = data[0]
+    if len(data) == 1 and (header & 0xF3) == 0xF3:
+        # Null packet, only sent to poll for data from the Crazyflie
+        return _PRIORITY_POLL
+    return PacketQueue.packet_class(CRTPPacket(header))
+
+
+class _LinkStatistics:
+    """Airtime statistics for one link using a shared radio"""
+
+    def __init__(self):
+        self.packets = 0
+        self.acks = 0
+        # Time spent configuring the radio and sending packets, in seconds
+        self.airtime = 0.0
+        # Time packets waited for the radio, in seconds
+        self.wait_time = 0.0
+        self.reconfigurations = 0
+
+    def as_dict(self) -> Dict[str, Union[int, float]]:
+        return {'packets': self.packets,
+                'acks': self.acks,
+                'airtime': self.airtime,
+                'wait_time': self.wait_time,
+                'reconfigurations': self.reconfigurations}
+
+
+class _PendingSend:
+    """A packet waiting to be sent by the shared radio"""
+
+    def __init__(self, sequence: int, config: Tuple, data: List[int]):
+        self.sequence = sequence
+        self.config = config
+        self.data = data
+        self.priority = _packet_priority(data)
+        self.queued_at = time.perf_counter()
+
+
+class _TdmScheduler:
+    """
+    Decides in which order the links sharing a radio are allowed to send.
+    Every link has at most one packet waiting since it waits for the ack
+    before sending the next one.
+
+    The links are served in rounds where every link sends at most once,
+    which splits the bandwidth fairly. Within a round the packets are sent
+    in the priority order of the PacketQueue classes, and null packets used
+    for polling are sent last.
+    Among packets with the same priority the ones using the current radio
+    configuration (channel, address and datarate) are sent first to avoid
+    reconfiguring the radio.
+    """
+
+    def __init__(self):
+        self._pending = {}  # type: Dict[int, _PendingSend]
+        self._served = set()
+        self._sequence = itertools.count()
+
+    def add(self, instance_id: int, config: Tuple, data: List[int]):
+        self._pending[instance_id] = _PendingSend(next(self._sequence),
+                                                  config, data)
+
+    def remove(self, instance_id: int):
+        self._pending.pop(instance_id, None)
+        self._served.discard(instance_id)
+
+    def has_pending(self) -> bool:
+        return len(self._pending) > 0
+
+    def next(self, current_config) -> Tuple[int, _PendingSend]:
+        """Remove and return the next packet to send"""
+        candidates = [i for i in self._pending if i not in self._served]
+        if not candidates:
+            # Start a new round
+            self._served.clear()
+            candidates = list(self._pending)
+
+        def order(instance_id):
+            pending = self._pending[instance_id]
+            return (pending.priority, pending.config != current_config,
+                    pending.sequence)
+
+        instance_id = min(candidates, key=order)
+        self._served.add(instance_id)
+        return instance_id, self._pending.pop(instance_id)
+
+
 class _SharedRadioInstance():
     def __init__(self, instance_id: int,
                  cmd_queue: 'Queue[Tuple[int, _RadioCommands, Any]]',
                  rsp_queue: Queue,
-                 version: float):
+                 version: float,
+                 statistics: _LinkStatistics = None):
         self._instance_id = instance_id
         self._cmd_queue = cmd_queue
         self._rsp_queue = rsp_queue
+        self.statistics = statistics
 
         self._channel = 2
         self._address = [0xe7]*5
@@ -152,8 +261,14 @@ class _SharedRadio(Thread):
 
         self._cmd_queue = Queue()  # type: Queue[Tuple[int, _RadioCommands, Any]]  # noqa
         self._rsp_queues = {}  # type: Dict[int, Queue[Any]]
+        self._statistics = {}  # type: Dict[int, _LinkStatistics]
         self._next_instance_id = 0
 
+        self._scheduler = _TdmScheduler()
+        # The (channel, address, datarate) the radio is configured with
+        self._config = None
+        self.reconfigurations = 0
+
         self._lock = Semaphore(1)
 
         self.setDaemon(True)
@@ -165,33 +280,45 @@ class _SharedRadio(Thread):
         with self._lock:
             instance_id = self._next_instance_id
             self._rsp_queues[instance_id] = rsp_queue
+            statistics = _LinkStatistics()
+            self._statistics[instance_id] = statistics
             self._next_instance_id += 1
 
             if self._radio is None:
                 self._radio = Crazyradio(devid=self._devid)
+                self._config = None
 
         return _SharedRadioInstance(instance_id,
                                     self._cmd_queue,
                                     rsp_queue,
-                                    self.version)
+                                    self.version,
+                                    statistics)
 
     def run(self):
         while True:
-            command = self._cmd_queue.get()
+            # Handle all waiting commands before sending the next packet, to
+            # have all links that want to send in the scheduler
+            if self._scheduler.has_pending():
+                try:
+                    command = self._cmd_queue.get_nowait()
+                except queue.Empty:
+                    self._send_next()
+                    continue
+            else:
+                command = self._cmd_queue.get()
 
             if command[1] == _RadioCommands.STOP:
+                self._scheduler.remove(command[0])
                 with self._lock:
                     del self._rsp_queues[command[0]]
+                    del self._statistics[command[0]]
                     if len(self._rsp_queues) == 0:
                         self._radio.close()
                         self._radio = None
             elif command[1] == _RadioCommands.SEND_PACKET:
                 channel, address, datarate, data = command[2]
-                self._radio.set_channel(channel)
-                self._radio.set_address(address)
-                self._radio.set_data_rate(datarate)
-                ack = self._radio.send_packet(data)
-                self._rsp_queues[command[0]].put(ack)
+                self._scheduler.add(
+                    command[0], (channel, tuple(address), datarate), data)
             elif command[1] == _RadioCommands.SET_ARC:
                 self._radio.set_arc(command[2])
             elif command[1] == _RadioCommands.SCAN_SELECTED:
@@ -199,14 +326,40 @@ class _SharedRadio(Thread):
                 self._radio.set_data_rate(datarate)
                 self._radio.set_address(address)
                 resp = self._radio.scan_selected(selected, data)
+                self._config = None
                 self._rsp_queues[command[0]].put(resp)
             elif command[1] == _RadioCommands.SCAN_CHANNELS:
                 datarate, address, start, stop, packet = command[2]
                 self._radio.set_data_rate(datarate)
                 self._radio.set_address(address)
                 resp = self._radio.scan_channels(start, stop, packet)
+                self._config = None
                 self._rsp_queues[command[0]].put(resp)
 
+    def _send_next(self):
+        instance_id, pending = self._scheduler.next(self._config)
+        statistics = self._statistics[instance_id]
+
+        start = time.perf_counter()
+        if pending.config != self._config:
+            channel, address, datarate = pending.config
+            self._radio.set_channel(channel)
+            self._radio.set_address(address)
+            self._radio.set_data_rate(datarate)
+            self._config = pending.config
+            self.reconfigurations += 1
+            statistics.reconfigurations += 1
+        ack = self._radio.send_packet(pending.data)
+        end = time.perf_counter()
+
+        statistics.packets += 1
+        if ack and ack.ack:
+            statistics.acks += 1
+        statistics.airtime += end - start
+        statistics.wait_time += start - pending.queued_at
+
+        self._rsp_queues[instance_id].put(ack)
+
 
 class RadioManager:
     _radios = []  # type: List[Union[_SharedRadio, None]]
@@ -246,12 +399,21 @@ class RadioDriver(CRTPDriver):
         self.out_queue = None
         self._thread = None
         self.needs_resending = True
+        self._poll_policy = _PollPolicy()
+        self.latency = {'enqueue_to_air': LatencyHistogram(),
+                        'air_to_callback': LatencyHistogram()}
 
     def connect(self, uri, link_quality_callback, link_error_callback):
         """
         Connect the link driver to a specified URI of the format:
         radio://<dongle nbr>/<radio channel>/[250K,1M,2M]
 
+        The polling of the Crazyflie for downlink data can be tuned with the
+        URI options ?poll=<adaptive|fixed>&poll_max=<ms>&poll_min=<ms>
+        &poll_backoff=<factor>, see _PollPolicy. The max number of outgoing
+        packets queued in each priority class is set with ?queue_depth=<n>,
+        see PacketQueue.
+
         The callback for linkQuality can be called at any moment from the
         driver to report back the link quality in percentage. The
         callback from linkError will be called when a error occurs with
@@ -259,6 +421,7 @@ class RadioDriver(CRTPDriver):
         """
 
         devid, channel, datarate, address = self.parse_uri(uri)
+        self._poll_policy = _PollPolicy.from_uri(uri)
         self.uri = uri
 
         if self._radio is None:
@@ -276,8 +439,10 @@ class RadioDriver(CRTPDriver):
 
         # Prepare the inter-thread communication queue
         self.in_queue = queue.Queue()
-        # Limited size out queue to avoid "ReadBack" effect
-        self.out_queue = queue.Queue(1)
+        # Setpoints are sent before other queued packets, so a deep queue
+        # for param, mem and TOC traffic does not delay them
+        self.out_queue = PacketQueue(
+            int(_uri_options(uri).get('queue_depth', DEFAULT_DEPTH)))
 
         # Launch the comm thread
         self._thread = _RadioDriverThread(self._radio,
@@ -341,21 +506,18 @@ class RadioDriver(CRTPDriver):
         Receive a packet though the link. This call is blocking but will
         timeout and return None if a timeout is supplied.
         """
-        if wait == 0:
-            try:
-                return self.in_queue.get(False)
-            except queue.Empty:
-                return None
-        elif wait < 0:
-            try:
-                return self.in_queue.get(True)
-            except queue.Empty:
-                return None
-        else:
-            try:
-                return self.in_queue.get(True, wait)
-            except queue.Empty:
-                return None
+        try:
+            if wait == 0:
+                pk, received = self.in_queue.get(False)
+            elif wait < 0:
+                pk, received = self.in_queue.get(True)
+            else:
+                pk, received = self.in_queue.get(True, wait)
+        except queue.Empty:
+            return None
+
+        self.latency['air_to_callback'].add(time.perf_counter() - received)
+        return pk
 
     def send_packet(self, pk):
         """ Send the packet pk though the link """
@@ -391,18 +553,12 @@ class RadioDriver(CRTPDriver):
             self._radio.close()
         self._radio = None
 
-        while not self.out_queue.empty():
-            self.out_queue.get()
+        self.out_queue.clear()
 
         # Clear callbacks
         self.link_error_callback = None
         self.link_quality_callback = None
 
-    def _scan_radio_channels(self, radio: _SharedRadioInstance,
-                             start=0, stop=125):
-        """ Scan for Crazyflies between the supplied channels. """
-        return list(radio.scan_channels(start, stop, (0xff,)))
-
     def scan_selected(self, links):
         to_scan = ()
         for link in links:
@@ -443,54 +599,194 @@ class RadioDriver(CRTPDriver):
 
     def scan_interface(self, address):
         """ Scan interface for Crazyflies """
+        addresses = None
+        if address is not None:
+            addresses = [address]
 
-        if self._radio is None:
+        found = list(self.scan(addresses=addresses))
+
+        # Keep the order of a scan of one datarate at a time
+        datarates = list(_DATARATES)
+
+        def order(uri):
+            parts = uri.split('/')
+            return datarates.index(parts[4]), int(parts[3]), uri
+
+        return [[uri, ''] for uri in sorted(found, key=order)]
+
+    # Recent scan results, {(datarate, address, start, stop): (time, devid,
+    # channels)}
+    _scan_cache = {}
+    _scan_cache_lock = threading.Lock()
+
+    def scan_with_callback(self, callback, addresses=None,
+                           datarates=('250K', '1M', '2M'), channels=(0, 125),
+                           devids=None, cache_ttl=0):
+        """
+        Scan for Crazyflies like scan(), and call the callback with the URI
+        of each Crazyflie as soon as it is found. Returns when the scan is
+        done.
+
+        For a description of the other arguments, see scan()
+
+        :param callback: Called with each URI found
+        :returns: The URIs found
+        """
+        found = []
+        for uri in self.scan(addresses=addresses, datarates=datarates,
+                             channels=channels, devids=devids,
+                             cache_ttl=cache_ttl):
+            callback(uri)
+            found.append(uri)
+        return found
+
+    def scan(self, addresses=None, datarates=('250K', '1M', '2M'),
+             channels=(0, 125), devids=None, cache_ttl=0):
+        """
+        Scan for Crazyflies using all attached Crazyradios in parallel. The
+        channels, datarates and addresses to scan are split in small jobs
+        that are handed out to the radios as they finish the previous job.
+
+        This is a generator yielding the URI of each Crazyflie found as soon
+        as the radio scanning it is done with the job, the URI has the
+        number of the radio that found it. Nothing is scanned until the
+        generator is iterated, use scan_with_callback() to scan without
+        iterating.
+
+        :param addresses: Addresses to scan as integers, the default
+         address if None
+        :param datarates: The datarates to scan, '250K', '1M' and/or '2M'
+        :param channels: The first and last channel to scan
+        :param devids: The Crazyradios to use, all attached radios if None
+        :param cache_ttl: Use cached results that are younger than this in
+         seconds, 0 to always scan
+        """
+        if addresses is None:
+            addresses = [DEFAULT_ADDR]
+        if devids is None:
             try:
-                self._radio = RadioManager.open(0)
+                devids = range(len(crazyradio.get_serials()))
             except Exception as e:
-                print(e)
-                return []
+                logger.warning('Cannot list Crazyradios: %s', e)
+                return
+
+        jobs = queue.Queue()
+        cached = []
+        now = time.monotonic()
+        with self._scan_cache_lock:
+            for address in addresses:
+                for datarate in datarates:
+                    for start in range(channels[0], channels[1] + 1,
+                                       _SCAN_CHUNK):
+                        stop = min(start + _SCAN_CHUNK - 1, channels[1])
+                        job = (datarate, address, start, stop)
+                        entry = self._scan_cache.get(job)
+                        if entry and now - entry[0] < cache_ttl:
+                            cached.append((job, entry[1], entry[2]))
+                        else:
+                            jobs.put(job)
+
+        results = queue.Queue()
+        workers = [Thread(target=self._scan_worker, daemon=True,
+                          args=(devid, jobs, results)) for devid in devids]
+        for worker in workers:
+            worker.start()
 
-        # FIXME: implements serial number in the Crazyradio driver!
-        serial = 'N/A'
+        try:
+            for job, devid, found in cached:
+                yield from self._scan_uris(job, devid, found)
+
+            running = len(workers)
+            while running > 0:
+                result = results.get()
+                if result is None:
+                    running -= 1
+                    continue
+                job, devid, found = result
+                with self._scan_cache_lock:
+                    self._scan_cache[job] = (time.monotonic(), devid, found)
+                yield from self._scan_uris(job, devid, found)
+        finally:
+            # Stop the workers if the caller stops early
+            while not jobs.empty():
+                try:
+                    jobs.get_nowait()
+                except queue.Empty:
+                    break
 
-        logger.info('v%s dongle with serial %s found', self._radio.version,
-                    serial)
-        found = []
+    @staticmethod
+    def _scan_uris(job, devid, found):
+        datarate, address, _, _ = job
+        for channel in found:
+            uri = 'radio://{}/{}/{}'.format(devid, channel, datarate)
+            if address != DEFAULT_ADDR:
+                uri += '/{:X}'.format(address)
+            yield uri
 
-        if address is not None:
-            # We make sure to pad the address with zeroes to get correct length
-            addr = '{:0>10X}'.format(address)
-            new_addr = struct.unpack('<BBBBB', binascii.unhexlify(addr))
-            self._radio.set_address(new_addr)
+    @staticmethod
+    def _scan_worker(devid, jobs, results):
+        """Scan jobs with one radio until there are no jobs left"""
+        try:
+            radio = RadioManager.open(devid)
+        except Exception as e:
+            logger.warning('Cannot scan with radio %d: %s', devid, e)
+            results.put(None)
+            return
+
+        try:
+            radio.set_arc(1)
+            while True:
+                try:
+                    job = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                datarate, address, start, stop = job
+                # Pad the address with zeroes to get the correct length
+                addr = '{:0>10X}'.format(address)
+                radio.set_address(
+                    struct.unpack('<BBBBB', binascii.unhexlify(addr)))
+                radio.set_data_rate(_DATARATES[datarate])
+                found = radio.scan_channels(start, stop, (0xff,))
+                results.put((job, devid, tuple(found)))
+        except Exception as e:
+            logger.warning('Scan with radio %d failed: %s', devid, e)
+        finally:
+            radio.set_arc(_nr_of_arc_retries)
+            radio.close()
+            results.put(None)
 
-        self._radio.set_arc(1)
+    def get_airtime_statistics(self):
+        """
+        Get statistics for the use of the shared radio by this link, returns
+        a dictionary with the number of packets and acks, the airtime and
+        time spent waiting for the radio in seconds and the number of times
+        the radio had to be reconfigured for this link.
+        """
+        if self._radio is None or self._radio.statistics is None:
+            return None
+        return self._radio.statistics.as_dict()
 
-        self._radio.set_data_rate(crazyradio.Crazyradio.DR_250KPS)
+    def set_downlink_period(self, period):
+        self._poll_policy.set_downlink_period(period)
 
-        if address is None or address == DEFAULT_ADDR:
-            found += [['radio://0/{}/250K'.format(c), '']
-                      for c in self._scan_radio_channels(self._radio)]
-            self._radio.set_data_rate(crazyradio.Crazyradio.DR_1MPS)
-            found += [['radio://0/{}/1M'.format(c), '']
-                      for c in self._scan_radio_channels(self._radio)]
-            self._radio.set_data_rate(crazyradio.Crazyradio.DR_2MPS)
-            found += [['radio://0/{}/2M'.format(c), '']
-                      for c in self._scan_radio_channels(self._radio)]
-        else:
-            found += [['radio://0/{}/250K/{:X}'.format(c, address), '']
-                      for c in self._scan_radio_channels(self._radio)]
-            self._radio.set_data_rate(crazyradio.Crazyradio.DR_1MPS)
-            found += [['radio://0/{}/1M/{:X}'.format(c, address), '']
-                      for c in self._scan_radio_channels(self._radio)]
-            self._radio.set_data_rate(crazyradio.Crazyradio.DR_2MPS)
-            found += [['radio://0/{}/2M/{:X}'.format(c, address), '']
-                      for c in self._scan_radio_channels(self._radio)]
-
-        self._radio.close()
-        self._radio = None
+    def get_queue_statistics(self):
+        """
+        Get the number of queued, superseded and dropped outgoing packets
+        for each priority class, see PacketQueue.get_statistics()
+        """
+        if self.out_queue is None:
+            return None
+        return self.out_queue.get_statistics()
 
-        return found
+    def get_latency_histograms(self):
+        """
+        Get histograms of the time from a packet is sent to the driver until
+        it is sent on air and from a packet is received on air until it is
+        picked up from the driver, as dictionaries keyed on
+        'enqueue_to_air' and 'air_to_callback'.
+        """
+        return {name: histogram.as_dict()
+                for name, histogram in self.latency.items()}
 
     def get_status(self):
         try:
@@ -508,6 +804,101 @@ class RadioDriver(CRTPDriver):
         return 'radio'
 
 
+def _uri_options(uri):
+    """Get the options of an URI, ?<key>=<value>&..., as a dictionary"""
+    _, _, options = uri.partition('?')
+    return dict(option.partition('=')[::2]
+                for option in filter(None, options.split('&')))
+
+
+class _PollPolicy:
+    """
+    Decides how long the radio thread waits for an outgoing packet before it
+    polls the Crazyflie for downlink data with a null packet.
+
+    In fixed mode the thread polls as fast as possible until 10 empty acks
+    have been received and then polls every max_wait. In adaptive mode the
+    wait starts at min_wait after a couple of empty acks and grows by the
+    backoff factor up to max_wait, or up to half the downlink period if the
+    Crazyflie is known to send data more often than that. Any downlink data
+    resets the wait to 0. An outgoing packet always ends the wait directly.
+    """
+
+    ADAPTIVE = 'adaptive'
+    FIXED = 'fixed'
+
+    EMPTY_BEFORE_FIXED_WAIT = 10
+    EMPTY_BEFORE_BACKOFF = 2
+
+    def __init__(self, mode=ADAPTIVE, max_wait=0.01, min_wait=0.0005,
+                 backoff=2.0):
+        if mode not in (self.ADAPTIVE, self.FIXED):
+            raise Exception('Unknown poll mode [{}]'.format(mode))
+        if min_wait <= 0 or max_wait < min_wait:
+            raise Exception('Poll wait times must be 0 < min <= max')
+        if backoff < 1:
+            raise Exception('Poll backoff must be at least 1')
+
+        self.mode = mode
+        self.max_wait = max_wait
+        self.min_wait = min_wait
+        self.backoff = backoff
+        self.downlink_period = None
+        self._empty = 0
+        self._wait = 0
+
+    @classmethod
+    def from_uri(cls, uri):
+        """
+        Create a policy from the options of a radio URI,
+        ?poll=<adaptive|fixed>&poll_max=<ms>&poll_min=<ms>&poll_backoff=<f>.
+        Other options are ignored.
+        """
+        kwargs = {}
+        for key, value in _uri_options(uri).items():
+            if key == 'poll':
+                kwargs['mode'] = value
+            elif key == 'poll_max':
+                kwargs['max_wait'] = float(value) / 1000
+            elif key == 'poll_min':
+                kwargs['min_wait'] = float(value) / 1000
+            elif key == 'poll_backoff':
+                kwargs['backoff'] = float(value)
+        return cls(**kwargs)
+
+    def set_downlink_period(self, period):
+        self.downlink_period = period
+
+    def next_wait(self, got_data: bool) -> float:
+        """Get the time to wait for an outgoing packet after an ack"""
+        if got_data:
+            self._empty = 0
+            self._wait = 0
+            return 0
+
+        self._empty += 1
+
+        if self.mode == self.FIXED:
+            if self._empty > self.EMPTY_BEFORE_FIXED_WAIT:
+                self._empty = self.EMPTY_BEFORE_FIXED_WAIT
+                return self.max_wait
+            return 0
+
+        if self._empty <= self.EMPTY_BEFORE_BACKOFF:
+            return 0
+
+        limit = self.max_wait
+        if self.downlink_period is not None:
+            limit = min(limit, self.downlink_period / 2)
+
+        if self._wait == 0:
+            self._wait = self.min_wait
+        else:
+            self._wait *= self.backoff
+        self._wait = min(self._wait, limit)
+        return self._wait
+
+
 # Transmit/receive radio thread
 class _RadioDriverThread(threading.Thread):
     """
@@ -533,6 +924,8 @@ class _RadioDriverThread(threading.Thread):
 
         self._has_safelink = False
         self._link = link
+        self._poll_policy = link._poll_policy
+        self._enqueue_to_air = link.latency['enqueue_to_air']
 
     def stop(self):
         """ Stop the thread """
@@ -564,8 +957,8 @@ class _RadioDriverThread(threading.Thread):
     def run(self):
         """ Run the receiver thread """
         dataOut = array.array('B', [0xFF])
+        enqueued = None
         waitTime = 0
-        emptyCtr = 0
         ackStatus = None
 
         # Try up to 10 times to enable the safelink mode
@@ -621,28 +1014,25 @@ class _RadioDriverThread(threading.Thread):
                 continue
             self._retry_before_disconnect = _nr_of_retries
 
+            now = time.perf_counter()
+            if enqueued is not None:
+                self._enqueue_to_air.add(now - enqueued)
+                enqueued = None
+
             data = ackStatus.data
 
             # If there is a copter in range, the packet is analysed and the
             # next packet to send is prepared
             if (len(data) > 0):
                 inPacket = CRTPPacket(data[0], list(data[1:]))
-                self._in_queue.put(inPacket)
-                waitTime = 0
-                emptyCtr = 0
-            else:
-                emptyCtr += 1
-                if (emptyCtr > 10):
-                    emptyCtr = 10
-                    # Relaxation time if the last 10 packet where empty
-                    waitTime = 0.01
-                else:
-                    waitTime = 0
+                self._in_queue.put((inPacket, now))
+            waitTime = self._poll_policy.next_wait(len(data) > 0)
 
-            # get the next packet to send of relaxation (wait 10ms)
+            # get the next packet to send, or poll with a null packet when
+            # nothing has been sent within the wait time
             outPacket = None
             try:
-                outPacket = self._out_queue.get(True, waitTime)
+                outPacket, enqueued = self._out_queue.get(True, waitTime)
             except queue.Empty:
                 outPacket = None
 
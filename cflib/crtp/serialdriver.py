@@ -35,6 +35,8 @@ import threading
 
 from .crtpstack import CRTPPacket
 from .exceptions import WrongUriType
+from .packetqueue import DEFAULT_DEPTH
+from .packetqueue import PacketQueue
 from cflib.crtp.crtpdriver import CRTPDriver
 
 found_serial = True
@@ -82,7 +84,8 @@ class SerialDriver(CRTPDriver):
             raise WrongUriType('Not a serial URI')
 
         # Check if it is a valid serial URI
-        uri_data = re.search('^serial://([-a-zA-Z0-9/.]+)$', uri)
+        uri_data = re.search(
+            '^serial://([-a-zA-Z0-9/.]+)(\\?queue_depth=([0-9]+))?$', uri)
         if not uri_data:
             raise Exception('Invalid serial URI')
 
@@ -101,7 +104,10 @@ class SerialDriver(CRTPDriver):
 
         # Prepare the inter-thread communication queue
         self.in_queue = queue.Queue()
-        self.out_queue = queue.Queue(1)
+        depth = DEFAULT_DEPTH
+        if uri_data.group(3):
+            depth = int(uri_data.group(3))
+        self.out_queue = PacketQueue(depth)
 
         self.ser = serial.Serial(device, 512000, timeout=1)
 
@@ -133,6 +139,15 @@ class SerialDriver(CRTPDriver):
             return None
         return pk
 
+    def get_queue_statistics(self):
+        """
+        Get the number of queued, superseded and dropped outgoing packets
+        for each priority class, see PacketQueue.get_statistics()
+        """
+        if self.out_queue is None:
+            return None
+        return self.out_queue.get_statistics()
+
     def get_status(self):
         return 'No information available'
 
@@ -261,7 +276,7 @@ class _SerialSendThread(threading.Thread):
 
         while not self._stop:
             try:
-                pk = self.out_queue.get(True, timeout=0.0003)
+                pk, _ = self.out_queue.get(True, timeout=0.0003)
                 data = pk.data
                 len_data = len(data)
                 end_of_payload = 5 + len_data
@@ -0,0 +1,726 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2023 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+"""
+CRTP driver for simulated Crazyflies. The driver runs in process and talks to
+a simulated firmware that answers the parts of the protocol used by the
+library when connecting, logging, setting parameters and accessing memories.
+No hardware is needed which makes it possible to test connection time, log
+throughput and swarm scaling with a large number of virtual Crazyflies.
+
+URI format: sim://<name>[?protocol=<version>][&latency=<ms>]
+"""
+import errno
+import heapq
+import itertools
+import logging
+import queue
+import re
+import struct
+import time
+import zlib
+from threading import Condition
+from threading import Lock
+from threading import Thread
+
+from .crtpdriver import CRTPDriver
+from .crtpstack import CRTPPacket
+from .crtpstack import CRTPPort
+from .exceptions import WrongUriType
+
+__author__ = 'Bitcraze AB'
+__all__ = ['SimDriver', 'SimulatedFirmware']
+
+logger = logging.getLogger(__name__)
+
+# Log and param variable types as seen by the firmware, (type id, format)
+_LOG_TYPES = {'uint8_t': (0x01, 'B'),
+              'uint16_t': (0x02, 'H'),
+              'uint32_t': (0x03, 'I'),
+              'int8_t': (0x04, 'b'),
+              'int16_t': (0x05, 'h'),
+              'int32_t': (0x06, 'i'),
+              'float': (0x07, 'f'),
+              'FP16': (0x08, 'e')}
+_LOG_FORMATS = {type_id: fmt for type_id, fmt in _LOG_TYPES.values()}
+
+_PARAM_TYPES = {'int8_t': (0x00, '<b'),
+                'int16_t': (0x01, '<h'),
+                'int32_t': (0x02, '<i'),
+                'int64_t': (0x03, '<q'),
+                'float': (0x06, '<f'),
+                'double': (0x07, '<d'),
+                'uint8_t': (0x08, '<B'),
+                'uint16_t': (0x09, '<H'),
+                'uint32_t': (0x0A, '<I'),
+                'uint64_t': (0x0B, '<Q')}
+_PARAM_RO_FLAG = 0x40
+
+# TOC commands, shared by the log and param ports
+_CMD_TOC_ELEMENT = 0
+_CMD_TOC_INFO = 1
+_CMD_TOC_ITEM_V2 = 2
+_CMD_TOC_INFO_V2 = 3
+
+# Log settings commands
+_CMD_CREATE_BLOCK = 0
+_CMD_APPEND_BLOCK = 1
+_CMD_DELETE_BLOCK = 2
+_CMD_START_LOGGING = 3
+_CMD_STOP_LOGGING = 4
+_CMD_RESET_LOGGING = 5
+_CMD_CREATE_BLOCK_V2 = 6
+_CMD_APPEND_BLOCK_V2 = 7
+
+# Memory info commands
+_CMD_INFO_VER = 0
+_CMD_INFO_NBR = 1
+_CMD_INFO_DETAILS = 2
+
+_TOC_CHANNEL = 0
+_SETTINGS_CHANNEL = 1
+_LOGDATA_CHANNEL = 2
+_READ_CHANNEL = 1
+_WRITE_CHANNEL = 2
+
+_LINK_ECHO = 0
+_LINK_SOURCE = 1
+_VERSION_COMMAND = 1
+_VERSION_GET_PROTOCOL = 0
+_VERSION_GET_FIRMWARE = 1
+
+_MEM_TYPE_TRAJ = 0x12
+_MEM_TYPE_MEMORY_TESTER = 0x15
+
+
+class _LogBlock:
+    """A log block configured in a simulated firmware"""
+
+    def __init__(self, firmware, block_id):
+        self.firmware = firmware
+        self.id = block_id
+        self.variables = []
+        self.period = 0.01
+        self.running = False
+        # Incremented on every start, used to drop stale scheduler entries
+        self.generation = 0
+        self._packer = None
+
+    def add_variable(self, fetch_type, name):
+        self.variables.append((fetch_type, name))
+        self._packer = None
+
+    def data_size(self):
+        fmt = '<' + ''.join(_LOG_FORMATS[t] for t, _ in self.variables)
+        return struct.calcsize(fmt)
+
+    def pack(self, values):
+        if self._packer is None:
+            self._packer = struct.Struct(
+                '<' + ''.join(_LOG_FORMATS[t] for t, _ in self.variables))
+        data = []
+        for fetch_type, name in self.variables:
+            value = values.get(name, 0)
+            if _LOG_FORMATS[fetch_type] in 'fe':
+                data.append(float(value))
+            else:
+                data.append(int(value))
+        return self._packer.pack(*data)
+
+
+class _LogDataScheduler(Thread):
+    """
+    Sends log data for the running log blocks of all simulated Crazyflies at
+    their configured periods. One thread is used for all blocks to make it
+    possible to simulate large swarms.
+    """
+
+    def __init__(self):
+        Thread.__init__(self)
+        self.daemon = True
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = Condition()
+
+    def schedule(self, block, deadline, generation):
+        with self._condition:
+            if not self.is_alive():
+                self.start()
+            heapq.heappush(self._heap, (deadline, next(self._sequence),
+                                        block, generation))
+            if self._heap[0][2] is block:
+                self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                deadline, _, block, generation = heapq.heappop(self._heap)
+
+            if not block.running or block.generation != generation:
+                continue
+
+            try:
+                block.firmware.send_log_data(block, deadline)
+            except Exception:  # pylint: disable=W0703
+                import traceback
+
+                logger.error('Exception while sending log data\n\n%s',
+                             traceback.format_exc())
+
+            # Keep the rate, but do not try to catch up if we are late
+            next_deadline = deadline + block.period
+            now = time.monotonic()
+            if next_deadline < now:
+                next_deadline = now + block.period
+            self.schedule(block, next_deadline, generation)
+
+
+class SimulatedFirmware:
+    """
+    A simulated Crazyflie firmware. Packets sent to the Crazyflie are passed
+    to handle_packet() and the answers are delivered to the callback set with
+    attach().
+
+    The values of the log variables are taken from log_values when log data is
+    sent and the parameter values are kept in param_values, both are keyed on
+    the complete name of the variable. Memory content is kept in memories, a
+    list of [type, bytearray] with the memory id as index.
+    """
+
+    MAX_BLOCKS = 16
+    MAX_VARIABLES = 128
+    # Log data packet: block id (1 byte) + timestamp (3 bytes) + data
+    MAX_LOG_DATA_SIZE = CRTPPacket.MAX_DATA_SIZE - 4
+    MAX_MEM_READ_SIZE = 24
+
+    FIRMWARE_VERSION = 'sim'
+
+    # (group, name, type)
+    LOG_VARIABLES = [
+        ('stabilizer', 'roll', 'float'),
+        ('stabilizer', 'pitch', 'float'),
+        ('stabilizer', 'yaw', 'float'),
+        ('stabilizer', 'thrust', 'uint16_t'),
+        ('stateEstimate', 'x', 'float'),
+        ('stateEstimate', 'y', 'float'),
+        ('stateEstimate', 'z', 'float'),
+        ('pm', 'vbat', 'float'),
+        ('pm', 'state', 'int8_t'),
+        ('radio', 'rssi', 'uint8_t'),
+        ('sys', 'canfly', 'uint8_t'),
+        ('sys', 'tick', 'uint32_t'),
+    ]
+
+    # (group, name, type, read only, default value)
+    PARAMS = [
+        ('stabilizer', 'estimator', 'uint8_t', False, 2),
+        ('stabilizer', 'controller', 'uint8_t', False, 1),
+        ('commander', 'enHighLevel', 'uint8_t', False, 0),
+        ('kalman', 'resetEstimation', 'uint8_t', False, 0),
+        ('pid_rate', 'roll_kp', 'float', False, 250.0),
+        ('pid_rate', 'pitch_kp', 'float', False, 250.0),
+        ('pid_rate', 'yaw_kp', 'float', False, 120.0),
+        ('ring', 'effect', 'uint8_t', False, 6),
+        ('ring', 'fadeTime', 'float', False, 0.5),
+        ('motorPowerSet', 'm1', 'uint16_t', False, 0),
+        ('firmware', 'revision0', 'uint32_t', True, 0x12345678),
+        ('firmware', 'modified', 'uint8_t', True, 0),
+        ('cpu', 'flash', 'uint16_t', True, 1024),
+        ('system', 'taskDump', 'int8_t', False, 0),
+    ]
+
+    # (type, size)
+    MEMORIES = [
+        (_MEM_TYPE_MEMORY_TESTER, 0x1000),
+        (_MEM_TYPE_TRAJ, 4096),
+    ]
+
+    _scheduler = None
+    _scheduler_lock = Lock()
+
+    def __init__(self, protocol_version=4, log_variables=None, params=None,
+                 memories=None):
+        """
+        Create a simulated firmware. The log variables, parameters and
+        memories default to the class attributes LOG_VARIABLES, PARAMS and
+        MEMORIES.
+        """
+        self.protocol_version = protocol_version
+
+        if log_variables is None:
+            log_variables = self.LOG_VARIABLES
+        if params is None:
+            params = self.PARAMS
+        if memories is None:
+            memories = self.MEMORIES
+
+        self._log_toc = [(group, name, _LOG_TYPES[ctype][0])
+                         for group, name, ctype in log_variables]
+        self._log_toc_crc = self._toc_crc(self._log_toc)
+        self.log_values = {}
+
+        self._param_toc = []
+        self._param_formats = []
+        self.param_values = {}
+        for group, name, ctype, read_only, default in params:
+            type_id, fmt = _PARAM_TYPES[ctype]
+            if read_only:
+                type_id |= _PARAM_RO_FLAG
+            self._param_toc.append((group, name, type_id))
+            self._param_formats.append(fmt)
+            self.param_values['%s.%s' % (group, name)] = default
+        self._param_toc_crc = self._toc_crc(self._param_toc)
+
+        self.memories = []
+        for mem_type, size in memories:
+            content = bytearray(size)
+            if mem_type == _MEM_TYPE_MEMORY_TESTER:
+                # Same test pattern as the memory tester in the firmware
+                content = bytearray(i & 0xff for i in range(size))
+            self.memories.append([mem_type, content])
+
+        self._blocks = {}
+        self._lock = Lock()
+        self._send = None
+        self._boot_time = time.monotonic()
+
+        self._handlers = {
+            CRTPPort.LINKCTRL: self._handle_link_control,
+            CRTPPort.PLATFORM: self._handle_platform,
+            CRTPPort.LOGGING: self._handle_log,
+            CRTPPort.PARAM: self._handle_param,
+            CRTPPort.MEM: self._handle_mem,
+        }
+
+    @staticmethod
+    def _toc_crc(toc):
+        crc = 0
+        for group, name, type_id in toc:
+            crc = zlib.crc32(bytes((type_id,)) + group.encode('ISO-8859-1') +
+                             b'\0' + name.encode('ISO-8859-1'), crc)
+        return crc
+
+    @classmethod
+    def _get_scheduler(cls):
+        with cls._scheduler_lock:
+            if cls._scheduler is None:
+                cls._scheduler = _LogDataScheduler()
+            return cls._scheduler
+
+    def attach(self, send):
+        """Set the callback that answers from the firmware are sent to"""
+        self._send = send
+
+    def detach(self):
+        """Stop all logging and stop sending answers"""
+        with self._lock:
+            for block in self._blocks.values():
+                block.running = False
+            self._send = None
+
+    def timestamp(self, now=None):
+        """Time since boot in ms, as sent in log data"""
+        if now is None:
+            now = time.monotonic()
+        return int((now - self._boot_time) * 1000) & 0xFFFFFF
+
+    def handle_packet(self, pk):
+        """Handle a packet sent to the Crazyflie"""
+        handler = self._handlers.get(pk.port)
+        if handler:
+            handler(pk)
+
+    def _reply(self, port, channel, data):
+        send = self._send
+        if send:
+            send(CRTPPacket((port & 0x0f) << 4 | channel, data))
+
+    def _handle_link_control(self, pk):
+        if pk.channel == _LINK_ECHO:
+            self._reply(CRTPPort.LINKCTRL, _LINK_ECHO, pk.data)
+        elif pk.channel == _LINK_SOURCE:
+            self._reply(CRTPPort.LINKCTRL, _LINK_SOURCE,
+                        b'Bitcraze Crazyflie'.ljust(
+                            CRTPPacket.MAX_DATA_SIZE, b'\0'))
+
+    def _handle_platform(self, pk):
+        if pk.channel != _VERSION_COMMAND or len(pk.data) < 1:
+            return
+        command = pk.data[0]
+        if command == _VERSION_GET_PROTOCOL:
+            self._reply(CRTPPort.PLATFORM, _VERSION_COMMAND,
+                        (_VERSION_GET_PROTOCOL, self.protocol_version))
+        elif command == _VERSION_GET_FIRMWARE:
+            self._reply(CRTPPort.PLATFORM, _VERSION_COMMAND,
+                        bytes((_VERSION_GET_FIRMWARE,)) +
+                        self.FIRMWARE_VERSION.encode('ISO-8859-1'))
+
+    def _handle_toc(self, port, toc, crc, pk, info_v1_extra=b''):
+        command = pk.data[0]
+        if command == _CMD_TOC_INFO:
+            self._reply(port, _TOC_CHANNEL,
+                        struct.pack('<BBI', command, len(toc), crc) +
+                        info_v1_extra)
+        elif command == _CMD_TOC_INFO_V2:
+            self._reply(port, _TOC_CHANNEL,
+                        struct.pack('<BHI', command, len(toc), crc) +
+                        info_v1_extra)
+        elif command == _CMD_TOC_ELEMENT or command == _CMD_TOC_ITEM_V2:
+            if command == _CMD_TOC_ELEMENT:
+                ident = pk.data[1]
+                header = struct.pack('<BB', command, ident)
+            else:
+                ident = struct.unpack('<H', pk.data[1:3])[0]
+                header = struct.pack('<BH', command, ident)
+            if ident >= len(toc):
+                return
+            group, name, type_id = toc[ident]
+            self._reply(port, _TOC_CHANNEL,
+                        header + bytes((type_id,)) +
+                        group.encode('ISO-8859-1') + b'\0' +
+                        name.encode('ISO-8859-1') + b'\0')
+
+    def _handle_log(self, pk):
+        if len(pk.data) < 1:
+            return
+        if pk.channel == _TOC_CHANNEL:
+            self._handle_toc(CRTPPort.LOGGING, self._log_toc,
+                             self._log_toc_crc, pk,
+                             bytes((self.MAX_BLOCKS, self.MAX_VARIABLES)))
+        elif pk.channel == _SETTINGS_CHANNEL:
+            command = pk.data[0]
+            block_id = pk.data[1] if len(pk.data) > 1 else 0
+            with self._lock:
+                status = self._log_settings(command, block_id, pk.data[2:])
+            if status is not None:
+                self._reply(CRTPPort.LOGGING, _SETTINGS_CHANNEL,
+                            (command, block_id, status))
+
+    def _log_settings(self, command, block_id, payload):
+        """Run a log settings command and return the status to answer"""
+        block = self._blocks.get(block_id)
+
+        if command == _CMD_CREATE_BLOCK or command == _CMD_CREATE_BLOCK_V2:
+            if block is not None:
+                return errno.EEXIST
+            if len(self._blocks) >= self.MAX_BLOCKS:
+                return errno.ENOMEM
+            block = _LogBlock(self, block_id)
+            status = self._append_variables(
+                block, payload, command == _CMD_CREATE_BLOCK_V2)
+            if status == 0:
+                self._blocks[block_id] = block
+            return status
+        elif command == _CMD_APPEND_BLOCK or command == _CMD_APPEND_BLOCK_V2:
+            if block is None:
+                return errno.ENOENT
+            return self._append_variables(
+                block, payload, command == _CMD_APPEND_BLOCK_V2)
+        elif command == _CMD_DELETE_BLOCK:
+            if block is None:
+                return errno.ENOENT
+            block.running = False
+            del self._blocks[block_id]
+            return 0
+        elif command == _CMD_START_LOGGING:
+            if block is None:
+                return errno.ENOENT
+            period = payload[0] if len(payload) > 0 else 1
+            block.period = max(period, 1) / 100.0
+            block.running = True
+            block.generation += 1
+            self._get_scheduler().schedule(
+                block, time.monotonic() + block.period, block.generation)
+            return 0
+        elif command == _CMD_STOP_LOGGING:
+            if block is None:
+                return errno.ENOENT
+            block.running = False
+            return 0
+        elif command == _CMD_RESET_LOGGING:
+            for block in self._blocks.values():
+                block.running = False
+            self._blocks = {}
+            return 0
+
+        return errno.ENOEXEC
+
+    def _append_variables(self, block, payload, use_v2):
+        """Add variables from a create/append command to a block"""
+        item_size = 3 if use_v2 else 2
+        variables = []
+        for i in range(0, len(payload) - item_size + 1, item_size):
+            fetch_type = payload[i] & 0x0f
+            if use_v2:
+                ident = payload[i + 1] | payload[i + 2] << 8
+            else:
+                ident = payload[i + 1]
+            if ident >= len(self._log_toc) or fetch_type not in _LOG_FORMATS:
+                return errno.ENOENT
+            group, name, _ = self._log_toc[ident]
+            variables.append((fetch_type, '%s.%s' % (group, name)))
+
+        nbr_of_variables = sum(len(b.variables) for b in
+                               self._blocks.values() if b is not block)
+        nbr_of_variables += len(block.variables) + len(variables)
+        if nbr_of_variables > self.MAX_VARIABLES:
+            return errno.ENOMEM
+
+        size = struct.calcsize(
+            '<' + ''.join(_LOG_FORMATS[t] for t, _ in variables))
+        if block.data_size() + size > self.MAX_LOG_DATA_SIZE:
+            return errno.E2BIG
+
+        for fetch_type, name in variables:
+            block.add_variable(fetch_type, name)
+        return 0
+
+    def send_log_data(self, block, now=None):
+        """Send one log data packet for a block, sampled at time now"""
+        data = block.pack(self.log_values)
+        self._reply(CRTPPort.LOGGING, _LOGDATA_CHANNEL,
+                    bytes((block.id,)) +
+                    self.timestamp(now).to_bytes(3, 'little') + data)
+
+    def _param_id(self, pk):
+        if self.protocol_version >= 4:
+            return struct.unpack('<H', pk.data[:2])[0], 2
+        return pk.data[0], 1
+
+    def _handle_param(self, pk):
+        if len(pk.data) < 1:
+            return
+        if pk.channel == _TOC_CHANNEL:
+            self._handle_toc(CRTPPort.PARAM, self._param_toc,
+                             self._param_toc_crc, pk)
+            return
+
+        ident, id_size = self._param_id(pk)
+        if ident >= len(self._param_toc):
+            return
+        group, name, type_id = self._param_toc[ident]
+        complete_name = '%s.%s' % (group, name)
+        fmt = self._param_formats[ident]
+
+        if pk.channel == _READ_CHANNEL:
+            value = struct.pack(fmt, self.param_values[complete_name])
+            if id_size == 2:
+                # The V2 protocol adds a status byte
+                self._reply(CRTPPort.PARAM, _READ_CHANNEL,
+                            bytes(pk.data[:2]) + b'\0' + value)
+            else:
+                self._reply(CRTPPort.PARAM, _READ_CHANNEL,
+                            bytes(pk.data[:1]) + value)
+        elif pk.channel == _WRITE_CHANNEL:
+            if type_id & _PARAM_RO_FLAG:
+                return
+            value = struct.unpack(
+                fmt, pk.data[id_size:id_size + struct.calcsize(fmt)])[0]
+            self.param_values[complete_name] = value
+            self._reply(CRTPPort.PARAM, _WRITE_CHANNEL,
+                        bytes(pk.data[:id_size]) + struct.pack(fmt, value))
+
+    def _handle_mem(self, pk):
+        if len(pk.data) < 1:
+            return
+        if pk.channel == _TOC_CHANNEL:
+            command = pk.data[0]
+            if command == _CMD_INFO_VER:
+                self._reply(CRTPPort.MEM, _TOC_CHANNEL, (command, 1))
+            elif command == _CMD_INFO_NBR:
+                self._reply(CRTPPort.MEM, _TOC_CHANNEL,
+                            (command, len(self.memories)))
+            elif command == _CMD_INFO_DETAILS and len(pk.data) > 1:
+                mem_id = pk.data[1]
+                if mem_id >= len(self.memories):
+                    self._reply(CRTPPort.MEM, _TOC_CHANNEL, (command, mem_id))
+                    return
+                mem_type, content = self.memories[mem_id]
+                self._reply(CRTPPort.MEM, _TOC_CHANNEL,
+                            struct.pack('<BBBI', command, mem_id, mem_type,
+                                        len(content)) + bytes(8))
+        elif pk.channel == _READ_CHANNEL:
+            mem_id, addr, length = struct.unpack('<BIB', pk.data[:6])
+            header = bytes(pk.data[:5])
+            if mem_id >= len(self.memories) or \
+                    length > self.MAX_MEM_READ_SIZE or \
+                    addr + length > len(self.memories[mem_id][1]):
+                self._reply(CRTPPort.MEM, _READ_CHANNEL,
+                            header + bytes((errno.EIO,)))
+                return
+            content = self.memories[mem_id][1]
+            self._reply(CRTPPort.MEM, _READ_CHANNEL,
+                        header + b'\0' + bytes(content[addr:addr + length]))
+        elif pk.channel == _WRITE_CHANNEL:
+            mem_id, addr = struct.unpack('<BI', pk.data[:5])
+            header = bytes(pk.data[:5])
+            data = pk.data[5:]
+            if mem_id >= len(self.memories) or \
+                    addr + len(data) > len(self.memories[mem_id][1]):
+                self._reply(CRTPPort.MEM, _WRITE_CHANNEL,
+                            header + bytes((errno.EIO,)))
+                return
+            self.memories[mem_id][1][addr:addr + len(data)] = data
+            self._reply(CRTPPort.MEM, _WRITE_CHANNEL, header + b'\0')
+
+
+class SimDriver(CRTPDriver):
+    """
+    Driver for simulated Crazyflies. The firmware of each simulated Crazyflie
+    is kept in the firmwares dictionary, keyed on name, and is reused when
+    reconnecting. A firmware with a custom setup can be added to the
+    dictionary before connecting, otherwise a default one is created on the
+    first connection.
+    """
+
+    firmwares = {}
+    _firmwares_lock = Lock()
+
+    def __init__(self):
+        CRTPDriver.__init__(self)
+        self.uri = ''
+        self.firmware = None
+        self.in_queue = None
+        self.latency = 0.0
+        self.link_error_callback = None
+        self.link_quality_callback = None
+
+    @staticmethod
+    def parse_uri(uri):
+        """Return the name, protocol version and latency of an URI"""
+        if not re.search('^sim://', uri):
+            raise WrongUriType('Not a sim URI')
+
+        uri_data = re.search(r'^sim://([\w\-]+)(\?(.+))?$', uri)
+        if not uri_data:
+            raise WrongUriType('Wrong sim URI format!')
+
+        name = uri_data.group(1)
+        protocol_version = 4
+        latency = 0.0
+        if uri_data.group(3):
+            for option in uri_data.group(3).split('&'):
+                key, _, value = option.partition('=')
+                if key == 'protocol':
+                    protocol_version = int(value)
+                elif key == 'latency':
+                    latency = float(value) / 1000.0
+                else:
+                    raise Exception(
+                        'Unknown sim URI option [{}]'.format(key))
+
+        return name, protocol_version, latency
+
+    def connect(self, uri, link_quality_callback, link_error_callback):
+        """
+        Connect the link driver to a simulated Crazyflie with an URI of the
+        format sim://<name>[?protocol=<version>][&latency=<ms>]. The
+        latency is the round trip time of the simulated link and is added
+        to all packets from the firmware.
+        """
+        name, protocol_version, self.latency = self.parse_uri(uri)
+        self.uri = uri
+
+        with SimDriver._firmwares_lock:
+            if name not in SimDriver.firmwares:
+                SimDriver.firmwares[name] = SimulatedFirmware(
+                    protocol_version=protocol_version)
+            self.firmware = SimDriver.firmwares[name]
+
+        self.in_queue = queue.Queue()
+        self.link_quality_callback = link_quality_callback
+        self.link_error_callback = link_error_callback
+        if self.latency > 0:
+            self.firmware.attach(self._put_delayed)
+        else:
+            self.firmware.attach(self.in_queue.put)
+
+    def _put_delayed(self, pk):
+        self.in_queue.put((time.monotonic() + self.latency, pk))
+
+    def send_packet(self, pk):
+        """ Send the packet pk to the simulated firmware """
+        if self.firmware:
+            self.firmware.handle_packet(pk)
+
+    def receive_packet(self, wait=0):
+        """
+        Receive a packet from the simulated firmware. This call is blocking
+        but will timeout and return None if a timeout is supplied.
+        """
+        try:
+            if wait == 0:
+                item = self.in_queue.get(False)
+            elif wait < 0:
+                item = self.in_queue.get(True)
+            else:
+                item = self.in_queue.get(True, wait)
+        except queue.Empty:
+            return None
+
+        if self.latency > 0:
+            # The queue is in order of delivery since the latency is fixed
+            due, item = item
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return item
+
+    def get_status(self):
+        return 'Simulated Crazyflies: {}'.format(len(SimDriver.firmwares))
+
+    def get_name(self):
+        return 'sim'
+
+    def scan_interface(self, address=None):
+        """ List the simulated Crazyflies that have been created """
+        with SimDriver._firmwares_lock:
+            return [['sim://{}'.format(name), ''] for name in
+                    SimDriver.firmwares]
+
+    def enum(self):
+        return []
+
+    def get_help(self):
+        return 'sim://<name>[?protocol=<version>][&latency=<ms>]'
+
+    def close(self):
+        """ Close the link. """
+        if self.firmware:
+            self.firmware.detach()
+        self.firmware = None
+
+        # Clear callbacks
+        self.link_error_callback = None
+        self.link_quality_callback = None
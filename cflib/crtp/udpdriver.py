@@ -24,12 +24,21 @@
 #  along with this program; if not, write to the Free Software
 #  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 #  MA  02110-1301, USA.
-""" CRTP UDP Driver. Work either with the UDP server or with an UDP device
-See udpserver.py for the protocol"""
+""" CRTP UDP Driver. Work either with the UDP server or with an UDP device.
+
+Each CRTP packet is sent as a frame with the header byte, the data and a
+checksum byte that is the sum of the header and data modulo 256. By default
+one frame is sent per datagram. With the coalesce option up to that many
+packets are sent in one datagram, each frame is then prefixed with one byte
+holding the length of the header and data.
+
+URI format: udp://<host>[:<port>][?coalesce=<packets>&queue=<size>]
+"""
+import logging
 import queue
 import re
-import struct
-from socket import socket
+import socket
+import threading
 
 from .crtpdriver import CRTPDriver
 from .crtpstack import CRTPPacket
@@ -38,66 +47,270 @@ from .exceptions import WrongUriType
 __author__ = 'Bitcraze AB'
 __all__ = ['UdpDriver']
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 7777
+DEFAULT_QUEUE_SIZE = 1000
+MAX_DATAGRAM_SIZE = 1024
+
+# Control messages used to register/unregister with the UDP server
+_CONTROL_CONNECT = b'\xFF\x01\x01\x01'
+_CONTROL_DISCONNECT = b'\xFF\x01\x02\x02'
+
+
+def _encode_frame(pk):
+    """Encode a packet as header, data and checksum"""
+    frame = bytearray((pk.header,))
+    frame += pk.data
+    frame.append(sum(frame) & 0xff)
+    return frame
+
+
+def _decode_frame(frame):
+    """Decode a frame with header, data and checksum. Returns None if the
+    frame is too short or the checksum is wrong."""
+    if len(frame) < 2 or sum(frame[:-1]) & 0xff != frame[-1]:
+        return None
+    return CRTPPacket(frame[0], bytes(frame[1:-1]))
+
+
+def _decode_datagram(data, coalesced):
+    """Decode a received datagram and return a list of packets. Frames with
+    a bad checksum are returned as None."""
+    if not coalesced:
+        return [_decode_frame(memoryview(data))]
+
+    packets = []
+    view = memoryview(data)
+    index = 0
+    while index < len(view):
+        length = view[index]
+        end = index + 2 + length
+        if end > len(view):
+            packets.append(None)
+            break
+        packets.append(_decode_frame(view[index + 1:end]))
+        index = end
+    return packets
+
 
 class UdpDriver(CRTPDriver):
+    """
+    Driver for CRTP over UDP. Received packets are read by a background
+    thread and put in a bounded queue, when the queue is full the oldest
+    packet is dropped.
+    """
 
     def __init__(self):
-        None
+        CRTPDriver.__init__(self)
+        self.uri = ''
+        self.socket = None
+        self.addr = None
+        self.in_queue = None
+        self.out_queue = None
+        self.link_error_callback = None
+        self.link_quality_callback = None
+        self._coalesce = 1
+        self._receive_thread = None
+        self._send_thread = None
+        self._stop = threading.Event()
+        self.dropped_packets = 0
+        self.checksum_errors = 0
 
-    def connect(self, uri, linkQualityCallback, linkErrorCallback):
-        # check if the URI is a radio URI
+    @staticmethod
+    def parse_uri(uri):
+        """Return the host, port, coalesce count and queue size of an URI"""
         if not re.search('^udp://', uri):
             raise WrongUriType('Not an UDP URI')
 
-        self.queue = queue.Queue()
-        self.socket = socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.addr = ('localhost', 7777)
+        uri_data = re.search(r'^udp://([\w\-\.]+)(:(\d+))?(\?(.+))?$', uri)
+        if not uri_data:
+            raise WrongUriType('Wrong UDP URI format!')
+
+        host = uri_data.group(1)
+        port = DEFAULT_PORT
+        if uri_data.group(3):
+            port = int(uri_data.group(3))
+
+        coalesce = 1
+        queue_size = DEFAULT_QUEUE_SIZE
+        if uri_data.group(5):
+            for option in uri_data.group(5).split('&'):
+                key, _, value = option.partition('=')
+                if key == 'coalesce':
+                    coalesce = int(value)
+                elif key == 'queue':
+                    queue_size = int(value)
+                else:
+                    raise Exception(
+                        'Unknown UDP URI option [{}]'.format(key))
+
+        if coalesce < 1:
+            raise Exception('coalesce must be at least 1')
+
+        return host, port, coalesce, queue_size
+
+    def connect(self, uri, link_quality_callback, link_error_callback):
+        """
+        Connect the link driver to an UDP server or device with an URI of the
+        format udp://<host>[:<port>][?coalesce=<packets>&queue=<size>]
+        """
+        host, port, self._coalesce, queue_size = self.parse_uri(uri)
+        self.uri = uri
+        self.addr = (host, port)
+
+        self.link_quality_callback = link_quality_callback
+        self.link_error_callback = link_error_callback
+
+        self.in_queue = queue.Queue(queue_size)
+        self._stop.clear()
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Timeout used to check if the receive thread should stop
+        self.socket.settimeout(0.1)
         self.socket.connect(self.addr)
 
         # Add this to the server clients list
-        self.socket.sendto('\xFF\x01\x01\x01', self.addr)
+        self.socket.send(_CONTROL_CONNECT)
+
+        self._receive_thread = threading.Thread(target=self._receive_loop,
+                                                name='UDP receive')
+        self._receive_thread.daemon = True
+        self._receive_thread.start()
+
+        if self._coalesce > 1:
+            self.out_queue = queue.Queue()
+            self._send_thread = threading.Thread(target=self._send_loop,
+                                                 name='UDP send')
+            self._send_thread.daemon = True
+            self._send_thread.start()
+
+    def _receive_loop(self):
+        coalesced = self._coalesce > 1
+        while not self._stop.is_set():
+            try:
+                data = self.socket.recv(MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if not self._stop.is_set():
+                    self._report_error('UdpDriver: {}'.format(e))
+                return
+
+            for pk in _decode_datagram(data, coalesced):
+                if pk is None:
+                    self.checksum_errors += 1
+                    continue
+                self._put_received(pk)
+
+    def _put_received(self, pk):
+        while True:
+            try:
+                self.in_queue.put_nowait(pk)
+                return
+            except queue.Full:
+                # Drop the oldest packet to keep the newest data
+                try:
+                    self.in_queue.get_nowait()
+                    self.dropped_packets += 1
+                except queue.Empty:
+                    pass
+
+    def _send_loop(self):
+        running = True
+        while running:
+            pk = self.out_queue.get()
+
+            # Add the packets that are already waiting to the same datagram
+            datagram = bytearray()
+            count = 0
+            while pk is not None:
+                frame = _encode_frame(pk)
+                datagram.append(len(frame) - 1)
+                datagram += frame
+                count += 1
+                if count >= self._coalesce or \
+                        len(datagram) + CRTPPacket.MAX_DATA_SIZE + 3 > \
+                        MAX_DATAGRAM_SIZE:
+                    break
+                try:
+                    pk = self.out_queue.get_nowait()
+                except queue.Empty:
+                    break
 
-    def receive_packet(self, time=0):
-        data, addr = self.socket.recvfrom(1024)
+            # None is put on the queue when closing
+            if pk is None:
+                running = False
 
-        if data:
-            data = struct.unpack('b' * (len(data) - 1), data[0:len(data) - 1])
-            pk = CRTPPacket()
-            pk.port = data[0]
-            pk.data = data[1:]
-            return pk
+            if datagram:
+                try:
+                    self.socket.send(datagram)
+                except OSError as e:
+                    self._report_error('UdpDriver: {}'.format(e))
 
+    def _report_error(self, message):
+        if self.link_error_callback:
+            self.link_error_callback(message)
+
+    def receive_packet(self, wait=0):
+        """
+        Receive a packet though the link. This call is blocking but will
+        timeout and return None if a timeout is supplied.
+        """
         try:
-            if time == 0:
-                return self.rxqueue.get(False)
-            elif time < 0:
-                while True:
-                    return self.rxqueue.get(True, 10)
+            if wait == 0:
+                return self.in_queue.get(False)
+            elif wait < 0:
+                return self.in_queue.get(True)
             else:
-                return self.rxqueue.get(True, time)
+                return self.in_queue.get(True, wait)
         except queue.Empty:
             return None
 
     def send_packet(self, pk):
-        raw = (pk.port,) + struct.unpack('B' * len(pk.data), pk.data)
-
-        cksum = 0
-        for i in raw:
-            cksum += i
+        """ Send the packet pk though the link """
+        if self._send_thread:
+            self.out_queue.put(pk)
+            return
 
-        cksum %= 256
+        try:
+            self.socket.send(_encode_frame(pk))
+        except OSError as e:
+            self._report_error('UdpDriver: {}'.format(e))
 
-        data = ''.join(chr(v) for v in (raw + (cksum,)))
+    def close(self):
+        """ Close the link. """
+        if self.socket is None:
+            return
 
-        # print tuple(data)
-        self.socket.sendto(data, self.addr)
+        self._stop.set()
+        if self._send_thread:
+            self.out_queue.put(None)
+            self._send_thread.join()
+            self._send_thread = None
+        self._receive_thread.join()
+        self._receive_thread = None
 
-    def close(self):
         # Remove this from the server clients list
-        self.socket.sendto('\xFF\x01\x02\x02', self.addr)
+        try:
+            self.socket.send(_CONTROL_DISCONNECT)
+        except OSError:
+            pass
+        self.socket.close()
+        self.socket = None
+
+        # Clear callbacks
+        self.link_error_callback = None
+        self.link_quality_callback = None
+
+    def get_status(self):
+        return 'No information available'
 
     def get_name(self):
         return 'udp'
 
-    def scan_interface(self, address):
+    def get_help(self):
+        return 'udp://<host>[:<port>][?coalesce=<packets>&queue=<size>]'
+
+    def scan_interface(self, address=None):
         return []
@@ -36,6 +36,8 @@ import threading
 
 from .crtpstack import CRTPPacket
 from .exceptions import WrongUriType
+from .packetqueue import DEFAULT_DEPTH
+from .packetqueue import PacketQueue
 from cflib.crtp.crtpdriver import CRTPDriver
 from cflib.drivers.cfusb import CfUsb
 
@@ -58,12 +60,13 @@ class UsbDriver(CRTPDriver):
         self.in_queue = None
         self.out_queue = None
         self._thread = None
+        self._send_thread = None
         self.needs_resending = False
 
     def connect(self, uri, link_quality_callback, link_error_callback):
         """
         Connect the link driver to a specified URI of the format:
-        radio://<dongle nbr>/<radio channel>/[250K,1M,2M]
+        usb://<device nbr>[?queue_depth=<n>]
 
         The callback for linkQuality can be called at any moment from the
         driver to report back the link quality in percentage. The
@@ -76,11 +79,11 @@ class UsbDriver(CRTPDriver):
             raise WrongUriType('Not a radio URI')
 
         # Open the USB dongle
-        if not re.search('^usb://([0-9]+)$',
+        if not re.search('^usb://([0-9]+)(\\?queue_depth=([0-9]+))?$',
                          uri):
             raise WrongUriType('Wrong radio URI format!')
 
-        uri_data = re.search('^usb://([0-9]+)$',
+        uri_data = re.search('^usb://([0-9]+)(\\?queue_depth=([0-9]+))?$',
                              uri)
 
         self.uri = uri
@@ -98,14 +101,19 @@ class UsbDriver(CRTPDriver):
 
         # Prepare the inter-thread communication queue
         self.in_queue = queue.Queue()
-        # Limited size out queue to avoid "ReadBack" effect
-        self.out_queue = queue.Queue(50)
+        depth = DEFAULT_DEPTH
+        if uri_data.group(3):
+            depth = int(uri_data.group(3))
+        self.out_queue = PacketQueue(depth)
 
-        # Launch the comm thread
+        # Launch the comm threads
         self._thread = _UsbReceiveThread(self.cfusb, self.in_queue,
                                          link_quality_callback,
                                          link_error_callback)
         self._thread.start()
+        self._send_thread = _UsbSendThread(self.cfusb, self.out_queue,
+                                           link_error_callback)
+        self._send_thread.start()
 
         self.link_error_callback = link_error_callback
 
@@ -132,15 +140,11 @@ class UsbDriver(CRTPDriver):
 
     def send_packet(self, pk):
         """ Send the packet pk though the link """
-        # if self.out_queue.full():
-        #    self.out_queue.get()
         if (self.cfusb is None):
             return
 
         try:
-            dataOut = (pk.header,)
-            dataOut += pk.datat
-            self.cfusb.send_packet(dataOut)
+            self.out_queue.put(pk, True, 2)
         except queue.Full:
             if self.link_error_callback:
                 self.link_error_callback(
@@ -149,6 +153,8 @@ class UsbDriver(CRTPDriver):
     def pause(self):
         self._thread.stop()
         self._thread = None
+        self._send_thread.stop()
+        self._send_thread = None
 
     def restart(self):
         if self._thread:
@@ -158,11 +164,18 @@ class UsbDriver(CRTPDriver):
                                          self.link_quality_callback,
                                          self.link_error_callback)
         self._thread.start()
+        self._send_thread = _UsbSendThread(self.cfusb, self.out_queue,
+                                           self.link_error_callback)
+        self._send_thread.start()
 
     def close(self):
         """ Close the link. """
-        # Stop the comm thread
+        # Stop the comm threads
         self._thread.stop()
+        if self._send_thread:
+            self._send_thread.stop()
+            self._send_thread = None
+        self.out_queue.clear()
 
         # Close the USB dongle
         try:
@@ -198,6 +211,15 @@ class UsbDriver(CRTPDriver):
 
         return found
 
+    def get_queue_statistics(self):
+        """
+        Get the number of queued, superseded and dropped outgoing packets
+        for each priority class, see PacketQueue.get_statistics()
+        """
+        if self.out_queue is None:
+            return None
+        return self.out_queue.get_statistics()
+
     def get_status(self):
         return 'No information available'
 
@@ -249,3 +271,46 @@ class _UsbReceiveThread(threading.Thread):
                     ' ,it has probably been unplugged!\n'
                     'Exception:%s\n\n%s' % (e,
                                             traceback.format_exc()))
+
+
+class _UsbSendThread(threading.Thread):
+    """
+    Thread sending the queued packets to the Crazyflie, in PacketQueue order
+    """
+
+    def __init__(self, cfusb, out_queue, link_error_callback):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.cfusb = cfusb
+        self.out_queue = out_queue
+        self.sp = False
+        self.link_error_callback = link_error_callback
+
+    def stop(self):
+        """ Stop the thread """
+        self.sp = True
+        try:
+            self.join()
+        except Exception:
+            pass
+
+    def run(self):
+        """ Run the sender thread """
+        while not self.sp:
+            try:
+                pk, _ = self.out_queue.get(True, 0.1)
+            except queue.Empty:
+                continue
+
+            try:
+                dataOut = (pk.header,)
+                dataOut += pk.datat
+                self.cfusb.send_packet(dataOut)
+            except Exception as e:
+                import traceback
+
+                self.link_error_callback(
+                    'Error communicating with the Crazyflie'
+                    ' ,it has probably been unplugged!\n'
+                    'Exception:%s\n\n%s' % (e,
+                                            traceback.format_exc()))
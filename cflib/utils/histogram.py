@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2023 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+"""
+Histogram used to record latencies in the link drivers
+"""
+import bisect
+
+__author__ = 'Bitcraze AB'
+__all__ = ['LatencyHistogram']
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies in seconds. The buckets are defined by their upper
+    limits, the last bucket holds everything above the last limit.
+    """
+
+    # 100 us to 1 s in 1-2-5 steps
+    DEFAULT_LIMITS = (0.0001, 0.0002, 0.0005,
+                      0.001, 0.002, 0.005,
+                      0.01, 0.02, 0.05,
+                      0.1, 0.2, 0.5,
+                      1.0)
+
+    def __init__(self, limits=DEFAULT_LIMITS):
+        self.limits = tuple(limits)
+        self.reset()
+
+    def reset(self):
+        """Remove all recorded values"""
+        self.counts = [0] * (len(self.limits) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        """Record one latency in seconds"""
+        self.counts[bisect.bisect_left(self.limits, latency)] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def mean(self):
+        """Mean latency in seconds, None if nothing has been recorded"""
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """
+        The upper limit of the bucket that holds the given percentile, None if
+        nothing has been recorded. The max latency is returned for the last
+        bucket.
+        """
+        if self.count == 0:
+            return None
+        needed = self.count * percent / 100.0
+        accumulated = 0
+        for limit, count in zip(self.limits, self.counts):
+            accumulated += count
+            if accumulated >= needed:
+                return limit
+        return self.max
+
+    def as_dict(self):
+        """Get the histogram as a dictionary"""
+        return {'limits': self.limits,
+                'counts': list(self.counts),
+                'count': self.count,
+                'mean': self.mean(),
+                'max': self.max}
@@ -37,6 +37,7 @@ setup(
 
     install_requires=[
         'pyusb>=1.0.0b2',
+        'numpy',
         'opencv-python-headless==4.5.1.48',
     ] + extra_required,
 
@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+#
+# ,---------,       ____  _ __
+# |  ,-^-,  |      / __ )(_) /_______________ _____  ___
+# | (  O  ) |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+# | / ,--'  |    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#    +------`   /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+# Copyright (C) 2023 Bitcraze AB
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, in version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import struct
+import time
+import unittest
+from test.support.benchmark import benchmark
+from test.support.benchmark import SimBenchmarkCase
+from threading import Event
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import cflib.crtp
+from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.mem import _ReadRequest
+from cflib.crazyflie.mem import _WriteRequest
+from cflib.crazyflie.mem import CHAN_READ
+from cflib.crazyflie.mem import CHAN_WRITE
+from cflib.crazyflie.mem import Memory
+from cflib.crazyflie.mem import MemoryElement
+from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
+from cflib.crtp.crtpstack import CRTPPacket
+from cflib.crtp.crtpstack import CRTPPort
+from cflib.crtp.simdriver import SimDriver
+from cflib.utils.callbacks import Caller
+
+
+def create_read_reply(mem_id, addr, data, status=0):
+    pk = CRTPPacket()
+    pk.set_header(CRTPPort.MEM, CHAN_READ)
+    pk.data = struct.pack('<BIB', mem_id, addr, status) + bytes(data)
+    return pk
+
+
+def create_write_reply(mem_id, addr, status=0):
+    pk = CRTPPacket()
+    pk.set_header(CRTPPort.MEM, CHAN_WRITE)
+    pk.data = struct.pack('<BIB', mem_id, addr, status)
+    return pk
+
+
+def written_chunks(cf_mock):
+    return [(struct.unpack('<I', call.args[0].data[1:5])[0],
+             bytes(call.args[0].data[5:]))
+            for call in cf_mock.send_packet.call_args_list]
+
+
+def requested_chunks(cf_mock):
+    return [struct.unpack('<BIB', call.args[0].data)[1:]
+            for call in cf_mock.send_packet.call_args_list]
+
+
+class ReadRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cf_mock = MagicMock(spec=Crazyflie)
+        self.mem = MemoryElement(id=3, type=0, size=1000, mem_handler=None)
+
+    def test_that_window_of_chunks_is_requested(self):
+        # Fixture
+        sut = _ReadRequest(self.mem, 100, 100, self.cf_mock, window=3)
+
+        # Test
+        sut.start()
+
+        # Assert
+        self.assertEqual([(100, 20), (120, 20), (140, 20)],
+                         requested_chunks(self.cf_mock))
+
+    def test_that_new_chunk_is_requested_for_each_answer(self):
+        # Fixture
+        sut = _ReadRequest(self.mem, 0, 50, self.cf_mock, window=2)
+        sut.start()
+        self.cf_mock.send_packet.reset_mock()
+
+        # Test
+        actual = sut.add_data(0, bytes(20))
+
+        # Assert
+        self.assertFalse(actual)
+        self.assertEqual([(40, 10)], requested_chunks(self.cf_mock))
+
+    def test_that_answers_out_of_order_are_put_in_place(self):
+        # Fixture
+        sut = _ReadRequest(self.mem, 10, 45, self.cf_mock, window=3)
+        sut.start()
+
+        # Test
+        sut.add_data(50, bytes(range(40, 45)))
+        sut.add_data(30, bytes(range(20, 40)))
+        actual = sut.add_data(10, bytes(range(20)))
+
+        # Assert
+        self.assertTrue(actual)
+        self.assertEqual(bytearray(range(45)), sut.data)
+        self.assertIsNotNone(sut.bytes_per_second())
+
+    def test_that_unexpected_address_is_ignored(self):
+        # Fixture
+        sut = _ReadRequest(self.mem, 0, 20, self.cf_mock, window=2)
+        sut.start()
+        sut.add_data(0, bytes(range(20)))
+
+        # Test
+        actual = sut.add_data(0, bytes(20))
+
+        # Assert
+        self.assertFalse(actual)
+        self.assertEqual(bytearray(range(20)), sut.data)
+
+    def test_that_rest_of_short_answer_is_requested(self):
+        # Fixture
+        sut = _ReadRequest(self.mem, 0, 20, self.cf_mock, window=1)
+        sut.start()
+        self.cf_mock.send_packet.reset_mock()
+
+        # Test
+        actual = sut.add_data(0, bytes(15))
+
+        # Assert
+        self.assertFalse(actual)
+        self.assertEqual([(15, 5)], requested_chunks(self.cf_mock))
+
+
+class MemoryReadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cf_mock = MagicMock(spec=Crazyflie)
+        self.cf_mock.disconnected = Caller()
+        self.sut = Memory(self.cf_mock)
+        self.mem = MemoryElement(id=3, type=0, size=1000,
+                                 mem_handler=self.sut)
+        self.sut.mems.append(self.mem)
+
+        self.read = []
+        self.sut.mem_read_cb.add_callback(
+            lambda mem, addr, data: self.read.append((addr, bytes(data))))
+
+    def test_that_concurrent_reads_are_queued(self):
+        # Fixture
+        self.sut.read(self.mem, 0, 10)
+
+        # Test
+        actual = self.sut.read(self.mem, 100, 10)
+
+        # Assert
+        self.assertTrue(actual)
+        self.assertEqual([(0, 10)], requested_chunks(self.cf_mock))
+
+    def test_that_queued_read_is_started_when_previous_is_done(self):
+        # Fixture
+        self.sut.read(self.mem, 0, 10)
+        self.sut.read(self.mem, 100, 10)
+
+        # Test
+        self.sut._new_packet_cb(create_read_reply(3, 0, range(10)))
+        self.sut._new_packet_cb(create_read_reply(3, 100, range(10, 20)))
+
+        # Assert
+        self.assertEqual([(0, bytes(range(10))), (100, bytes(range(10, 20)))],
+                         self.read)
+        self.assertEqual([(0, 10), (100, 10)],
+                         requested_chunks(self.cf_mock))
+        self.assertIsNotNone(self.sut.last_read_rate)
+
+    def test_that_queued_read_is_started_when_previous_fails(self):
+        # Fixture
+        failed = []
+        self.sut.mem_read_failed_cb.add_callback(
+            lambda mem, addr, data: failed.append(addr))
+        self.sut.read(self.mem, 0, 10)
+        self.sut.read(self.mem, 100, 10)
+
+        # Test
+        self.sut._new_packet_cb(create_read_reply(3, 0, (), status=5))
+
+        # Assert
+        self.assertEqual([0], failed)
+        self.assertEqual([(0, 10), (100, 10)],
+                         requested_chunks(self.cf_mock))
+
+    def test_that_late_error_does_not_fail_next_read(self):
+        # Fixture
+        failed = []
+        self.sut.mem_read_failed_cb.add_callback(
+            lambda mem, addr, data: failed.append(addr))
+        self.sut.read(self.mem, 0, 10)
+        self.sut.read(self.mem, 100, 10)
+        self.sut._new_packet_cb(create_read_reply(3, 0, range(10)))
+
+        # Test
+        self.sut._new_packet_cb(create_read_reply(3, 0, (), status=5))
+        self.sut._new_packet_cb(create_read_reply(3, 100, range(10, 20)))
+
+        # Assert
+        self.assertEqual([], failed)
+        self.assertEqual([(0, bytes(range(10))), (100, bytes(range(10, 20)))],
+                         self.read)
+
+
+class WriteRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cf_mock = MagicMock(spec=Crazyflie)
+        self.mem = MemoryElement(id=3, type=0, size=1000, mem_handler=None)
+        self.data = bytes(range(60))
+
+    def test_that_window_of_chunks_is_written(self):
+        # Fixture
+        sut = _WriteRequest(self.mem, 100, self.data, self.cf_mock, window=2)
+
+        # Test
+        sut.start()
+
+        # Assert
+        self.assertEqual([(100, self.data[0:25]), (125, self.data[25:50])],
+                         written_chunks(self.cf_mock))
+
+    def test_that_acknowledgements_out_of_order_finish_the_write(self):
+        # Fixture
+        sut = _WriteRequest(self.mem, 0, self.data, self.cf_mock, window=3)
+        sut.start()
+
+        # Test
+        actual = [sut.write_done(25), sut.write_done(50), sut.write_done(0)]
+
+        # Assert
+        self.assertEqual([False, False, True], actual)
+        self.assertEqual(60, sut.bytes_written())
+        self.assertIsNotNone(sut.bytes_per_second())
+
+    def test_that_unexpected_address_is_ignored(self):
+        # Fixture
+        sut = _WriteRequest(self.mem, 0, self.data, self.cf_mock, window=1)
+        sut.start()
+
+        # Test
+        actual = sut.write_done(25)
+
+        # Assert
+        self.assertFalse(actual)
+        self.assertEqual(0, sut.bytes_written())
+
+    def test_that_only_failed_chunk_is_written_again(self):
+        # Fixture
+        sut = _WriteRequest(self.mem, 0, self.data, self.cf_mock, window=3)
+        sut.start()
+        self.cf_mock.send_packet.reset_mock()
+
+        # Test
+        actual = sut.write_failed(25)
+
+        # Assert
+        self.assertFalse(actual)
+        self.assertEqual([(25, self.data[25:50])],
+                         written_chunks(self.cf_mock))
+
+    def test_that_write_fails_when_retries_are_used_up(self):
+        # Fixture
+        sut = _WriteRequest(self.mem, 0, self.data, self.cf_mock, window=1)
+        sut.start()
+
+        # Test
+        actual = [sut.write_failed(0)
+                  for _ in range(_WriteRequest.MAX_RETRIES + 1)]
+
+        # Assert
+        self.assertEqual([False] * _WriteRequest.MAX_RETRIES + [True],
+                         actual)
+
+    def test_that_memoryview_and_tuple_sources_are_accepted(self):
+        for data in [memoryview(self.data)[10:40], tuple(self.data[10:40])]:
+            # Fixture
+            self.cf_mock.send_packet.reset_mock()
+            sut = _WriteRequest(self.mem, 0, data, self.cf_mock, window=2)
+
+            # Test
+            sut.start()
+
+            # Assert
+            self.assertEqual([(0, self.data[10:35]), (25, self.data[35:40])],
+                             written_chunks(self.cf_mock))
+
+
+class MemoryWriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cf_mock = MagicMock(spec=Crazyflie)
+        self.cf_mock.disconnected = Caller()
+        self.sut = Memory(self.cf_mock)
+        self.sut.write_window = 2
+        self.mem = MemoryElement(id=3, type=0, size=1000,
+                                 mem_handler=self.sut)
+
+    def test_that_progress_is_reported(self):
+        # Fixture
+        progress = []
+        done = []
+        self.sut.mem_write_progress_cb.add_callback(
+            lambda mem, addr, written, total, rate: progress.append(
+                (addr, written, total)))
+        self.sut.mem_write_cb.add_callback(
+            lambda mem, addr: done.append(addr))
+        self.sut.write(self.mem, 10, bytes(30))
+
+        # Test
+        self.sut._new_packet_cb(create_write_reply(3, 10))
+        self.sut._new_packet_cb(create_write_reply(3, 35))
+
+        # Assert
+        self.assertEqual([(10, 25, 30), (10, 30, 30)], progress)
+        self.assertEqual([10], done)
+        self.assertIsNotNone(self.sut.last_write_rate)
+
+    def test_that_late_acknowledgement_is_ignored(self):
+        # Fixture
+        self.sut.write(self.mem, 0, bytes(10))
+        self.sut._new_packet_cb(create_write_reply(3, 0))
+
+        # Test
+        self.sut._new_packet_cb(create_write_reply(3, 0))
+
+        # Assert
+        self.assertEqual([], self.sut._write_requests[3])
+
+    def test_that_next_write_is_started_when_previous_fails(self):
+        # Fixture
+        failed = []
+        self.sut.mem_write_failed_cb.add_callback(
+            lambda mem, addr: failed.append(addr))
+        self.sut.write(self.mem, 0, bytes(10))
+        self.sut.write(self.mem, 100, bytes(10))
+
+        # Test
+        for _ in range(_WriteRequest.MAX_RETRIES + 1):
+            self.sut._new_packet_cb(create_write_reply(3, 0, status=5))
+
+        # Assert
+        self.assertEqual([0], failed)
+        self.assertEqual(100, written_chunks(self.cf_mock)[-1][0])
+
+
+class SimulatedMemoryReadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.classes_patch = patch.object(cflib.crtp, 'CLASSES', [SimDriver])
+        self.classes_patch.start()
+
+    def tearDown(self):
+        self.classes_patch.stop()
+        SimDriver.firmwares.clear()
+
+    def test_that_whole_memory_is_read(self):
+        # Fixture
+        cf = Crazyflie(rw_cache=None)
+        done = Event()
+        actual = []
+
+        def read_done(mem, addr, data):
+            actual.append(bytes(data))
+            done.set()
+
+        with SyncCrazyflie('sim://0', cf=cf):
+            mem = cf.mem.mems[0]
+            cf.mem.mem_read_cb.add_callback(read_done)
+
+            # Test
+            cf.mem.read(mem, 0, mem.size)
+
+            # Assert
+            self.assertTrue(done.wait(5))
+            self.assertEqual(bytes(i & 0xff for i in range(mem.size)),
+                             actual[0])
+
+    def test_that_written_data_is_stored(self):
+        # Fixture
+        cf = Crazyflie(rw_cache=None)
+        done = Event()
+        data = bytes(i * 7 & 0xff for i in range(1000))
+
+        with SyncCrazyflie('sim://0', cf=cf):
+            mem = cf.mem.mems[1]
+            cf.mem.mem_write_cb.add_callback(lambda *args: done.set())
+
+            # Test
+            cf.mem.write(mem, 10, data)
+
+            # Assert
+            self.assertTrue(done.wait(5))
+            self.assertEqual(data,
+                             cf.link.firmware.memories[1][1][10:1010])
+
+
+@benchmark
+class MemoryWriteBenchmark(SimBenchmarkCase):
+
+    LENGTH = 1000
+
+    def _measure(self, window):
+        cf = Crazyflie(rw_cache=None)
+        done = Event()
+        with SyncCrazyflie('sim://0?latency=2', cf=cf):
+            cf.mem.write_window = window
+            cf.mem.mem_write_cb.add_callback(lambda *args: done.set())
+            cf.mem.write(cf.mem.mems[1], 0, bytes(self.LENGTH))
+            self.assertTrue(done.wait(10))
+            return cf.mem.last_write_rate
+
+    def test_write_throughput(self):
+        # Fixture
+        # Test
+        one_chunk = self._measure(1)
+        windowed = self._measure(4)
+
+        # Assert
+        # With 2 ms round trips the throughput is limited by the number of
+        # chunks in flight
+        self.assertGreater(windowed, one_chunk * 2, (one_chunk, windowed))
+
+
+@benchmark
+class MemoryReadBenchmark(SimBenchmarkCase):
+
+    LENGTH = 1000
+
+    def _measure(self, window):
+        cf = Crazyflie(rw_cache=None)
+        done = Event()
+        with SyncCrazyflie('sim://0?latency=2', cf=cf):
+            cf.mem.read_window = window
+            cf.mem.mem_read_cb.add_callback(lambda *args: done.set())
+            start = time.perf_counter()
+            cf.mem.read(cf.mem.mems[0], 0, self.LENGTH)
+            self.assertTrue(done.wait(10))
+            elapsed = time.perf_counter() - start
+        return self.LENGTH / elapsed
+
+    def test_read_throughput(self):
+        # Fixture
+        # Test
+        one_chunk = self._measure(1)
+        windowed = self._measure(4)
+
+        # Assert
+        # With 2 ms round trips the throughput is limited by the number of
+        # chunks in flight
+        self.assertGreater(windowed, one_chunk * 2, (one_chunk, windowed))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+#
+# ,---------,       ____  _ __
+# |  ,-^-,  |      / __ )(_) /_______________ _____  ___
+# | (  O  ) |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+# | / ,--'  |    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#    +------`   /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+# Copyright (C) 2023 Bitcraze AB
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, in version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+from threading import Event
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import cflib.crtp
+from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.mem import MemoryElement
+from cflib.crazyflie.mem import MemoryMirror
+from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
+from cflib.crtp.simdriver import SimDriver
+from cflib.utils.callbacks import Caller
+
+
+class MemoryMirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = MagicMock()
+        self.handler.mem_write_cb = Caller()
+        self.handler.mem_write_failed_cb = Caller()
+        self.handler.mem_read_cb = Caller()
+        self.handler.mem_read_failed_cb = Caller()
+        self.mem = MemoryElement(id=2, type=0, size=1000,
+                                 mem_handler=self.handler)
+        self.sut = self.mem.mirror(100, 200)
+
+    def _writes(self):
+        return [(call.args[1], call.args[2])
+                for call in self.handler.write.call_args_list]
+
+    def _ack_writes(self):
+        for addr, _ in self._writes():
+            self.handler.mem_write_cb.call(self.mem, addr)
+
+    def test_that_nothing_is_written_before_flush(self):
+        # Fixture
+        # Test
+        self.sut.write(110, b'abc')
+
+        # Assert
+        self.handler.write.assert_not_called()
+        self.assertEqual([(110, 113)], self.sut.dirty_ranges())
+
+    def test_that_close_ranges_are_written_together(self):
+        # Fixture
+        self.sut.write(110, b'abc')
+        self.sut.write(115, b'de')
+        self.sut.write(200, b'f')
+
+        # Test
+        self.sut.flush()
+
+        # Assert
+        self.assertEqual([(110, b'abc\0\0de'), (200, b'f')], self._writes())
+        self.assertFalse(self.sut.is_dirty())
+
+    def test_that_only_changed_bytes_are_written(self):
+        # Fixture
+        self.sut.write(100, bytes(50))
+        self.sut.flush()
+        self._ack_writes()
+        self.handler.write.reset_mock()
+        data = bytearray(50)
+        data[20] = 1
+        data[22] = 2
+
+        # Test
+        self.sut.write(100, data)
+        self.sut.flush()
+
+        # Assert
+        self.assertEqual([(120, b'\x01\0\x02')], self._writes())
+
+    def test_that_unchanged_write_is_not_flushed(self):
+        # Fixture
+        done = []
+        self.sut.write(100, b'abc')
+        self.sut.flush()
+        self._ack_writes()
+        self.handler.write.reset_mock()
+
+        # Test
+        self.sut.write(100, b'abc')
+        self.sut.flush(lambda mirror: done.append(mirror))
+
+        # Assert
+        self.handler.write.assert_not_called()
+        self.assertEqual([self.sut], done)
+
+    def test_that_flush_done_is_called_when_all_writes_are_done(self):
+        # Fixture
+        done = []
+        self.sut.write(110, b'a')
+        self.sut.write(200, b'b')
+        self.sut.flush(lambda mirror: done.append(mirror))
+
+        # Test
+        self.handler.mem_write_cb.call(self.mem, 110)
+        first = list(done)
+        self.handler.mem_write_cb.call(self.mem, 200)
+
+        # Assert
+        self.assertEqual([], first)
+        self.assertEqual([self.sut], done)
+
+    def test_that_failed_range_is_kept_dirty(self):
+        # Fixture
+        failed = []
+        self.sut.write(110, b'a')
+        self.sut.flush(flush_failed_cb=lambda mirror: failed.append(mirror))
+
+        # Test
+        self.handler.mem_write_failed_cb.call(self.mem, 110)
+
+        # Assert
+        self.assertEqual([self.sut], failed)
+        self.assertEqual([(110, 111)], self.sut.dirty_ranges())
+
+    def test_that_read_is_cached(self):
+        # Fixture
+        read = []
+        self.sut.read(120, 4, lambda m, addr, data: read.append(bytes(data)))
+        self.handler.mem_read_cb.call(self.mem, 120, bytearray(b'wxyz'))
+
+        # Test
+        self.sut.read(121, 2, lambda m, addr, data: read.append(bytes(data)))
+
+        # Assert
+        self.assertEqual(1, self.handler.read.call_count)
+        self.assertEqual([b'wxyz', b'xy'], read)
+
+    def test_that_written_range_is_read_from_cache(self):
+        # Fixture
+        read = []
+        self.sut.write(120, b'ab')
+
+        # Test
+        self.sut.read(120, 2, lambda m, addr, data: read.append(bytes(data)))
+
+        # Assert
+        self.handler.read.assert_not_called()
+        self.assertEqual([b'ab'], read)
+
+    def test_that_invalidated_range_is_read_again(self):
+        # Fixture
+        self.sut.read(120, 4, lambda *args: None)
+        self.handler.mem_read_cb.call(self.mem, 120, bytearray(4))
+
+        # Test
+        self.sut.invalidate(122, 1)
+        self.sut.read(120, 4, lambda *args: None)
+
+        # Assert
+        self.assertEqual(2, self.handler.read.call_count)
+
+    def test_that_read_does_not_overwrite_unflushed_changes(self):
+        # Fixture
+        read = []
+        self.sut.write(121, b'B')
+        self.sut.invalidate()
+
+        # Test
+        self.sut.read(120, 3, lambda m, addr, data: read.append(bytes(data)))
+        self.handler.mem_read_cb.call(self.mem, 120, bytearray(b'abc'))
+
+        # Assert
+        self.assertEqual([b'aBc'], read)
+
+    def test_that_read_answered_during_flush_keeps_written_bytes(self):
+        # Fixture
+        read = []
+        self.sut.write(110, b'NEW')
+        self.sut.read(100, 20, lambda *args: None)
+        self.sut.flush()
+
+        # Test
+        self.handler.mem_read_cb.call(self.mem, 100, bytearray(20))
+        self._ack_writes()
+        self.sut.read(110, 3, lambda m, addr, data: read.append(bytes(data)))
+
+        # Assert
+        self.assertEqual([b'NEW'], read)
+        self.assertEqual(1, self.handler.read.call_count)
+
+    def test_that_failed_write_after_read_during_flush_is_kept(self):
+        # Fixture
+        self.sut.write(110, b'NEW')
+        self.sut.read(100, 20, lambda *args: None)
+        self.sut.flush()
+        self.handler.mem_read_cb.call(self.mem, 100, bytearray(20))
+        self.handler.write.reset_mock()
+
+        # Test
+        self.handler.mem_write_failed_cb.call(self.mem, 110)
+        self.sut.flush()
+
+        # Assert
+        self.assertEqual([(110, b'NEW')], self._writes())
+
+    def test_that_invalidate_keeps_ranges_being_written(self):
+        # Fixture
+        self.sut.write(110, b'NEW')
+        self.sut.flush()
+
+        # Test
+        self.sut.invalidate()
+
+        # Assert
+        self.sut.read(110, 3, lambda *args: None)
+        self.handler.read.assert_not_called()
+
+    def test_that_range_outside_of_mirror_raises(self):
+        # Fixture
+        # Test
+        # Assert
+        with self.assertRaises(Exception):
+            self.sut.write(299, b'ab')
+
+
+class SimulatedMemoryMirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.classes_patch = patch.object(cflib.crtp, 'CLASSES', [SimDriver])
+        self.classes_patch.start()
+
+    def tearDown(self):
+        self.classes_patch.stop()
+        SimDriver.firmwares.clear()
+
+    def test_that_changes_are_written_to_the_crazyflie(self):
+        # Fixture
+        cf = Crazyflie(rw_cache=None)
+        done = Event()
+
+        with SyncCrazyflie('sim://0', cf=cf):
+            sut = MemoryMirror(cf.mem.mems[1])
+            sut.write(0, bytes(range(200)))
+            sut.write(1000, b'abc')
+
+            # Test
+            sut.flush(lambda mirror: done.set())
+
+            # Assert
+            self.assertTrue(done.wait(5))
+            content = cf.link.firmware.memories[1][1]
+            self.assertEqual(bytes(range(200)), content[0:200])
+            self.assertEqual(b'abc', content[1000:1003])
+            sut.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
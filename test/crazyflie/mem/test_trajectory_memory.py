@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+#
+# ,---------,       ____  _ __
+# |  ,-^-,  |      / __ )(_) /_______________ _____  ___
+# | (  O  ) |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+# | / ,--'  |    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#    +------`   /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+# Copyright (C) 2023 Bitcraze AB
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, in version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import struct
+import time
+import unittest
+from test.support.benchmark import benchmark
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from cflib.crazyflie.mem import MemoryElement
+from cflib.crazyflie.mem import Poly4D
+from cflib.crazyflie.mem import TrajectoryMemory
+
+
+def create_poly4D(i):
+    return Poly4D(0.5 + i,
+                  Poly4D.Poly([i + 0.1 * j for j in range(8)]),
+                  Poly4D.Poly([i + 1.0 + 0.1 * j for j in range(8)]),
+                  Poly4D.Poly([i + 2.0 + 0.1 * j for j in range(8)]),
+                  Poly4D.Poly([i + 3.0 + 0.1 * j for j in range(8)]))
+
+
+def struct_pack(poly4Ds):
+    data = bytearray()
+    for poly4D in poly4Ds:
+        data += struct.pack('<ffffffff', *poly4D.x.values)
+        data += struct.pack('<ffffffff', *poly4D.y.values)
+        data += struct.pack('<ffffffff', *poly4D.z.values)
+        data += struct.pack('<ffffffff', *poly4D.yaw.values)
+        data += struct.pack('<f', poly4D.duration)
+    return bytes(data)
+
+
+class TrajectoryMemoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mem_handler = MagicMock()
+        self.sut = TrajectoryMemory(id=1, type=MemoryElement.TYPE_TRAJ,
+                                    size=4096, mem_handler=self.mem_handler)
+        self.poly4Ds = [create_poly4D(i) for i in range(3)]
+        self.done = []
+        self.failed = []
+
+    def _write(self, force=False):
+        self.sut.write_data(lambda mem, addr: self.done.append(addr),
+                            lambda mem, addr: self.failed.append(addr),
+                            force=force)
+
+    def test_that_poly4Ds_are_packed_as_in_memory(self):
+        # Fixture
+        # Test
+        actual = TrajectoryMemory.pack(self.poly4Ds)
+
+        # Assert
+        self.assertEqual(struct_pack(self.poly4Ds), actual)
+
+    def test_that_array_is_packed_as_poly4Ds(self):
+        # Fixture
+        array = TrajectoryMemory.to_array(self.poly4Ds).astype(np.float64)
+
+        # Test
+        actual = TrajectoryMemory.pack(array)
+
+        # Assert
+        self.assertEqual(struct_pack(self.poly4Ds), actual)
+
+    def test_that_array_with_wrong_shape_raises(self):
+        # Fixture
+        # Test
+        # Assert
+        with self.assertRaises(Exception):
+            TrajectoryMemory.pack(np.zeros((3, 32), dtype=np.float32))
+
+    def test_that_array_is_written(self):
+        # Fixture
+        self.sut.poly4Ds = TrajectoryMemory.to_array(self.poly4Ds)
+
+        # Test
+        self._write()
+
+        # Assert
+        self.mem_handler.write.assert_called_once_with(
+            self.sut, 0x00, struct_pack(self.poly4Ds), flush_queue=True)
+
+    def test_that_same_trajectory_is_not_written_again(self):
+        # Fixture
+        self.sut.poly4Ds = self.poly4Ds
+        self._write()
+        self.sut.write_done(self.sut, 0)
+
+        # Test
+        self._write()
+
+        # Assert
+        self.assertEqual(1, self.mem_handler.write.call_count)
+        self.assertEqual([0, 0], self.done)
+
+    def test_that_changed_trajectory_is_written(self):
+        # Fixture
+        self.sut.poly4Ds = self.poly4Ds
+        self._write()
+        self.sut.write_done(self.sut, 0)
+
+        # Test
+        self.sut.poly4Ds = self.poly4Ds[:2]
+        self._write()
+
+        # Assert
+        self.assertEqual(2, self.mem_handler.write.call_count)
+
+    def test_that_forced_trajectory_is_written(self):
+        # Fixture
+        self.sut.poly4Ds = self.poly4Ds
+        self._write()
+        self.sut.write_done(self.sut, 0)
+
+        # Test
+        self._write(force=True)
+
+        # Assert
+        self.assertEqual(2, self.mem_handler.write.call_count)
+
+    def test_that_trajectory_is_written_again_after_failure(self):
+        # Fixture
+        self.sut.poly4Ds = self.poly4Ds
+        self._write()
+        self.sut.write_failed(self.sut, 0)
+
+        # Test
+        self._write()
+
+        # Assert
+        self.assertEqual([0], self.failed)
+        self.assertEqual(2, self.mem_handler.write.call_count)
+
+    def test_that_other_write_to_memory_clears_hash(self):
+        # Fixture
+        self.sut.poly4Ds = self.poly4Ds
+        self._write()
+        self.sut.write_done(self.sut, 0)
+
+        # Test
+        self.sut.write_done(self.sut, 100)
+
+        # Assert
+        self.assertIsNone(self.sut.uploaded_hash)
+
+    def test_that_other_write_done_during_upload_does_not_set_hash(self):
+        # Fixture
+        self.sut.poly4Ds = self.poly4Ds
+        self._write()
+
+        # Test
+        self.sut.write_done(self.sut, 100)
+
+        # Assert
+        self.assertIsNone(self.sut.uploaded_hash)
+
+    def test_that_write_done_without_upload_does_not_set_hash(self):
+        # Fixture
+        self.sut.poly4Ds = self.poly4Ds
+        self._write()
+        self.sut.write_done(self.sut, 0)
+
+        # Test
+        self.sut.write_done(self.sut, 0)
+
+        # Assert
+        self.assertIsNone(self.sut.uploaded_hash)
+
+
+@benchmark
+class TrajectoryPackBenchmark(unittest.TestCase):
+
+    SEGMENTS = 500
+    ITERATIONS = 20
+
+    def _measure(self, pack, trajectory):
+        start = time.perf_counter()
+        for _ in range(self.ITERATIONS):
+            pack(trajectory)
+        return (time.perf_counter() - start) / self.ITERATIONS
+
+    def test_pack_time(self):
+        # Fixture
+        poly4Ds = [create_poly4D(i) for i in range(self.SEGMENTS)]
+        array = TrajectoryMemory.to_array(poly4Ds)
+
+        # Test
+        struct_time = self._measure(struct_pack, poly4Ds)
+        array_time = self._measure(TrajectoryMemory.pack, array)
+
+        # Assert
+        # An array is packed in one NumPy call instead of one struct call
+        # per segment
+        self.assertLess(array_time, struct_time / 10,
+                        (struct_time, array_time))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  MA  02110-1301, USA.
+import struct
+import threading
+import time
+import unittest
+from test.support.benchmark import benchmark
+from test.support.benchmark import measure_rate
+from unittest.mock import MagicMock
+
+from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.log import Log
+from cflib.crazyflie.log import LogConfig
+from cflib.crazyflie.mem import Memory
+from cflib.crazyflie.param import Param
+from cflib.crazyflie.platformservice import PlatformService
+from cflib.crtp.crtpstack import CRTPPacket
+from cflib.crtp.crtpstack import CRTPPort
+
+
+class ConnectionSetupTest(unittest.TestCase):
+
+    def _create_sut(self, parallel_setup):
+        sut = Crazyflie(parallel_setup=parallel_setup)
+        sut.platform = MagicMock(spec=PlatformService)
+        sut.log = MagicMock(spec=Log)
+        sut.mem = MagicMock(spec=Memory)
+        sut.param = MagicMock(spec=Param)
+
+        self.connected_cb = MagicMock()
+        sut.connected.add_callback(self.connected_cb)
+        return sut
+
+    def _setup_cb(self, mock):
+        return mock.call_args[0][0]
+
+    def test_that_setup_is_sequential_by_default(self):
+        # Fixture
+        sut = self._create_sut(False)
+        sut._start_connection_setup()
+
+        # Test
+        self._setup_cb(sut.platform.fetch_platform_informations)()
+
+        # Assert
+        sut.log.refresh_toc.assert_called_once()
+        sut.mem.refresh.assert_not_called()
+        sut.param.refresh_toc.assert_not_called()
+
+        # Test
+        self._setup_cb(sut.log.refresh_toc)()
+        self._setup_cb(sut.mem.refresh)()
+        self._setup_cb(sut.param.refresh_toc)()
+
+        # Assert
+        self.connected_cb.assert_called_once_with('')
+        sut.param.request_update_of_all_params.assert_called_once_with()
+
+    def test_that_parallel_setup_starts_all_stages(self):
+        # Fixture
+        sut = self._create_sut(True)
+        sut._start_connection_setup()
+
+        # Test
+        self._setup_cb(sut.platform.fetch_platform_informations)()
+
+        # Assert
+        sut.log.refresh_toc.assert_called_once()
+        sut.mem.refresh.assert_called_once()
+        sut.param.refresh_toc.assert_called_once()
+
+    def test_that_parallel_setup_is_connected_when_all_stages_are_done(self):
+        # Fixture
+        sut = self._create_sut(True)
+        sut._start_connection_setup()
+        self._setup_cb(sut.platform.fetch_platform_informations)()
+
+        # Test
+        self._setup_cb(sut.param.refresh_toc)()
+        self._setup_cb(sut.log.refresh_toc)()
+
+        # Assert
+        self.connected_cb.assert_not_called()
+
+        # Test
+        self._setup_cb(sut.mem.refresh)()
+
+        # Assert
+        self.connected_cb.assert_called_once_with('')
+        self.assertTrue(sut.is_connected())
+
+    def test_that_setup_timing_is_reported(self):
+        # Fixture
+        sut = self._create_sut(True)
+        sut._start_connection_setup()
+        self._setup_cb(sut.platform.fetch_platform_informations)()
+        self._setup_cb(sut.param.refresh_toc)()
+        self._setup_cb(sut.log.refresh_toc)()
+        self._setup_cb(sut.mem.refresh)()
+
+        # Test
+        sut._all_params_updated_cb()
+
+        # Assert
+        self.assertEqual({Crazyflie.STAGE_PLATFORM,
+                          Crazyflie.STAGE_LOG_TOC,
+                          Crazyflie.STAGE_MEMORIES,
+                          Crazyflie.STAGE_PARAM_TOC,
+                          Crazyflie.STAGE_SETUP,
+                          Crazyflie.STAGE_PARAM_VALUES},
+                         set(sut.setup_timing.keys()))
+        for duration in sut.setup_timing.values():
+            self.assertGreaterEqual(duration, 0)
+
+
+class PacketDispatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = Crazyflie()
+        self.sut.link = MagicMock()
+        self.sut.link.needs_resending = True
+
+    def tearDown(self):
+        for patterns in self.sut._answer_patterns.values():
+            for resend in patterns.values():
+                resend.cancel()
+
+    def _packet(self, port, channel, data):
+        pk = CRTPPacket()
+        pk.set_header(port, channel)
+        pk.data = data
+        return pk
+
+    def test_that_port_callback_gets_all_channels_of_port(self):
+        # Fixture
+        cb = MagicMock()
+        self.sut.add_port_callback(CRTPPort.CONSOLE, cb)
+        pk1 = self._packet(CRTPPort.CONSOLE, 0, b'a')
+        pk2 = self._packet(CRTPPort.CONSOLE, 3, b'b')
+
+        # Test
+        self.sut.incoming.dispatch(pk1)
+        self.sut.incoming.dispatch(pk2)
+        self.sut.incoming.dispatch(self._packet(CRTPPort.MEM, 0, b'c'))
+
+        # Assert
+        self.assertEqual([((pk1,),), ((pk2,),)], cb.call_args_list)
+
+    def test_that_header_callback_is_filtered_on_channel(self):
+        # Fixture
+        cb = MagicMock()
+        self.sut.incoming.add_header_callback(cb, CRTPPort.LINKCTRL, 1)
+        pk = self._packet(CRTPPort.LINKCTRL, 1, b'a')
+
+        # Test
+        self.sut.incoming.dispatch(self._packet(CRTPPort.LINKCTRL, 0, b'b'))
+        self.sut.incoming.dispatch(pk)
+
+        # Assert
+        cb.assert_called_once_with(pk)
+
+    def test_that_removed_callback_is_not_called(self):
+        # Fixture
+        cb = MagicMock()
+        self.sut.add_port_callback(CRTPPort.CONSOLE, cb)
+
+        # Test
+        self.sut.remove_port_callback(CRTPPort.CONSOLE, cb)
+        self.sut.incoming.dispatch(self._packet(CRTPPort.CONSOLE, 0, b'a'))
+
+        # Assert
+        cb.assert_not_called()
+
+    def test_that_longest_answer_pattern_is_matched(self):
+        # Fixture
+        self.sut.send_packet(self._packet(CRTPPort.MEM, 1, (1,)),
+                             expected_reply=(1,))
+        self.sut.send_packet(self._packet(CRTPPort.MEM, 1, (1, 2)),
+                             expected_reply=(1, 2))
+        header = self._packet(CRTPPort.MEM, 1, ()).header
+
+        # Test
+        self.sut.incoming.dispatch(self._packet(CRTPPort.MEM, 1, (1, 2, 3)))
+
+        # Assert
+        self.assertEqual([(header, 1)],
+                         list(self.sut._answer_patterns[header].keys()))
+
+    def test_that_answer_on_other_channel_is_not_matched(self):
+        # Fixture
+        self.sut.send_packet(self._packet(CRTPPort.MEM, 1, (1,)),
+                             expected_reply=(1,))
+        header = self._packet(CRTPPort.MEM, 1, ()).header
+
+        # Test
+        self.sut.incoming.dispatch(self._packet(CRTPPort.MEM, 2, (1,)))
+
+        # Assert
+        self.assertEqual(1, len(self.sut._answer_patterns[header]))
+
+
+class ResendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = Crazyflie()
+        self.sut.link = MagicMock()
+        self.sut.link.needs_resending = True
+
+    def tearDown(self):
+        self.sut._cancel_resends()
+
+    def _send(self, timeout=0.05):
+        pk = CRTPPacket()
+        pk.set_header(CRTPPort.PARAM, 1)
+        pk.data = (1, 0)
+        self.sut.send_packet(pk, expected_reply=(1, 0), timeout=timeout)
+        return pk
+
+    def _answer(self):
+        pk = CRTPPacket()
+        pk.set_header(CRTPPort.PARAM, 1)
+        pk.data = (1, 0, 42)
+        self.sut.incoming.dispatch(pk)
+
+    def test_that_packet_is_resent_when_no_answer(self):
+        # Fixture
+        pk = self._send()
+
+        # Test
+        time.sleep(0.17)
+
+        # Assert
+        self.assertGreaterEqual(self.sut.link.send_packet.call_count, 3)
+        self.sut.link.send_packet.assert_called_with(pk)
+        self.assertEqual(self.sut.link.send_packet.call_count - 1,
+                         self.sut.resend_counts[CRTPPort.PARAM])
+
+    def test_that_packet_is_not_resent_when_answered(self):
+        # Fixture
+        self._send()
+
+        # Test
+        self._answer()
+        time.sleep(0.1)
+
+        # Assert
+        self.assertEqual(1, self.sut.link.send_packet.call_count)
+        self.assertEqual({}, self.sut.resend_counts)
+
+    def test_that_resending_stops_after_max_resends(self):
+        # Fixture
+        self.sut.max_resends = 2
+        self._send(0.02)
+
+        # Test
+        time.sleep(0.15)
+
+        # Assert
+        self.assertEqual(3, self.sut.link.send_packet.call_count)
+        self.assertEqual({}, self.sut._answer_patterns[self._header()])
+
+    def test_that_timeout_is_increased_with_backoff(self):
+        # Fixture
+        self.sut.resend_backoff = 4.0
+        self._send(0.02)
+
+        # Test
+        time.sleep(0.15)
+
+        # Assert
+        # Resends at 0.02 and 0.1 s, the next one is at 0.42 s
+        self.assertEqual(3, self.sut.link.send_packet.call_count)
+
+    def test_that_resends_are_cancelled_on_close(self):
+        # Fixture
+        self._send()
+
+        # Test
+        self.sut.close_link()
+        time.sleep(0.1)
+
+        # Assert
+        self.assertEqual({}, self.sut._answer_patterns)
+
+    def test_that_scheduler_thread_is_stopped_on_close(self):
+        # Fixture
+        self._send()
+        scheduler = self.sut._resend_scheduler
+
+        # Test
+        self.sut.close_link()
+        scheduler.join(1.0)
+
+        # Assert
+        self.assertFalse(scheduler.is_alive())
+
+    def test_that_packet_is_resent_after_reconnect(self):
+        # Fixture
+        self._send()
+        link = self.sut.link
+        self.sut.close_link()
+        self.sut.link = link
+        link.reset_mock()
+
+        # Test
+        self._send()
+        time.sleep(0.08)
+
+        # Assert
+        self.assertGreaterEqual(link.send_packet.call_count, 2)
+
+    def test_that_packet_is_not_resent_without_resend(self):
+        # Fixture
+        pk = CRTPPacket()
+        pk.set_header(CRTPPort.PARAM, 1)
+        pk.data = (1, 0)
+
+        # Test
+        self.sut.send_packet(pk, expected_reply=(1, 0), timeout=0.02,
+                             resend_until_answered=False)
+        time.sleep(0.08)
+
+        # Assert
+        self.assertEqual(1, self.sut.link.send_packet.call_count)
+
+    def test_that_resent_packet_does_not_add_answer_pattern(self):
+        # Fixture
+        pk = CRTPPacket()
+        pk.set_header(CRTPPort.PARAM, 1)
+        pk.data = (1, 0)
+
+        # Test
+        self.sut.send_packet(pk, expected_reply=(1, 0), resend=True,
+                             timeout=0.02)
+        time.sleep(0.08)
+
+        # Assert
+        self.assertEqual(1, self.sut.link.send_packet.call_count)
+        self.assertEqual({}, self.sut._answer_patterns)
+
+    def test_that_answers_are_handled_while_link_send_blocks(self):
+        # Fixture
+        unblock = threading.Event()
+        self.sut.link.send_packet.side_effect = lambda pk: unblock.wait(1)
+        sender = threading.Thread(target=self._send, args=(1.0,))
+        sender.start()
+        time.sleep(0.05)
+
+        # Test
+        answered = threading.Thread(target=self._answer)
+        answered.start()
+        answered.join(0.5)
+
+        # Assert
+        self.assertFalse(answered.is_alive())
+        self.assertEqual({}, self.sut._answer_patterns[self._header()])
+        unblock.set()
+        sender.join()
+
+    def _header(self):
+        pk = CRTPPacket()
+        pk.set_header(CRTPPort.PARAM, 1)
+        return pk.header
+
+
+@benchmark
+class PacketDispatchBenchmark(unittest.TestCase):
+
+    ITERATIONS = 20000
+
+    def _measure(self, outstanding):
+        sut = Crazyflie()
+        sut.link = MagicMock()
+        sut.link.needs_resending = True
+        sut.packet_received.remove_callback(sut._check_for_initial_packet_cb)
+
+        config = LogConfig('bench', 10,
+                           data_format=LogConfig.DATA_FORMAT_TUPLE)
+        config.add_variable('a.x', 'float')
+        config.id = 1
+        config.data_received_cb.add_callback(lambda ts, data, block: None)
+        sut.log.log_blocks.append(config)
+
+        # Outstanding requests on other ports
+        for i in range(outstanding):
+            pk = CRTPPacket()
+            pk.set_header(CRTPPort.PARAM, 1)
+            pk.data = struct.pack('<HB', i, 0)
+            sut.send_packet(pk, expected_reply=tuple(pk.data[:2]),
+                            timeout=60)
+
+        pk = CRTPPacket()
+        pk.set_header(CRTPPort.LOGGING, 2)
+        pk.data = struct.pack('<BBBBf', 1, 0, 0, 0, 1.0)
+
+        try:
+            return measure_rate(lambda: sut.incoming.dispatch(pk),
+                                self.ITERATIONS)
+        finally:
+            sut._cancel_resends()
+
+    def test_packets_per_second(self):
+        # Fixture
+        # Test
+        idle = self._measure(0)
+        busy = self._measure(1000)
+
+        # Assert
+        # Answers are looked up on the header of the packet, requests
+        # waiting for answers on other ports do not slow down dispatch
+        self.assertGreater(busy, idle / 2, (idle, busy))
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  MA  02110-1301, USA.
+import struct
+import unittest
+from test.support.benchmark import benchmark
+from test.support.benchmark import measure_rate
+from unittest.mock import MagicMock
+
+from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.log import Log
+from cflib.crazyflie.log import LogConfig
+from cflib.crtp.crtpstack import CRTPPacket
+from cflib.crtp.crtpstack import CRTPPort
+
+
+class LogConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = struct.pack('<BhfeL', 7, -3, 1.5, 0.25, 123456)
+
+    def _create_config(self, data_format=LogConfig.DATA_FORMAT_DICT):
+        config = LogConfig('test', 10, data_format=data_format)
+        config.add_variable('a.u8', 'uint8_t')
+        config.add_variable('a.i16', 'int16_t')
+        config.add_variable('b.f', 'float')
+        config.add_variable('b.h', 'FP16')
+        config.add_memory('mem', 'uint32_t', 'uint32_t', 0x1000)
+        return config
+
+    def _receive(self, config):
+        actual = []
+        config.data_received_cb.add_callback(
+            lambda ts, data, block: actual.append((ts, data, block)))
+        config.unpack_log_data(self.data, 4711)
+        return actual
+
+    def test_that_data_is_unpacked_to_dict(self):
+        # Fixture
+        sut = self._create_config()
+
+        # Test
+        actual = self._receive(sut)
+
+        # Assert
+        expected = [(4711, {'a.u8': 7, 'a.i16': -3, 'b.f': 1.5, 'b.h': 0.25,
+                            'mem': 123456}, sut)]
+        self.assertEqual(expected, actual)
+
+    def test_that_data_is_unpacked_to_tuple(self):
+        # Fixture
+        sut = self._create_config(LogConfig.DATA_FORMAT_TUPLE)
+
+        # Test
+        actual = self._receive(sut)
+
+        # Assert
+        self.assertEqual((7, -3, 1.5, 0.25, 123456), actual[0][1])
+
+    def test_that_data_is_unpacked_to_namedtuple(self):
+        # Fixture
+        sut = self._create_config(LogConfig.DATA_FORMAT_NAMEDTUPLE)
+
+        # Test
+        actual = self._receive(sut)
+
+        # Assert
+        data = actual[0][1]
+        self.assertEqual(-3, data.a_i16)
+        self.assertEqual(0.25, data.b_h)
+        self.assertEqual(123456, data.mem)
+
+    def test_that_decoder_is_rebuilt_when_variable_is_added(self):
+        # Fixture
+        sut = LogConfig('test', 10, data_format=LogConfig.DATA_FORMAT_TUPLE)
+        sut.add_variable('a.u8', 'uint8_t')
+        sut.unpack_log_data(self.data, 0)
+        sut.add_variable('a.i16', 'int16_t')
+
+        # Test
+        actual = self._receive(sut)
+
+        # Assert
+        self.assertEqual((7, -3), actual[0][1])
+
+    def test_that_log_data_packet_is_dispatched_to_block(self):
+        # Fixture
+        cf_mock = MagicMock(spec=Crazyflie)
+        log = Log(cf_mock)
+        sut = self._create_config()
+        sut.id = 3
+        log.log_blocks.append(sut)
+
+        pk = CRTPPacket()
+        pk.set_header(CRTPPort.LOGGING, 2)
+        pk.data = bytearray((3, 0x01, 0x02, 0x03)) + self.data
+
+        # Test
+        actual = []
+        sut.data_received_cb.add_callback(
+            lambda ts, data, block: actual.append((ts, data)))
+        log._new_packet_cb(pk)
+
+        # Assert
+        self.assertEqual(0x030201, actual[0][0])
+        self.assertEqual(123456, actual[0][1]['mem'])
+
+
+@benchmark
+class LogDecodeBenchmark(unittest.TestCase):
+
+    ITERATIONS = 20000
+
+    def _create_config(self, data_format):
+        config = LogConfig('bench', 10, data_format=data_format)
+        for i in range(6):
+            config.add_variable('group.var%d' % i, 'float')
+        config.data_received_cb.add_callback(lambda ts, data, block: None)
+        return config
+
+    def _measure(self, data_format):
+        sut = self._create_config(data_format)
+        data = memoryview(struct.pack('<6f', *range(6)))
+        return measure_rate(lambda: sut.unpack_log_data(data, 0),
+                            self.ITERATIONS)
+
+    def test_decode_throughput(self):
+        # Fixture
+        # Test
+        rates = {data_format: self._measure(data_format) for data_format in (
+            LogConfig.DATA_FORMAT_DICT,
+            LogConfig.DATA_FORMAT_TUPLE,
+            LogConfig.DATA_FORMAT_NAMEDTUPLE)}
+
+        # Assert
+        # Tuples are unpacked straight from the struct, without building a
+        # dict or a named tuple
+        self.assertGreater(rates[LogConfig.DATA_FORMAT_TUPLE],
+                           rates[LogConfig.DATA_FORMAT_DICT], rates)
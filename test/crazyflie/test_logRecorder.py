@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  MA  02110-1301, USA.
+import io
+import struct
+import time
+import unittest
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import numpy as np
+
+import cflib.crtp
+from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.log import Log
+from cflib.crazyflie.log import LogConfig
+from cflib.crazyflie.logRecorder import _TimestampUnwrapper
+from cflib.crazyflie.logRecorder import LogRecorder
+from cflib.crazyflie.logRecorder import SwarmLogRecorder
+from cflib.crazyflie.swarm import CachedCfFactory
+from cflib.crazyflie.swarm import Swarm
+from cflib.crtp.simdriver import SimDriver
+from cflib.utils.callbacks import Caller
+
+
+class LogRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cf_mock = MagicMock(spec=Crazyflie)
+        self.cf_mock.disconnected = Caller()
+
+        self.log_mock = MagicMock(spec=Log)
+        self.cf_mock.log = self.log_mock
+
+        self.log_config = LogConfig('conf', 10)
+        self.log_config.add_variable('a.f', 'float')
+        self.log_config.add_variable('a.i16', 'int16_t')
+        self.log_config.cf = self.cf_mock
+        self.cf_mock.link = None
+
+        self.sut = LogRecorder(self.cf_mock, self.log_config, capacity=4)
+
+    def _add_samples(self, count):
+        for i in range(count):
+            self.log_config.unpack_log_data(
+                memoryview(struct.pack('<fh', i * 0.5, -i)), 1000 + i)
+
+    def test_that_log_configuration_is_added_on_connect(self):
+        # Fixture
+
+        # Test
+        self.sut.connect()
+
+        # Assert
+        self.log_mock.add_config.assert_called_once_with(self.log_config)
+
+    def test_that_samples_are_recorded_in_columns(self):
+        # Fixture
+        self.sut.connect()
+
+        # Test
+        self._add_samples(3)
+
+        # Assert
+        actual = self.sut.snapshot('conf')
+        self.assertEqual(3, len(actual))
+        self.assertEqual([1000, 1001, 1002], list(actual['timestamp']))
+        self.assertEqual([0.0, 0.5, 1.0], list(actual['a.f']))
+        self.assertEqual([0, -1, -2], list(actual['a.i16']))
+
+    def test_that_oldest_samples_are_overwritten_when_full(self):
+        # Fixture
+        self.sut.connect()
+
+        # Test
+        self._add_samples(6)
+
+        # Assert
+        actual = self.sut.snapshot('conf')
+        self.assertEqual([1002, 1003, 1004, 1005], list(actual['timestamp']))
+        self.assertEqual(6, self.sut.sample_count('conf'))
+
+    def test_that_snapshot_is_a_view(self):
+        # Fixture
+        self.sut.connect()
+        self._add_samples(5)
+
+        # Test
+        actual = self.sut.snapshot('conf', 2)
+
+        # Assert
+        self.assertEqual([1003, 1004], list(actual['timestamp']))
+        self.assertIsNotNone(actual.base)
+
+    def test_that_empty_buffer_gives_empty_snapshot(self):
+        # Fixture
+        self.sut.connect()
+
+        # Test
+        actual = self.sut.snapshot('conf')
+
+        # Assert
+        self.assertEqual(0, len(actual))
+
+    def test_that_data_is_exported_to_npz(self):
+        # Fixture
+        self.sut.connect()
+        self._add_samples(2)
+        file = io.BytesIO()
+
+        # Test
+        self.sut.save(file)
+
+        # Assert
+        file.seek(0)
+        actual = np.load(file)['conf']
+        self.assertEqual([1000, 1001], list(actual['timestamp']))
+
+    def test_that_recording_stops_on_disconnect(self):
+        # Fixture
+        self.sut.connect()
+        self._add_samples(1)
+
+        # Test
+        self.cf_mock.disconnected.call('uri')
+        self._add_samples(1)
+
+        # Assert
+        self.assertEqual(1, self.sut.sample_count('conf'))
+        self.assertFalse(self.sut.is_connected())
+
+
+class TimestampUnwrapperTest(unittest.TestCase):
+
+    def test_that_wrapped_timestamps_are_extended(self):
+        # Fixture
+        sut = _TimestampUnwrapper()
+
+        # Test
+        actual = [sut.unwrap(ts) for ts in
+                  [0xFFFFF0, 0xFFFFFA, 5, 15, 0xFFFFF0, 3]]
+
+        # Assert
+        self.assertEqual([0xFFFFF0, 0xFFFFFA, 0x1000005, 0x100000F,
+                          0x1FFFFF0, 0x2000003], actual)
+
+    def test_that_reordered_timestamp_is_not_a_wrap(self):
+        # Fixture
+        sut = _TimestampUnwrapper()
+        sut.unwrap(1000)
+
+        # Test
+        actual = sut.unwrap(990)
+
+        # Assert
+        self.assertEqual(990, actual)
+
+
+class SwarmLogRecorderTest(unittest.TestCase):
+
+    URIS = ['sim://0', 'sim://1', 'sim://2']
+
+    def setUp(self):
+        self.classes_patch = patch.object(cflib.crtp, 'CLASSES', [SimDriver])
+        self.classes_patch.start()
+        self.swarm = Swarm(self.URIS, factory=CachedCfFactory())
+        self.swarm.open_links()
+
+        self.log_config = LogConfig('power', 10)
+        self.log_config.add_variable('pm.vbat')
+
+    def tearDown(self):
+        self.swarm.close_links()
+        self.classes_patch.stop()
+        SimDriver.firmwares.clear()
+
+    def _record(self, samples):
+        sut = self.swarm.log_recorder(self.log_config)
+        with sut:
+            deadline = time.time() + 5
+            while sut.sample_count('power') < samples and \
+                    time.time() < deadline:
+                time.sleep(0.01)
+        return sut
+
+    def test_that_all_crazyflies_are_recorded_in_one_buffer(self):
+        # Fixture
+        # Test
+        sut = self._record(30)
+        actual = sut.to_numpy('power')
+
+        # Assert
+        self.assertEqual({0, 1, 2}, set(actual['uri']))
+        self.assertTrue((np.diff(actual['t']) >= 0).all())
+        self.assertEqual(np.uint64, actual['timestamp'].dtype)
+
+    def test_that_host_time_is_close_to_receive_time(self):
+        # Fixture
+        # Test
+        sut = self._record(30)
+        actual = sut.to_numpy('power', uri='sim://1')
+
+        # Assert
+        self.assertTrue((actual['uri'] == 1).all())
+        self.assertTrue((np.diff(actual['timestamp'].astype(np.int64)) > 0).all())
+        self.assertLess(np.abs(actual['t'] - actual['received']).max(), 0.05)
+        self.assertIsNotNone(sut.round_trips[1])
+        self.assertEqual(set(self.URIS), set(sut.clock_offsets()))
+
+    def test_that_round_trips_are_measured_in_parallel(self):
+        # Fixture
+        cfs = {uri: MagicMock(spec=Crazyflie) for uri in self.URIS}
+        sut = SwarmLogRecorder(cfs, [], echo_count=1)
+
+        # Test
+        start = time.perf_counter()
+        sut.connect()
+        elapsed = time.perf_counter() - start
+
+        # Assert
+        # One unanswered echo takes 0.5 s
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual([None] * len(self.URIS), sut.round_trips)
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  MA  02110-1301, USA.
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+from test.crazyflie.test_toc import create_param_toc_element
+from test.support.benchmark import benchmark
+from threading import Thread
+from unittest.mock import MagicMock
+
+from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.param import _ParamUpdater
+from cflib.crazyflie.param import Param
+from cflib.crazyflie.param import ParamTocElement
+from cflib.crazyflie.platformservice import PlatformService
+from cflib.crazyflie.toccache import TocCache
+from cflib.crtp.crtpstack import CRTPPacket
+from cflib.crtp.crtpstack import CRTPPort
+from cflib.utils.callbacks import Caller
+
+
+class ParamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cf_mock = MagicMock(spec=Crazyflie)
+        self.cf_mock.disconnected = Caller()
+        self.cf_mock.link = True
+        self.cf_mock.platform = MagicMock(spec=PlatformService)
+        self.cf_mock.platform.get_protocol_version.return_value = 4
+        self.cf_mock.send_packet.side_effect = self._reply
+
+        self.sut = Param(self.cf_mock)
+        self.sut._useV2 = True
+        self.sut.param_updater._useV2 = True
+        for i in range(4):
+            self.sut.toc.add_element(
+                create_param_toc_element(i, 'g', 'p%d' % i))
+        self.sut.toc.get_element_by_id(3).access = ParamTocElement.RO_ACCESS
+
+        self.values = {0: 10, 1: 11, 2: 12, 3: 13}
+
+    def _reply(self, pk, expected_reply=()):
+        var_id = struct.unpack('<H', pk.data[:2])[0]
+        reply = CRTPPacket()
+        if pk.channel == 1:
+            reply.set_header(CRTPPort.PARAM, 1)
+            reply.data = struct.pack('<HBB', var_id, 0, self.values[var_id])
+        else:
+            self.values[var_id] = pk.data[2]
+            reply.set_header(CRTPPort.PARAM, 2)
+            reply.data = pk.data
+        self.sut.param_updater._new_packet_cb(reply)
+
+    def test_that_values_are_read(self):
+        # Fixture
+
+        # Test
+        actual = self.sut.get_values(['g.p0', 'g.p2'], timeout=2)
+
+        # Assert
+        self.assertEqual({'g.p0': '10', 'g.p2': '12'}, actual)
+
+    def test_that_values_are_set(self):
+        # Fixture
+
+        # Test
+        actual = self.sut.set_values({'g.p0': 1, 'g.p1': 2}, timeout=2)
+
+        # Assert
+        self.assertEqual({'g.p0': '1', 'g.p1': '2'}, actual)
+        self.assertEqual(1, self.values[0])
+        self.assertEqual(2, self.values[1])
+
+    def test_that_replies_to_earlier_requests_are_skipped(self):
+        # Fixture
+        held = []
+        self.cf_mock.send_packet.side_effect = \
+            lambda pk, expected_reply=(): held.append(pk)
+        self.sut.request_param_update('g.p0')
+        while not held:
+            time.sleep(0.01)
+        self.cf_mock.send_packet.side_effect = self._reply
+        actual = {}
+        thread = Thread(target=lambda: actual.update(
+            self.sut.set_values({'g.p0': 1}, timeout=2)))
+        thread.start()
+        while self.sut.param_updater.outstanding_requests(0) < 2:
+            time.sleep(0.01)
+
+        # Test
+        self._reply(held[0])
+        thread.join()
+
+        # Assert
+        self.assertEqual({'g.p0': '1'}, actual)
+
+    def test_that_nothing_is_set_if_one_param_is_read_only(self):
+        # Fixture
+
+        # Test
+        # Assert
+        with self.assertRaises(AttributeError):
+            self.sut.set_values({'g.p0': 1, 'g.p3': 2})
+        self.cf_mock.send_packet.assert_not_called()
+
+    def test_that_unknown_param_raises(self):
+        # Fixture
+
+        # Test
+        # Assert
+        with self.assertRaises(KeyError):
+            self.sut.get_values(['g.unknown'])
+
+    def test_that_timeout_raises(self):
+        # Fixture
+        self.cf_mock.send_packet.side_effect = None
+
+        # Test
+        # Assert
+        with self.assertRaises(Exception):
+            self.sut.get_values(['g.p0'], timeout=0.1)
+
+
+class ParamValueCacheTest(unittest.TestCase):
+
+    URI = 'radio://0/80/2M/E7E7E7E701'
+    CRC = 0x12345678
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.toc_cache = TocCache(rw_cache=self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _create_sut(self):
+        cf_mock = MagicMock(spec=Crazyflie)
+        cf_mock.disconnected = Caller()
+        cf_mock.link_uri = self.URI
+        cf_mock.platform = MagicMock(spec=PlatformService)
+        cf_mock.platform.get_protocol_version.return_value = 4
+
+        sut = Param(cf_mock)
+        sut._useV2 = True
+        sut.use_value_cache = True
+        sut._toc_cache = self.toc_cache
+        sut.toc.crc = self.CRC
+        for i in range(3):
+            sut.toc.add_element(create_param_toc_element(i, 'g', 'p%d' % i))
+        sut.param_updater = MagicMock()
+        return sut
+
+    def _fetch_all(self, sut):
+        sut.request_update_of_all_params()
+        for i in range(3):
+            pk = CRTPPacket()
+            pk.set_header(CRTPPort.PARAM, 1)
+            pk.data = struct.pack('<HB', i, 10 + i)
+            sut._param_updated(pk)
+
+    def test_that_values_are_stored_when_all_are_updated(self):
+        # Fixture
+        sut = self._create_sut()
+
+        # Test
+        self._fetch_all(sut)
+
+        # Assert
+        actual = self.toc_cache.fetch_param_values(self.CRC, self.URI)
+        self.assertEqual({'g': {'p0': '10', 'p1': '11', 'p2': '12'}}, actual)
+
+    def test_that_cached_values_are_used_on_connect(self):
+        # Fixture
+        self._fetch_all(self._create_sut())
+        sut = self._create_sut()
+        all_updated = MagicMock()
+        sut.all_updated.add_callback(all_updated)
+
+        # Test
+        sut.request_update_of_all_params()
+
+        # Assert
+        all_updated.assert_called_once_with()
+        self.assertEqual('11', sut.values['g']['p1'])
+        self.assertEqual(
+            3, sut.param_updater.request_param_update.call_count)
+
+    def test_that_only_volatile_params_are_fetched_on_cache_hit(self):
+        # Fixture
+        self._fetch_all(self._create_sut())
+        sut = self._create_sut()
+        sut.volatile_params = {'g.p2'}
+
+        # Test
+        sut.request_update_of_all_params()
+
+        # Assert
+        sut.param_updater.request_param_update.assert_called_once_with(2)
+
+    def test_that_values_are_not_used_for_other_toc(self):
+        # Fixture
+        self._fetch_all(self._create_sut())
+        sut = self._create_sut()
+        sut.toc.crc = 0x87654321
+        all_updated = MagicMock()
+        sut.all_updated.add_callback(all_updated)
+
+        # Test
+        sut.request_update_of_all_params()
+
+        # Assert
+        all_updated.assert_not_called()
+        self.assertEqual({}, sut.values)
+
+
+class ParamUpdaterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cf_mock = MagicMock(spec=Crazyflie)
+        self.cf_mock.link = True
+        self.cf_mock.platform = MagicMock(spec=PlatformService)
+        self.cf_mock.platform.get_protocol_version.return_value = 4
+        self.updated_cb = MagicMock()
+
+        self.sut = _ParamUpdater(self.cf_mock, True, self.updated_cb,
+                                 window_size=4)
+        self.sut.start()
+
+    def _wait_for_send_count(self, count):
+        timeout = time.time() + 2
+        while self.cf_mock.send_packet.call_count < count and \
+                time.time() < timeout:
+            time.sleep(0.01)
+        # Give the thread a chance to send more packets than expected
+        time.sleep(0.05)
+
+    def _reply(self, var_id):
+        pk = CRTPPacket()
+        pk.set_header(CRTPPort.PARAM, 1)
+        pk.data = struct.pack('<HBB', var_id, 0, 0)
+        self.sut._new_packet_cb(pk)
+
+    def test_that_window_of_requests_is_sent(self):
+        # Fixture
+
+        # Test
+        for i in range(6):
+            self.sut.request_param_update(i)
+        self._wait_for_send_count(4)
+
+        # Assert
+        self.assertEqual(4, self.cf_mock.send_packet.call_count)
+
+    def test_that_replies_open_the_window(self):
+        # Fixture
+        for i in range(6):
+            self.sut.request_param_update(i)
+        self._wait_for_send_count(4)
+
+        # Test
+        self._reply(2)
+        self._reply(0)
+        self._wait_for_send_count(6)
+
+        # Assert
+        self.assertEqual(6, self.cf_mock.send_packet.call_count)
+        self.assertEqual(2, self.updated_cb.call_count)
+
+    def test_that_only_one_request_per_var_id_is_in_flight(self):
+        # Fixture
+
+        # Test
+        self.sut.request_param_update(1)
+        self.sut.request_param_update(1)
+        self._wait_for_send_count(1)
+
+        # Assert
+        self.assertEqual(1, self.cf_mock.send_packet.call_count)
+
+    def test_that_repeated_var_id_does_not_hold_up_other_requests(self):
+        # Fixture
+
+        # Test
+        for var_id in [1, 1, 1, 2, 3]:
+            self.sut.request_param_update(var_id)
+        self._wait_for_send_count(3)
+
+        # Assert
+        self.assertEqual(3, self.cf_mock.send_packet.call_count)
+
+    def test_that_backlog_of_var_id_is_sent_after_reply(self):
+        # Fixture
+        for var_id in [1, 1, 2]:
+            self.sut.request_param_update(var_id)
+        self._wait_for_send_count(2)
+
+        # Test
+        self._reply(1)
+        self._wait_for_send_count(3)
+
+        # Assert
+        self.assertEqual(3, self.cf_mock.send_packet.call_count)
+        self.assertEqual(1, self.sut.outstanding_requests(1))
+
+    def test_that_updated_callback_is_called_without_lock(self):
+        # Fixture
+        requester = Thread(target=self.sut.request_param_update, args=(5,))
+
+        def updated_cb(pk):
+            requester.start()
+            requester.join(1)
+
+        self.sut.updated_callback = updated_cb
+        self.sut.request_param_update(1)
+        self._wait_for_send_count(1)
+
+        # Test
+        self._reply(1)
+
+        # Assert
+        self.assertFalse(requester.is_alive())
+
+    def test_that_unrequested_replies_are_ignored(self):
+        # Fixture
+
+        # Test
+        self._reply(3)
+
+        # Assert
+        self.updated_cb.assert_not_called()
+
+
+@benchmark
+class ParamSyncBenchmark(unittest.TestCase):
+
+    def _create_sut(self, toc_size):
+        cf_mock = MagicMock(spec=Crazyflie)
+        cf_mock.disconnected = Caller()
+
+        sut = Param(cf_mock)
+        sut._useV2 = True
+        for i in range(toc_size):
+            sut.toc.add_element(
+                create_param_toc_element(i, 'group%d' % (i // 10),
+                                         'param%d' % i))
+        return sut
+
+    def _sync_time_per_entry(self, toc_size):
+        sut = self._create_sut(toc_size)
+        packets = []
+        for i in range(toc_size):
+            pk = CRTPPacket()
+            pk.set_header(CRTPPort.PARAM, 1)
+            pk.data = struct.pack('<HB', i, i & 0xff)
+            packets.append(pk)
+
+        all_updated = []
+        sut.all_updated.add_callback(lambda: all_updated.append(True))
+
+        start = time.perf_counter()
+        for pk in packets:
+            sut._param_updated(pk)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual([True], all_updated)
+        self.assertEqual('17', sut.values['group1']['param17'])
+        return elapsed / toc_size
+
+    def test_connect_time_param_sync(self):
+        # Fixture
+        # Test
+        small = self._sync_time_per_entry(200)
+        large = self._sync_time_per_entry(2000)
+
+        # Assert
+        # Elements are looked up by id, the time per entry does not grow
+        # with the size of the TOC
+        self.assertLess(large, small * 3, (small, large))
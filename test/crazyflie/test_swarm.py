@@ -21,11 +21,28 @@
 #  along with this program; if not, write to the Free Software
 #  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 #  MA  02110-1301, USA.
+import struct
+import threading
+import time
 import unittest
+from test.support.benchmark import benchmark
+from test.support.benchmark import SimBenchmarkCase
 from unittest.mock import MagicMock
+from unittest.mock import patch
 
+import numpy as np
+
+import cflib.crtp
+from cflib.crazyflie.high_level_commander import HighLevelCommander
+from cflib.crazyflie.localization import Localization
+from cflib.crazyflie.mem import MemoryElement
+from cflib.crazyflie.mem import TrajectoryMemory
+from cflib.crazyflie.swarm import CachedCfFactory
+from cflib.crazyflie.swarm import ExtposPublisher
 from cflib.crazyflie.swarm import Swarm
 from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
+from cflib.crtp.packetqueue import PacketQueue
+from cflib.crtp.simdriver import SimDriver
 
 
 class TestSwarm(unittest.TestCase):
@@ -80,6 +97,163 @@ class TestSwarm(unittest.TestCase):
         for uri, mock in self.factory.mocks.items():
             mock.close_link.assert_called_once_with()
 
+    def test_that_parallel_safe_returns_results_keyed_on_uri(self):
+        # Fixture
+        args_dict = {self.URI1: [1], self.URI2: [2], self.URI3: [3]}
+
+        # Test
+        actual = self.sut.parallel_safe(lambda scf, value: value * 10,
+                                        args_dict=args_dict)
+
+        # Assert
+        self.assertEqual({self.URI1: 10, self.URI2: 20, self.URI3: 30},
+                         actual)
+
+    def test_that_parallel_returns_results_without_errors(self):
+        # Fixture
+        def func(scf):
+            if scf is self.factory.mocks[self.URI2]:
+                raise Exception()
+            return True
+
+        # Test
+        actual = self.sut.parallel(func)
+
+        # Assert
+        self.assertEqual({self.URI1: True, self.URI3: True}, actual)
+
+    def test_that_worker_threads_are_reused(self):
+        # Fixture
+        threads = set()
+
+        # Test
+        for _ in range(10):
+            self.sut.parallel_safe(
+                lambda scf: threads.add(threading.get_ident()))
+
+        # Assert
+        self.assertLessEqual(len(threads), len(self.uris))
+
+    def test_that_submit_all_returns_futures(self):
+        # Fixture
+        done = threading.Event()
+
+        # Test
+        futures = self.sut.submit_all(lambda scf: done.wait(1))
+
+        # Assert
+        self.assertEqual(set(self.uris), set(futures))
+        done.set()
+        self.assertEqual({uri: True for uri in self.uris},
+                         Swarm.wait_all(futures, timeout=1))
+
+    def test_that_parallel_safe_raises_on_timeout(self):
+        # Fixture
+        done = threading.Event()
+
+        def func(scf):
+            if scf is self.factory.mocks[self.URI3]:
+                done.wait(1)
+
+        # Test
+        # Assert
+        with self.assertRaises(Exception) as context:
+            self.sut.parallel_safe(func, timeout=0.05)
+        done.set()
+        self.assertIn(self.URI3, str(context.exception))
+        self.assertNotIn(self.URI1, str(context.exception))
+
+    def test_that_new_workers_are_used_after_timeout(self):
+        # Fixture
+        done = threading.Event()
+
+        def func(scf):
+            if scf is self.factory.mocks[self.URI3]:
+                done.wait(1)
+
+        with self.assertRaises(Exception):
+            self.sut.parallel_safe(func, timeout=0.05)
+        barrier = threading.Barrier(len(self.uris), timeout=1)
+
+        # Test
+        actual = self.sut.parallel_safe(lambda scf: barrier.wait() >= 0,
+                                        timeout=1)
+        done.set()
+
+        # Assert
+        self.assertEqual({uri: True for uri in self.uris}, actual)
+
+    def test_that_nested_parallel_safe_is_run_in_calling_thread(self):
+        # Fixture
+        def inner(scf):
+            return threading.get_ident()
+
+        def outer(scf):
+            results = self.sut.parallel_safe(inner, timeout=1)
+            return set(results.values()) == {threading.get_ident()}
+
+        # Test
+        actual = self.sut.parallel_safe(outer, timeout=1)
+
+        # Assert
+        self.assertEqual({uri: True for uri in self.uris}, actual)
+
+    def test_that_failed_open_is_retried(self):
+        # Fixture
+        mock = self.factory.mocks[self.URI2]
+        mock.open_link.side_effect = [Exception('No answer'), None]
+
+        # Test
+        actual = self.sut.open_links(retries=1, retry_delay=0)
+
+        # Assert
+        self.assertEqual(2, mock.open_link.call_count)
+        self.assertEqual(2, actual[self.URI2]['attempts'])
+        self.assertEqual('No answer', actual[self.URI2]['error'])
+        self.assertEqual(1, actual[self.URI1]['attempts'])
+        self.assertIsNotNone(actual[self.URI1]['latency'])
+
+    def test_that_concurrent_connects_are_limited(self):
+        # Fixture
+        self._track_concurrency(self.factory.mocks.values())
+
+        # Test
+        self.sut.open_links(max_concurrency=2)
+
+        # Assert
+        self.assertEqual(2, self.max_concurrent)
+
+    def test_that_concurrent_connects_are_limited_per_dongle(self):
+        # Fixture
+        factory = MockFactory()
+        uris = ['radio://0/10/2M/E7E7E7E701', 'radio://0/10/2M/E7E7E7E702',
+                'radio://1/80/2M/E7E7E7E703', 'radio://1/80/2M/E7E7E7E704']
+        sut = Swarm(uris, factory=factory)
+        self._track_concurrency(factory.mocks.values())
+
+        # Test
+        sut.open_links(max_concurrency=1, group_by_dongle=True)
+
+        # Assert
+        self.assertEqual(2, self.max_concurrent)
+
+    def _track_concurrency(self, mocks):
+        self.concurrent = 0
+        self.max_concurrent = 0
+        lock = threading.Lock()
+
+        def open_link():
+            with lock:
+                self.concurrent += 1
+                self.max_concurrent = max(self.max_concurrent,
+                                          self.concurrent)
+            time.sleep(0.05)
+            with lock:
+                self.concurrent -= 1
+
+        for mock in mocks:
+            mock.open_link.side_effect = open_link
+
     def test_that_all_links_are_closed(self):
         # Fixture
         self.sut.open_links()
@@ -205,6 +379,376 @@ class TestSwarm(unittest.TestCase):
             self.sut.parallel_safe(func_fail, args_dict=args_dict)
 
 
+class TestExtposPublisher(unittest.TestCase):
+    URIS = ['radio://0/10/2M/E7E7E7E701', 'radio://0/10/2M/E7E7E7E702',
+            'radio://1/80/2M/E7E7E7E703', 'radio://0/10/2M/E7E7E7E704']
+
+    def setUp(self):
+        self.sent = []
+        self.cfs = {}
+        for uri in self.URIS:
+            scf = MagicMock()
+            scf.cf.send_packet.side_effect = \
+                lambda pk, uri=uri: self.sent.append((uri, pk))
+            self.cfs[uri] = scf
+
+        self.sut = ExtposPublisher(self.cfs)
+
+    def test_that_positions_are_packed_like_send_extpos(self):
+        # Fixture
+        poses = np.arange(12, dtype=float).reshape(4, 3) / 10
+
+        # Test
+        self.sut.publish(poses)
+
+        # Assert
+        actual = dict(self.sent)
+        for uri, pos in zip(self.URIS, poses):
+            pk = actual[uri]
+            self.assertEqual(Localization.POSITION_CH, pk.channel)
+            self.assertEqual(struct.pack('<fff', *pos), bytes(pk.data))
+
+    def test_that_poses_are_packed_like_send_extpose(self):
+        # Fixture
+        poses = np.arange(28, dtype=float).reshape(4, 7)
+
+        # Test
+        self.sut.publish(poses)
+
+        # Assert
+        actual = dict(self.sent)
+        pk = actual[self.URIS[2]]
+        self.assertEqual(Localization.GENERIC_CH, pk.channel)
+        self.assertEqual(struct.pack('<Bfffffff', Localization.EXT_POSE,
+                                     *poses[2]), bytes(pk.data))
+
+    def test_that_sends_alternate_between_radios(self):
+        # Fixture
+        # Test
+        self.sut.publish(np.zeros((4, 3)))
+
+        # Assert
+        actual = [uri for uri, _ in self.sent]
+        expected = [self.URIS[0], self.URIS[2], self.URIS[1], self.URIS[3]]
+        self.assertEqual(expected, actual)
+
+    def test_that_rows_that_are_not_finite_are_skipped(self):
+        # Fixture
+        poses = np.zeros((4, 3))
+        poses[1, 0] = np.nan
+
+        # Test
+        actual = self.sut.publish(poses, timestamp=0)
+
+        # Assert
+        self.assertEqual(3, actual)
+        self.assertEqual(3, len(self.sent))
+        self.assertTrue(np.isnan(self.sut.last_staleness[1]))
+        self.assertTrue((self.sut.last_staleness[[0, 2, 3]] > 0).all())
+        self.assertEqual(1, self.sut.skipped)
+        self.assertEqual(3, self.sut.staleness.count)
+
+    def test_that_staleness_is_recorded_when_packet_is_taken_from_queue(self):
+        # Fixture
+        out_queue = PacketQueue()
+        scf = self.cfs[self.URIS[0]]
+        scf.cf.link.out_queue = out_queue
+        scf.cf.send_packet.side_effect = out_queue.put
+
+        self.sut.publish(np.zeros((4, 3)), timestamp=0)
+        self.assertTrue(np.isnan(self.sut.last_staleness[0]))
+        self.assertEqual(3, self.sut.staleness.count)
+
+        # Test
+        out_queue.get()
+
+        # Assert
+        self.assertGreater(self.sut.last_staleness[0], 0)
+        self.assertEqual(4, self.sut.staleness.count)
+
+    def test_that_superseded_pose_is_not_recorded(self):
+        # Fixture
+        out_queue = PacketQueue()
+        scf = self.cfs[self.URIS[0]]
+        scf.cf.link.out_queue = out_queue
+        scf.cf.send_packet.side_effect = out_queue.put
+
+        self.sut.publish(np.zeros((4, 3)), timestamp=0)
+        self.sut.publish(np.zeros((4, 3)), timestamp=time.perf_counter())
+
+        # Test
+        out_queue.get()
+
+        # Assert
+        self.assertTrue(out_queue.empty())
+        self.assertEqual(7, self.sut.staleness.count)
+        self.assertLess(self.sut.last_staleness[0], 1)
+
+    def test_that_close_stops_watching_the_queue(self):
+        # Fixture
+        out_queue = PacketQueue()
+        scf = self.cfs[self.URIS[0]]
+        scf.cf.link.out_queue = out_queue
+        scf.cf.send_packet.side_effect = out_queue.put
+        self.sut.publish(np.zeros((4, 3)))
+
+        # Test
+        self.sut.close()
+
+        # Assert
+        self.assertEqual([], out_queue.packet_taken.callbacks)
+
+    def test_that_wrong_number_of_rows_raises(self):
+        # Fixture
+        # Test
+        # Assert
+        with self.assertRaises(Exception):
+            self.sut.publish(np.zeros((3, 3)))
+
+
+def create_trajectory(segments, value):
+    return np.full((segments, TrajectoryMemory.SEGMENT_LENGTH), value,
+                   dtype=np.float32)
+
+
+class TestTrajectoryDistributor(unittest.TestCase):
+
+    URIS = ['sim://0', 'sim://1', 'sim://2']
+
+    def setUp(self):
+        self.classes_patch = patch.object(cflib.crtp, 'CLASSES', [SimDriver])
+        self.classes_patch.start()
+        self.define_patch = patch.object(HighLevelCommander,
+                                         'define_trajectory', autospec=True)
+        self.define_mock = self.define_patch.start()
+        self.sut = Swarm(self.URIS, factory=CachedCfFactory())
+        self.sut.open_links()
+
+    def tearDown(self):
+        self.sut.close_links()
+        self.define_patch.stop()
+        self.classes_patch.stop()
+        SimDriver.firmwares.clear()
+
+    def _memory(self, uri):
+        return SimDriver.firmwares[uri[len('sim://'):]].memories[1][1]
+
+    def _defined(self):
+        return sorted(call.args[1:] for call in self.define_mock.call_args_list)
+
+    def test_that_shared_trajectory_is_uploaded_and_defined(self):
+        # Fixture
+        trajectory = create_trajectory(3, 1.5)
+
+        # Test
+        actual = self.sut.upload_trajectories(
+            {uri: {1: trajectory} for uri in self.URIS})
+
+        # Assert
+        data = trajectory.tobytes()
+        for uri in self.URIS:
+            self.assertEqual(data, self._memory(uri)[0:len(data)])
+            self.assertEqual(len(data), actual[uri]['uploaded'])
+        self.assertEqual([(1, 0, 3)] * 3, self._defined())
+
+    def test_that_trajectory_in_memory_is_not_uploaded_again(self):
+        # Fixture
+        trajectory = create_trajectory(3, 1.5)
+        self.sut.upload_trajectories({'sim://0': {1: trajectory}})
+        self._memory('sim://0')[0:4] = bytes(4)
+
+        # Test
+        actual = self.sut.upload_trajectories(
+            {'sim://0': {1: create_trajectory(3, 1.5)}})
+
+        # Assert
+        self.assertEqual({'uploaded': 0, 'reused': 1},
+                         {key: actual['sim://0'][key]
+                          for key in ['uploaded', 'reused']})
+        self.assertEqual(bytes(4), self._memory('sim://0')[0:4])
+        self.assertEqual([(1, 0, 3)] * 2, self._defined())
+
+    def test_that_new_trajectory_is_put_after_the_old_ones(self):
+        # Fixture
+        self.sut.upload_trajectories(
+            {'sim://0': {1: create_trajectory(3, 1.5)}})
+
+        # Test
+        self.sut.upload_trajectories(
+            {'sim://0': {1: create_trajectory(3, 1.5),
+                         2: create_trajectory(2, 2.5)}})
+
+        # Assert
+        self.assertEqual([(1, 0, 3), (1, 0, 3), (2, 396, 2)],
+                         self._defined())
+        self.assertEqual(create_trajectory(2, 2.5).tobytes(),
+                         self._memory('sim://0')[396:660])
+
+    def test_that_full_memory_is_rewritten_from_the_start(self):
+        # Fixture
+        self.sut.upload_trajectories(
+            {'sim://0': {1: create_trajectory(20, 1.5)}})
+
+        # Test
+        self.sut.upload_trajectories(
+            {'sim://0': {2: create_trajectory(20, 2.5)}})
+
+        # Assert
+        self.assertEqual([(1, 0, 20), (2, 0, 20)], self._defined())
+
+    def test_that_trajectory_is_uploaded_again_after_other_write(self):
+        # Fixture
+        trajectory = create_trajectory(3, 1.5)
+        self.sut.upload_trajectories({'sim://0': {1: trajectory}})
+        cf = self.sut._cfs['sim://0'].cf
+        mem = cf.mem.get_mems(MemoryElement.TYPE_TRAJ)[0]
+        done = threading.Event()
+        mem.poly4Ds = create_trajectory(1, 9.0)
+        mem.write_data(lambda *args: done.set())
+        self.assertTrue(done.wait(5))
+
+        # Test
+        actual = self.sut.upload_trajectories({'sim://0': {1: trajectory}})
+
+        # Assert
+        self.assertEqual(len(trajectory.tobytes()),
+                         actual['sim://0']['uploaded'])
+        self.assertEqual(trajectory.tobytes(),
+                         self._memory('sim://0')[0:len(trajectory.tobytes())])
+
+    def test_that_ids_in_overwritten_memory_are_reported_stale(self):
+        # Fixture
+        self.sut.upload_trajectories(
+            {'sim://0': {1: create_trajectory(20, 1.5)}})
+
+        # Test
+        actual = self.sut.upload_trajectories(
+            {'sim://0': {2: create_trajectory(20, 2.5)}})
+
+        # Assert
+        self.assertEqual([1], actual['sim://0']['stale'])
+
+    def test_that_trajectory_is_uploaded_again_after_reconnect(self):
+        # Fixture
+        trajectory = create_trajectory(3, 1.5)
+        self.sut.upload_trajectories({'sim://0': {1: trajectory}})
+        self.sut.close_links()
+        self.sut.open_links()
+
+        # Test
+        actual = self.sut.upload_trajectories({'sim://0': {1: trajectory}})
+
+        # Assert
+        self.assertEqual(len(trajectory.tobytes()),
+                         actual['sim://0']['uploaded'])
+
+    def test_that_too_large_trajectory_raises(self):
+        # Fixture
+        # Test
+        # Assert
+        with self.assertRaises(Exception):
+            self.sut.upload_trajectories(
+                {'sim://0': {1: create_trajectory(40, 1.5)}})
+
+
+@benchmark
+class SwarmTrajectoryUploadBenchmark(SimBenchmarkCase):
+
+    SWARM_SIZE = 10
+    SEGMENTS = 30
+
+    def test_upload_of_shared_trajectory(self):
+        # Fixture
+        uris = ['sim://{}?latency=2'.format(i)
+                for i in range(self.SWARM_SIZE)]
+        trajectory = create_trajectory(self.SEGMENTS, 0.5)
+        trajectories = {uri: {1: trajectory} for uri in uris}
+        swarm = Swarm(uris, factory=CachedCfFactory())
+        swarm.open_links()
+
+        # Test
+        times = []
+        for _ in range(2):
+            start = time.perf_counter()
+            swarm.upload_trajectories(trajectories)
+            times.append(time.perf_counter() - start)
+        swarm.close_links()
+
+        # Assert
+        # The trajectory is already in place the second time, only the
+        # trajectory definitions are sent
+        self.assertLess(times[1], times[0] / 2, times)
+
+
+@benchmark
+class SwarmOpenLinksBenchmark(SimBenchmarkCase):
+
+    SWARM_SIZE = 20
+
+    def _measure(self, max_concurrency):
+        uris = ['sim://{}?latency=2'.format(i)
+                for i in range(self.SWARM_SIZE)]
+        swarm = Swarm(uris, factory=CachedCfFactory())
+
+        start = time.perf_counter()
+        report = swarm.open_links(max_concurrency=max_concurrency,
+                                  wait_for_params=True)
+        duration = time.perf_counter() - start
+        swarm.close_links()
+        SimDriver.firmwares.clear()
+
+        self.assertEqual(self.SWARM_SIZE, len(report))
+        return duration
+
+    def test_open_links_with_simulated_crazyflies(self):
+        # Fixture
+        # Test
+        sequential = self._measure(1)
+        concurrent = self._measure(5)
+
+        # Assert
+        # Links are set up at the same time, waiting for answers from one
+        # Crazyflie does not hold up the others
+        self.assertLess(concurrent, sequential / 2, (sequential, concurrent))
+
+
+@benchmark
+class SwarmParallelBenchmark(unittest.TestCase):
+
+    SWARM_SIZE = 30
+    CALLS = 200
+
+    @staticmethod
+    def _thread_per_crazyflie(sut, func):
+        # How parallel_safe() ran before the worker pool
+        threads = [threading.Thread(target=func, args=(scf,))
+                   for scf in sut._cfs.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _measure(self, call):
+        start = time.perf_counter()
+        for _ in range(self.CALLS):
+            call()
+        return (time.perf_counter() - start) / self.CALLS
+
+    def test_parallel_safe_call_overhead(self):
+        # Fixture
+        sut = Swarm(['uri{}'.format(i) for i in range(self.SWARM_SIZE)],
+                    factory=MockFactory())
+
+        # Test
+        threads = self._measure(
+            lambda: self._thread_per_crazyflie(sut, lambda scf: None))
+        pool = self._measure(lambda: sut.parallel_safe(lambda scf: None))
+        sut.close_links()
+
+        # Assert
+        self.assertLess(pool, threads, (threads, pool))
+
+
 class MockFactory:
 
     def __init__(self):
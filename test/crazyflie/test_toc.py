@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  MA  02110-1301, USA.
+import struct
+import unittest
+from unittest.mock import MagicMock
+
+from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.param import ParamTocElement
+from cflib.crazyflie.platformservice import PlatformService
+from cflib.crazyflie.toc import Toc
+from cflib.crazyflie.toc import TocFetcher
+from cflib.crazyflie.toccache import TocCache
+from cflib.crtp.crtpstack import CRTPPacket
+from cflib.crtp.crtpstack import CRTPPort
+
+
+def create_param_toc_element(ident, group, name):
+    data = bytearray((0x08,)) + \
+        '{}\0{}\0'.format(group, name).encode('ISO-8859-1')
+    return ParamTocElement(ident, data)
+
+
+class TocTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = Toc()
+        self.element_a = create_param_toc_element(0, 'g1', 'a')
+        self.element_b = create_param_toc_element(1, 'g1', 'b')
+        self.element_c = create_param_toc_element(2, 'g2', 'c')
+
+    def test_that_element_is_found_by_id(self):
+        # Fixture
+        self.sut.add_element(self.element_a)
+        self.sut.add_element(self.element_c)
+
+        # Test
+        actual = self.sut.get_element_by_id(2)
+
+        # Assert
+        self.assertEqual(self.element_c, actual)
+
+    def test_that_unknown_id_returns_none(self):
+        # Fixture
+        self.sut.add_element(self.element_a)
+
+        # Test
+        # Assert
+        self.assertIsNone(self.sut.get_element_by_id(17))
+        self.assertIsNone(self.sut.get_element_by_id(None))
+
+    def test_that_negative_id_returns_none(self):
+        # Fixture
+        self.sut.add_element(self.element_a)
+
+        # Test
+        # Assert
+        self.assertIsNone(self.sut.get_element_by_id(-1))
+
+    def test_that_element_is_found_by_complete_name(self):
+        # Fixture
+        self.sut.add_element(self.element_a)
+        self.sut.add_element(self.element_b)
+
+        # Test
+        actual = self.sut.get_element_by_complete_name('g1.b')
+
+        # Assert
+        self.assertEqual(self.element_b, actual)
+
+    def test_that_element_id_is_found_by_complete_name(self):
+        # Fixture
+        self.sut.add_element(self.element_c)
+
+        # Test
+        # Assert
+        self.assertEqual(2, self.sut.get_element_id('g2.c'))
+        self.assertIsNone(self.sut.get_element_id('g2.unknown'))
+
+    def test_that_indexes_are_rebuilt_when_toc_is_replaced(self):
+        # Fixture
+        self.sut.add_element(self.element_a)
+        toc = {'g1': {'b': self.element_b}, 'g2': {'c': self.element_c}}
+
+        # Test
+        self.sut.toc = toc
+
+        # Assert
+        self.assertIsNone(self.sut.get_element_by_id(0))
+        self.assertEqual(self.element_b, self.sut.get_element_by_id(1))
+        self.assertEqual(self.element_c,
+                         self.sut.get_element_by_complete_name('g2.c'))
+        self.assertEqual(2, self.sut.nbr_of_elements())
+
+    def test_that_clear_removes_all_elements(self):
+        # Fixture
+        self.sut.add_element(self.element_a)
+
+        # Test
+        self.sut.clear()
+
+        # Assert
+        self.assertEqual({}, self.sut.toc)
+        self.assertIsNone(self.sut.get_element_by_id(0))
+        self.assertEqual(0, self.sut.nbr_of_elements())
+
+
+class TocFetcherTest(unittest.TestCase):
+
+    NBR_OF_ITEMS = 10
+
+    def setUp(self):
+        self.cf_mock = MagicMock(spec=Crazyflie)
+        self.cf_mock.platform = MagicMock(spec=PlatformService)
+        self.cf_mock.platform.get_protocol_version.return_value = 4
+
+        self.toc_cache_mock = MagicMock(spec=TocCache)
+        self.toc_cache_mock.fetch.return_value = None
+
+        self.toc = Toc()
+        self.finished_cb = MagicMock()
+
+    def _create_sut(self, window_size):
+        return TocFetcher(self.cf_mock, ParamTocElement, CRTPPort.PARAM,
+                          self.toc, self.finished_cb, self.toc_cache_mock,
+                          window_size=window_size)
+
+    def _packet(self, data):
+        pk = CRTPPacket()
+        pk.set_header(CRTPPort.PARAM, 0)
+        pk.data = data
+        return pk
+
+    def _info_reply(self, use_v2=True):
+        if use_v2:
+            return self._packet(struct.pack('<BHI', 3, self.NBR_OF_ITEMS,
+                                            0x12345678))
+        return self._packet(struct.pack('<BBI', 1, self.NBR_OF_ITEMS,
+                                        0x12345678))
+
+    def _item_reply(self, ident, use_v2=True):
+        name = bytearray((0x08,)) + 'g\0p{}\0'.format(ident).encode()
+        if use_v2:
+            return self._packet(struct.pack('<BH', 2, ident) + name)
+        return self._packet(struct.pack('<BB', 0, ident) + name)
+
+    def _requested_items(self):
+        return [tuple(c[0][0].data) for c in
+                self.cf_mock.send_packet.call_args_list[1:]]
+
+    def test_that_window_of_requests_is_sent(self):
+        # Fixture
+        sut = self._create_sut(4)
+        sut.start()
+
+        # Test
+        sut._new_packet_cb(self._info_reply())
+
+        # Assert
+        expected = [(2, i, 0) for i in range(4)]
+        self.assertEqual(expected, self._requested_items())
+
+    def test_that_out_of_order_replies_are_accepted(self):
+        # Fixture
+        sut = self._create_sut(4)
+        sut.start()
+        sut._new_packet_cb(self._info_reply())
+
+        # Test
+        for ident in [3, 1, 0, 2, 5, 4, 7, 6, 9, 8]:
+            sut._new_packet_cb(self._item_reply(ident))
+
+        # Assert
+        self.finished_cb.assert_called_once_with()
+        self.assertEqual(self.NBR_OF_ITEMS, self.toc.nbr_of_elements())
+        self.assertEqual(self.NBR_OF_ITEMS + 1,
+                         self.cf_mock.send_packet.call_count)
+        self.toc_cache_mock.insert.assert_called_once_with(
+            0x12345678, self.toc.toc)
+
+    def test_that_duplicate_replies_are_ignored(self):
+        # Fixture
+        sut = self._create_sut(4)
+        sut.start()
+        sut._new_packet_cb(self._info_reply())
+
+        # Test
+        sut._new_packet_cb(self._item_reply(1))
+        sut._new_packet_cb(self._item_reply(1))
+
+        # Assert
+        self.assertEqual(5, len(self._requested_items()))
+
+    def test_that_v1_protocol_fetches_one_item_at_a_time(self):
+        # Fixture
+        self.cf_mock.platform.get_protocol_version.return_value = 3
+        sut = self._create_sut(4)
+        sut.start()
+
+        # Test
+        sut._new_packet_cb(self._info_reply(use_v2=False))
+
+        # Assert
+        self.assertEqual([(0, 0)], self._requested_items())
+
+        # Test
+        sut._new_packet_cb(self._item_reply(0, use_v2=False))
+
+        # Assert
+        self.assertEqual([(0, 0), (0, 1)], self._requested_items())
+
+    def test_that_toc_is_loaded_from_cache(self):
+        # Fixture
+        element = create_param_toc_element(0, 'g', 'p')
+        self.toc_cache_mock.fetch.return_value = {'g': {'p': element}}
+        sut = self._create_sut(4)
+        sut.start()
+
+        # Test
+        sut._new_packet_cb(self._info_reply())
+
+        # Assert
+        self.finished_cb.assert_called_once_with()
+        self.assertEqual(element, self.toc.get_element_by_id(0))
+        self.assertEqual([], self._requested_items())
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  MA  02110-1301, USA.
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from test.crazyflie.test_toc import create_param_toc_element
+from test.support.benchmark import benchmark
+
+from cflib.crazyflie.log import LogTocElement
+from cflib.crazyflie.param import ParamTocElement
+from cflib.crazyflie.toccache import TocCache
+
+
+def create_param_toc(size):
+    toc = {}
+    for i in range(size):
+        element = create_param_toc_element(i, 'group%d' % (i // 10),
+                                           'param%d' % i)
+        toc.setdefault(element.group, {})[element.name] = element
+    return toc
+
+
+class TocCacheTest(unittest.TestCase):
+
+    CRC = 0x12345678
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        TocCache.clear_decoded()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        TocCache.clear_decoded()
+
+    def _assert_toc_equal(self, expected, actual):
+        self.assertEqual(set(expected.keys()), set(actual.keys()))
+        for group in expected:
+            for name, element in expected[group].items():
+                other = actual[group][name]
+                self.assertEqual(type(element), type(other))
+                for attr in ('ident', 'group', 'name', 'ctype', 'pytype',
+                             'access'):
+                    self.assertEqual(getattr(element, attr),
+                                     getattr(other, attr))
+
+    def test_that_toc_is_saved_and_loaded(self):
+        # Fixture
+        toc = create_param_toc(25)
+        TocCache(rw_cache=self.cache_dir).insert(self.CRC, toc)
+        TocCache.clear_decoded()
+
+        # Test
+        actual = TocCache(rw_cache=self.cache_dir).fetch(self.CRC)
+
+        # Assert
+        self._assert_toc_equal(toc, actual)
+
+    def test_that_log_toc_is_saved_and_loaded(self):
+        # Fixture
+        element = LogTocElement(3, bytearray((0x07,)) + b'stab\0roll\0')
+        toc = {'stab': {'roll': element}}
+        TocCache(rw_cache=self.cache_dir).insert(self.CRC, toc)
+        TocCache.clear_decoded()
+
+        # Test
+        actual = TocCache(rw_cache=self.cache_dir).fetch(self.CRC)
+
+        # Assert
+        self._assert_toc_equal(toc, actual)
+
+    def test_that_unknown_crc_is_a_miss(self):
+        # Fixture
+        TocCache(rw_cache=self.cache_dir).insert(self.CRC, create_param_toc(1))
+
+        # Test
+        actual = TocCache(rw_cache=self.cache_dir).fetch(0x11111111)
+
+        # Assert
+        self.assertIsNone(actual)
+
+    def test_that_json_cache_is_read(self):
+        # Fixture
+        element = create_param_toc_element(0, 'g', 'p')
+        with open(os.path.join(self.cache_dir, '%08X.json' % self.CRC),
+                  'w') as f:
+            json.dump({'g': {'p': {
+                '__class__': 'ParamTocElement', 'ident': 0, 'group': 'g',
+                'name': 'p', 'ctype': element.ctype,
+                'pytype': element.pytype, 'access': element.access}}}, f)
+
+        # Test
+        actual = TocCache(ro_cache=self.cache_dir).fetch(self.CRC)
+
+        # Assert
+        self._assert_toc_equal({'g': {'p': element}}, actual)
+
+    def test_that_unknown_class_in_json_cache_is_not_evaluated(self):
+        # Fixture
+        with open(os.path.join(self.cache_dir, '%08X.json' % self.CRC),
+                  'w') as f:
+            json.dump({'g': {'p': {'__class__': 'print', 'ident': 0}}}, f)
+
+        # Test
+        actual = TocCache(ro_cache=self.cache_dir).fetch(self.CRC)
+
+        # Assert
+        self.assertIsNone(actual)
+
+    def test_that_decoded_toc_is_shared_between_instances(self):
+        # Fixture
+        TocCache(rw_cache=self.cache_dir).insert(self.CRC, create_param_toc(5))
+        TocCache.clear_decoded()
+        first = TocCache(rw_cache=self.cache_dir).fetch(self.CRC)
+
+        # Test
+        second = TocCache(rw_cache=self.cache_dir).fetch(self.CRC)
+
+        # Assert
+        self.assertIsNot(first, second)
+        self.assertIs(first['group0']['param0'], second['group0']['param0'])
+
+    def test_that_fetched_toc_can_be_modified_without_affecting_cache(self):
+        # Fixture
+        TocCache(rw_cache=self.cache_dir).insert(self.CRC, create_param_toc(5))
+        first = TocCache(rw_cache=self.cache_dir).fetch(self.CRC)
+
+        # Test
+        first['group0'].clear()
+
+        # Assert
+        second = TocCache(rw_cache=self.cache_dir).fetch(self.CRC)
+        self.assertEqual(5, len(second['group0']))
+
+
+@benchmark
+class TocCacheBenchmark(unittest.TestCase):
+
+    CRC = 0x12345678
+    ITERATIONS = 50
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        TocCache.clear_decoded()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        TocCache.clear_decoded()
+
+    def _measure(self, cold):
+        start = time.perf_counter()
+        for _ in range(self.ITERATIONS):
+            if cold:
+                TocCache.clear_decoded()
+            toc = TocCache(rw_cache=self.cache_dir).fetch(self.CRC)
+        elapsed = time.perf_counter() - start
+        self.assertIsNotNone(toc)
+        return elapsed / self.ITERATIONS
+
+    def test_cold_and_warm_load(self):
+        # Fixture
+        TocCache(rw_cache=self.cache_dir).insert(
+            self.CRC, create_param_toc(1000))
+
+        # Test
+        cold = self._measure(True)
+        warm = self._measure(False)
+
+        # Assert
+        # A warm load copies the decoded TOC instead of reading the file
+        self.assertLess(warm, cold / 10, (cold, warm))
+        self.assertIsInstance(
+            TocCache(rw_cache=self.cache_dir).fetch(self.CRC)['group0'][
+                'param0'], ParamTocElement)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2023 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+import queue
+import threading
+import unittest
+
+from cflib.crtp.crtpstack import CRTPPacket
+from cflib.crtp.crtpstack import CRTPPort
+from cflib.crtp.packetqueue import PacketQueue
+
+
+def create_packet(port, channel, data=(0,)):
+    pk = CRTPPacket()
+    pk.set_header(port, channel)
+    pk.data = data
+    return pk
+
+
+class PacketQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = PacketQueue(depth=2)
+
+    def _drain(self):
+        result = []
+        while not self.sut.empty():
+            result.append(self.sut.get(False)[0])
+        return result
+
+    def test_that_packets_are_taken_in_priority_order(self):
+        # Fixture
+        param = create_packet(CRTPPort.PARAM, 2)
+        extpos = create_packet(CRTPPort.LOCALIZATION, 0)
+        hl = create_packet(CRTPPort.SETPOINT_HL, 0)
+        setpoint = create_packet(CRTPPort.COMMANDER_GENERIC, 0)
+
+        # Test
+        for pk in [param, extpos, hl, setpoint]:
+            self.sut.put(pk, False)
+
+        # Assert
+        self.assertEqual([setpoint, extpos, param, hl], self._drain())
+
+    def test_that_commands_in_different_classes_are_taken_in_order(self):
+        # Fixture
+        param = create_packet(CRTPPort.PARAM, 2)
+        stop = create_packet(CRTPPort.COMMANDER_GENERIC, 1)
+        mem = create_packet(CRTPPort.MEM, 2)
+        takeoff = create_packet(CRTPPort.SETPOINT_HL, 0)
+        emergency_stop = create_packet(CRTPPort.LOCALIZATION, 1, (3,))
+
+        # Test
+        for pk in [param, stop, mem, takeoff, emergency_stop]:
+            self.sut.put(pk, False)
+
+        # Assert
+        self.assertEqual([param, stop, mem, takeoff, emergency_stop],
+                         self._drain())
+
+    def test_that_setpoint_does_not_overtake_command_in_its_class(self):
+        # Fixture
+        param = create_packet(CRTPPort.PARAM, 2)
+        stop = create_packet(CRTPPort.COMMANDER_GENERIC, 1)
+        setpoint = create_packet(CRTPPort.COMMANDER_GENERIC, 0)
+        extpos = create_packet(CRTPPort.LOCALIZATION, 0)
+
+        # Test
+        for pk in [param, stop, setpoint, extpos]:
+            self.sut.put(pk, False)
+
+        # Assert
+        self.assertEqual([extpos, param, stop, setpoint], self._drain())
+
+    def test_that_packets_in_a_class_are_taken_in_order(self):
+        # Fixture
+        first = create_packet(CRTPPort.MEM, 1)
+        second = create_packet(CRTPPort.PARAM, 1)
+
+        # Test
+        self.sut.put(first, False)
+        self.sut.put(second, False)
+
+        # Assert
+        self.assertEqual([first, second], self._drain())
+
+    def test_that_queued_setpoint_is_superseded(self):
+        # Fixture
+        old = create_packet(CRTPPort.COMMANDER_GENERIC, 0, (1,))
+        other_port = create_packet(CRTPPort.COMMANDER, 0, (2,))
+        new = create_packet(CRTPPort.COMMANDER_GENERIC, 0, (3,))
+
+        # Test
+        for pk in [old, other_port, new]:
+            self.sut.put(pk, False)
+
+        # Assert
+        self.assertEqual([new, other_port], self._drain())
+        self.assertEqual(1, self.sut.get_statistics()['setpoint']['superseded'])
+
+    def test_that_queued_external_position_is_superseded(self):
+        # Fixture
+        old_pos = create_packet(CRTPPort.LOCALIZATION, 0, (1,))
+        old_pose = create_packet(CRTPPort.LOCALIZATION, 1, (8, 1))
+        emergency_stop = create_packet(CRTPPort.LOCALIZATION, 1, (3,))
+        new_pos = create_packet(CRTPPort.LOCALIZATION, 0, (2,))
+        new_pose = create_packet(CRTPPort.LOCALIZATION, 1, (8, 2))
+
+        # Test
+        self.sut = PacketQueue(depth=3)
+        for pk in [old_pos, old_pose, emergency_stop, new_pos, new_pose]:
+            self.sut.put(pk, False)
+
+        # Assert
+        self.assertEqual([new_pos, new_pose, emergency_stop], self._drain())
+
+    def test_that_commander_commands_are_not_superseded(self):
+        # Fixture
+        stop = create_packet(CRTPPort.COMMANDER_GENERIC, 1, (0,))
+        another = create_packet(CRTPPort.COMMANDER_GENERIC, 1, (0,))
+
+        # Test
+        self.sut.put(stop, False)
+        self.sut.put(another, False)
+
+        # Assert
+        self.assertEqual([stop, another], self._drain())
+
+    def test_that_full_class_raises_and_counts_drop(self):
+        # Fixture
+        for _ in range(2):
+            self.sut.put(create_packet(CRTPPort.PARAM, 2), False)
+
+        # Test
+        with self.assertRaises(queue.Full):
+            self.sut.put(create_packet(CRTPPort.MEM, 2), True, 0.01)
+        self.sut.put(create_packet(CRTPPort.SETPOINT_HL, 0), False)
+
+        # Assert
+        actual = self.sut.get_statistics()
+        self.assertEqual(1, actual['bulk']['dropped'])
+        self.assertEqual(2, actual['bulk']['depth'])
+        self.assertEqual(1, actual['high_level']['depth'])
+
+    def test_that_get_waits_for_packet(self):
+        # Fixture
+        pk = create_packet(CRTPPort.PARAM, 2)
+        timer = threading.Timer(0.05, self.sut.put, (pk,))
+
+        # Test
+        timer.start()
+        actual, _ = self.sut.get(True, 1)
+
+        # Assert
+        self.assertIs(pk, actual)
+
+    def test_that_empty_queue_raises(self):
+        # Fixture
+        # Test
+        # Assert
+        with self.assertRaises(queue.Empty):
+            self.sut.get(True, 0.01)
+
+    def test_that_blocked_put_continues_when_packet_is_taken(self):
+        # Fixture
+        for _ in range(2):
+            self.sut.put(create_packet(CRTPPort.PARAM, 2), False)
+        threading.Timer(0.05, self.sut.get).start()
+
+        # Test
+        self.sut.put(create_packet(CRTPPort.PARAM, 2), True, 1)
+
+        # Assert
+        self.assertEqual(2, self.sut.qsize())
+
+
+if __name__ == '__main__':
+    unittest.main()
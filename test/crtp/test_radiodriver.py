@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2023 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from cflib.crtp.radiodriver import _PollPolicy
+from cflib.crtp.radiodriver import _SharedRadio
+from cflib.crtp.radiodriver import _TdmScheduler
+from cflib.crtp.radiodriver import RadioDriver
+from cflib.crtp.radiodriver import RadioManager
+from cflib.drivers.crazyradio import _radio_ack
+from cflib.drivers.crazyradio import Crazyradio
+
+CONFIG_A = (10, (0xe7,) * 5, 2)
+CONFIG_B = (80, (0xe7,) * 5, 2)
+
+NULL_PACKET = [0xff]
+SETPOINT = [0x30, 0, 0, 0, 0]
+HIGH_LEVEL_PACKET = [0x80, 3, 0]
+LOG_PACKET = [0x51, 3, 1]
+
+
+def create_ack(data):
+    ack = _radio_ack()
+    ack.ack = True
+    ack.data = bytes(data)
+    return ack
+
+
+class TdmSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = _TdmScheduler()
+
+    def _next_ids(self, config, count):
+        return [self.sut.next(config)[0] for _ in range(count)]
+
+    def test_that_links_are_served_in_arrival_order(self):
+        # Fixture
+        for instance_id in range(3):
+            self.sut.add(instance_id, CONFIG_A, LOG_PACKET)
+
+        # Test
+        actual = self._next_ids(CONFIG_A, 3)
+
+        # Assert
+        self.assertEqual([0, 1, 2], actual)
+        self.assertFalse(self.sut.has_pending())
+
+    def test_that_a_link_is_served_once_per_round(self):
+        # Fixture
+        self.sut.add(0, CONFIG_A, LOG_PACKET)
+        self.sut.add(1, CONFIG_A, LOG_PACKET)
+        self.sut.next(CONFIG_A)
+
+        # Test
+        # Link 0 sends again before link 1 has been served
+        self.sut.add(0, CONFIG_A, SETPOINT)
+        actual = self._next_ids(CONFIG_A, 2)
+
+        # Assert
+        self.assertEqual([1, 0], actual)
+
+    def test_that_setpoints_are_sent_before_other_packets(self):
+        # Fixture
+        self.sut.add(0, CONFIG_A, NULL_PACKET)
+        self.sut.add(1, CONFIG_A, LOG_PACKET)
+        self.sut.add(2, CONFIG_A, SETPOINT)
+
+        # Test
+        actual = self._next_ids(CONFIG_A, 3)
+
+        # Assert
+        self.assertEqual([2, 1, 0], actual)
+
+    def test_that_packets_are_sent_in_packet_queue_class_order(self):
+        # Fixture
+        self.sut.add(0, CONFIG_A, LOG_PACKET)
+        self.sut.add(1, CONFIG_A, HIGH_LEVEL_PACKET)
+        self.sut.add(2, CONFIG_A, SETPOINT)
+
+        # Test
+        actual = self._next_ids(CONFIG_A, 3)
+
+        # Assert
+        self.assertEqual([2, 1, 0], actual)
+
+    def test_that_links_with_current_config_are_grouped(self):
+        # Fixture
+        self.sut.add(0, CONFIG_A, LOG_PACKET)
+        self.sut.add(1, CONFIG_B, LOG_PACKET)
+        self.sut.add(2, CONFIG_A, LOG_PACKET)
+        self.sut.add(3, CONFIG_B, LOG_PACKET)
+
+        # Test
+        actual = []
+        config = CONFIG_B
+        for _ in range(4):
+            instance_id, pending = self.sut.next(config)
+            config = pending.config
+            actual.append(instance_id)
+
+        # Assert
+        self.assertEqual([1, 3, 0, 2], actual)
+
+    def test_that_removed_link_is_not_served(self):
+        # Fixture
+        self.sut.add(0, CONFIG_A, LOG_PACKET)
+        self.sut.add(1, CONFIG_A, LOG_PACKET)
+
+        # Test
+        self.sut.remove(0)
+
+        # Assert
+        self.assertEqual([1], self._next_ids(CONFIG_A, 1))
+        self.assertFalse(self.sut.has_pending())
+
+
+class PollPolicyTest(unittest.TestCase):
+
+    def _waits(self, sut, count):
+        return [sut.next_wait(False) for _ in range(count)]
+
+    def test_that_uri_options_are_parsed(self):
+        # Fixture
+        # Test
+        actual = _PollPolicy.from_uri(
+            'radio://0/80/2M?safelink=0&poll=fixed&poll_max=20&poll_min=1'
+            '&poll_backoff=1.5')
+
+        # Assert
+        self.assertEqual(_PollPolicy.FIXED, actual.mode)
+        self.assertAlmostEqual(0.02, actual.max_wait)
+        self.assertAlmostEqual(0.001, actual.min_wait)
+        self.assertEqual(1.5, actual.backoff)
+
+    def test_that_unknown_mode_raises(self):
+        # Fixture
+        # Test
+        # Assert
+        with self.assertRaises(Exception):
+            _PollPolicy.from_uri('radio://0/80/2M?poll=sometimes')
+
+    def test_that_fixed_mode_waits_max_after_10_empty_acks(self):
+        # Fixture
+        sut = _PollPolicy(_PollPolicy.FIXED)
+
+        # Test
+        actual = self._waits(sut, 12)
+
+        # Assert
+        self.assertEqual([0] * 10 + [0.01] * 2, actual)
+
+    def test_that_adaptive_mode_backs_off_to_max(self):
+        # Fixture
+        sut = _PollPolicy(max_wait=0.004, min_wait=0.001)
+
+        # Test
+        actual = self._waits(sut, 7)
+
+        # Assert
+        self.assertEqual([0, 0, 0.001, 0.002, 0.004, 0.004, 0.004], actual)
+
+    def test_that_data_resets_the_wait(self):
+        # Fixture
+        sut = _PollPolicy(max_wait=0.004, min_wait=0.001)
+        self._waits(sut, 5)
+
+        # Test
+        actual = [sut.next_wait(True)] + self._waits(sut, 3)
+
+        # Assert
+        self.assertEqual([0, 0, 0, 0.001], actual)
+
+    def test_that_wait_is_limited_by_downlink_period(self):
+        # Fixture
+        sut = _PollPolicy(max_wait=0.01, min_wait=0.001)
+
+        # Test
+        sut.set_downlink_period(0.005)
+        actual = self._waits(sut, 6)
+
+        # Assert
+        self.assertEqual([0, 0, 0.001, 0.002, 0.0025, 0.0025], actual)
+
+
+class SharedRadioTest(unittest.TestCase):
+
+    def setUp(self):
+        self.crazyradio_patch = patch('cflib.crtp.radiodriver.Crazyradio')
+        crazyradio_mock = self.crazyradio_patch.start()
+        self.radio_mock = MagicMock()
+        self.radio_mock.version = 0.5
+        self.radio_mock.send_packet.side_effect = create_ack
+        crazyradio_mock.return_value = self.radio_mock
+
+        self.sut = _SharedRadio(0)
+
+    def tearDown(self):
+        self.crazyradio_patch.stop()
+
+    def _open(self, channel):
+        instance = self.sut.open_instance()
+        instance.set_channel(channel)
+        return instance
+
+    def test_that_radio_is_only_configured_when_config_changes(self):
+        # Fixture
+        instance = self._open(10)
+
+        # Test
+        for _ in range(5):
+            ack = instance.send_packet(LOG_PACKET)
+
+        # Assert
+        self.assertTrue(ack.ack)
+        self.radio_mock.set_channel.assert_called_once_with(10)
+        self.assertEqual(1, self.sut.reconfigurations)
+
+    def test_that_airtime_statistics_are_kept_per_link(self):
+        # Fixture
+        instance_a = self._open(10)
+        instance_b = self._open(80)
+
+        # Test
+        for _ in range(3):
+            instance_a.send_packet(LOG_PACKET)
+        instance_b.send_packet(LOG_PACKET)
+
+        # Assert
+        actual_a = instance_a.statistics.as_dict()
+        actual_b = instance_b.statistics.as_dict()
+        self.assertEqual(3, actual_a['packets'])
+        self.assertEqual(3, actual_a['acks'])
+        self.assertEqual(1, actual_a['reconfigurations'])
+        self.assertEqual(1, actual_b['packets'])
+        self.assertGreater(actual_a['airtime'], 0)
+
+    def test_that_closed_link_is_removed(self):
+        # Fixture
+        instance_a = self._open(10)
+        instance_b = self._open(80)
+
+        # Test
+        instance_a.close()
+        ack = instance_b.send_packet(LOG_PACKET)
+
+        # Assert
+        self.assertTrue(ack.ack)
+        self.radio_mock.close.assert_not_called()
+
+
+class FakeScanRadio:
+    """Crazyradio answering scans for a set of Crazyflies"""
+
+    version = 0.5
+
+    def __init__(self, crazyflies, scanned):
+        # crazyflies is a set of (channel, datarate, address)
+        self._crazyflies = crazyflies
+        self._scanned = scanned
+        self._datarate = None
+        self._address = None
+        self.arc = []
+
+    def set_data_rate(self, datarate):
+        self._datarate = datarate
+
+    def set_address(self, address):
+        self._address = tuple(address)
+
+    def set_arc(self, arc):
+        self.arc.append(arc)
+
+    def scan_channels(self, start, stop, packet):
+        self._scanned.append((self, start, stop))
+        # Scanning takes time, let the other radios take jobs
+        time.sleep(0.001)
+        return tuple(c for c in range(start, stop + 1)
+                     if (c, self._datarate, self._address) in
+                     self._crazyflies)
+
+    def close(self):
+        pass
+
+
+class RadioScanTest(unittest.TestCase):
+
+    ADDRESS = 0xE7E7E7E701
+
+    def setUp(self):
+        self.scanned = []
+        crazyflies = {(10, Crazyradio.DR_2MPS, (0xe7,) * 5),
+                      (80, Crazyradio.DR_250KPS, (0xe7,) * 5),
+                      (100, Crazyradio.DR_2MPS, (0xe7,) * 4 + (0x01,))}
+        self.radios = [FakeScanRadio(crazyflies, self.scanned)
+                       for _ in range(2)]
+
+        self.crazyradio_patch = patch('cflib.crtp.radiodriver.Crazyradio')
+        crazyradio_mock = self.crazyradio_patch.start()
+        crazyradio_mock.side_effect = lambda devid: self.radios[devid]
+        self.serials_patch = patch('cflib.drivers.crazyradio.get_serials',
+                                   return_value=('a', 'b'))
+        self.serials_patch.start()
+
+        RadioDriver._scan_cache.clear()
+        self.sut = RadioDriver()
+
+    def tearDown(self):
+        self.crazyradio_patch.stop()
+        self.serials_patch.stop()
+        RadioManager._radios.clear()
+        RadioDriver._scan_cache.clear()
+
+    def _uris(self, found):
+        return sorted(uri.split('/', 3)[3] for uri in found)
+
+    def test_that_scan_interface_finds_crazyflies_on_all_datarates(self):
+        # Fixture
+        # Test
+        actual = self.sut.scan_interface(None)
+
+        # Assert
+        self.assertEqual(['80/250K', '10/2M'],
+                         [uri.split('/', 3)[3] for uri, _ in actual])
+
+    def test_that_scan_is_split_between_radios(self):
+        # Fixture
+        # Test
+        list(self.sut.scan())
+
+        # Assert
+        self.assertEqual(3 * 8, len(self.scanned))
+        self.assertEqual(3 * 126, sum(stop - start + 1
+                                      for _, start, stop in self.scanned))
+        self.assertEqual(set(self.radios),
+                         {radio for radio, _, _ in self.scanned})
+        # The arc is restored by the radio thread after the scan
+        deadline = time.time() + 1
+        while any(len(radio.arc) < 2 for radio in self.radios) and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        for radio in self.radios:
+            self.assertEqual([1, 3], radio.arc)
+
+    def test_that_addresses_are_scanned(self):
+        # Fixture
+        # Test
+        actual = list(self.sut.scan(addresses=[0xE7E7E7E7E7, self.ADDRESS],
+                                    datarates=['2M']))
+
+        # Assert
+        self.assertEqual(['10/2M', '100/2M/E7E7E7E701'], self._uris(actual))
+
+    def test_that_callback_is_called_with_each_uri(self):
+        # Fixture
+        found = []
+
+        # Test
+        actual = self.sut.scan_with_callback(found.append)
+
+        # Assert
+        self.assertEqual(actual, found)
+        self.assertEqual(2, len(found))
+
+    def test_that_cached_results_are_used_within_ttl(self):
+        # Fixture
+        list(self.sut.scan(datarates=['2M']))
+        scans = len(self.scanned)
+
+        # Test
+        actual = list(self.sut.scan(datarates=['2M'], cache_ttl=60))
+
+        # Assert
+        self.assertEqual(scans, len(self.scanned))
+        self.assertEqual(['10/2M'], self._uris(actual))
+
+    def test_that_stopping_early_ends_scan(self):
+        # Fixture
+        # Test
+        for uri in self.sut.scan(devids=[0]):
+            break
+
+        # Assert
+        threading.Event().wait(0.1)
+        self.assertLess(len(self.scanned), 3 * 8)
+
+    def test_that_scan_interface_returns_empty_list_on_usb_error(self):
+        # Fixture
+        self.serials_patch.stop()
+        self.serials_patch = patch('cflib.drivers.crazyradio.get_serials',
+                                   side_effect=Exception('No backend'))
+        self.serials_patch.start()
+
+        # Test
+        actual = self.sut.scan_interface(None)
+
+        # Assert
+        self.assertEqual([], actual)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2023 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+import errno
+import struct
+import unittest
+from threading import Event
+from unittest.mock import patch
+
+import cflib.crtp
+from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.log import LogConfig
+from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
+from cflib.crtp.crtpstack import CRTPPacket
+from cflib.crtp.crtpstack import CRTPPort
+from cflib.crtp.exceptions import WrongUriType
+from cflib.crtp.simdriver import SimDriver
+from cflib.crtp.simdriver import SimulatedFirmware
+
+
+class SimDriverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = SimDriver()
+
+    def tearDown(self):
+        self.sut.close()
+        SimDriver.firmwares.clear()
+
+    def test_that_other_uris_are_rejected(self):
+        # Fixture
+        # Test
+        # Assert
+        with self.assertRaises(WrongUriType):
+            self.sut.connect('radio://0/80/2M', None, None)
+
+    def test_that_uri_options_are_parsed(self):
+        # Fixture
+        # Test
+        actual = SimDriver.parse_uri('sim://cf-1?protocol=3&latency=5')
+
+        # Assert
+        self.assertEqual(('cf-1', 3, 0.005), actual)
+
+    def test_that_unknown_uri_option_raises(self):
+        # Fixture
+        # Test
+        # Assert
+        with self.assertRaises(Exception):
+            SimDriver.parse_uri('sim://0?bogus=1')
+
+    def test_that_firmware_is_reused_when_reconnecting(self):
+        # Fixture
+        self.sut.connect('sim://0', None, None)
+        firmware = self.sut.firmware
+        self.sut.close()
+
+        # Test
+        self.sut.connect('sim://0', None, None)
+
+        # Assert
+        self.assertIs(firmware, self.sut.firmware)
+        self.assertEqual([['sim://0', '']], self.sut.scan_interface())
+
+    def test_that_echo_is_answered(self):
+        # Fixture
+        self.sut.connect('sim://0', None, None)
+        pk = CRTPPacket()
+        pk.set_header(CRTPPort.LINKCTRL, 0)
+        pk.data = (1, 2, 3)
+
+        # Test
+        self.sut.send_packet(pk)
+
+        # Assert
+        actual = self.sut.receive_packet(1)
+        self.assertEqual(pk.header, actual.header)
+        self.assertEqual(bytearray((1, 2, 3)), actual.data)
+
+    def test_that_no_packets_are_received_after_close(self):
+        # Fixture
+        self.sut.connect('sim://0', None, None)
+        firmware = self.sut.firmware
+        self.sut.close()
+        pk = CRTPPacket()
+        pk.set_header(CRTPPort.LINKCTRL, 0)
+        pk.data = (1,)
+
+        # Test
+        firmware.handle_packet(pk)
+
+        # Assert
+        self.assertIsNone(self.sut.receive_packet(0))
+
+
+class SimulatedFirmwareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.replies = []
+        self.sut = SimulatedFirmware()
+        self.sut.attach(self.replies.append)
+
+    def tearDown(self):
+        self.sut.detach()
+
+    def _send(self, port, channel, data):
+        pk = CRTPPacket()
+        pk.set_header(port, channel)
+        pk.data = data
+        self.sut.handle_packet(pk)
+        return self.replies.pop() if self.replies else None
+
+    def test_that_protocol_version_is_answered(self):
+        # Fixture
+        # Test
+        actual = self._send(CRTPPort.PLATFORM, 1, (0,))
+
+        # Assert
+        self.assertEqual(bytearray((0, 4)), actual.data)
+
+    def test_that_toc_info_has_number_of_items_in_both_versions(self):
+        # Fixture
+        expected = len(SimulatedFirmware.PARAMS)
+
+        # Test
+        actual_v1 = self._send(CRTPPort.PARAM, 0, (1,))
+        actual_v2 = self._send(CRTPPort.PARAM, 0, (3,))
+
+        # Assert
+        self.assertEqual(expected, actual_v1.data[1])
+        self.assertEqual(expected,
+                         struct.unpack('<H', actual_v2.data[1:3])[0])
+        self.assertEqual(actual_v1.data[2:6], actual_v2.data[3:7])
+
+    def test_that_written_param_value_is_stored_and_answered(self):
+        # Fixture
+        # Test
+        actual = self._send(CRTPPort.PARAM, 2,
+                            struct.pack('<Hf', 4, 1.5))
+
+        # Assert
+        self.assertEqual(struct.pack('<Hf', 4, 1.5), bytes(actual.data))
+        self.assertEqual(1.5, self.sut.param_values['pid_rate.roll_kp'])
+
+    def test_that_read_only_param_is_not_written(self):
+        # Fixture
+        # Test
+        actual = self._send(CRTPPort.PARAM, 2,
+                            struct.pack('<HI', 10, 17))
+
+        # Assert
+        self.assertIsNone(actual)
+        self.assertEqual(0x12345678,
+                         self.sut.param_values['firmware.revision0'])
+
+    def test_that_log_block_with_unknown_variable_is_rejected(self):
+        # Fixture
+        # Test
+        actual = self._send(CRTPPort.LOGGING, 1, (6, 1, 0x77, 0xff, 0x00))
+
+        # Assert
+        self.assertEqual(bytearray((6, 1, errno.ENOENT)), actual.data)
+
+    def test_that_too_large_log_block_is_rejected(self):
+        # Fixture
+        data = [6, 1]
+        for i in range(7):
+            data += [0x77, i, 0]
+
+        # Test
+        actual = self._send(CRTPPort.LOGGING, 1, data)
+
+        # Assert
+        self.assertEqual(bytearray((6, 1, errno.E2BIG)), actual.data)
+
+    def test_that_log_data_is_packed_from_log_values(self):
+        # Fixture
+        self._send(CRTPPort.LOGGING, 1, (6, 1, 0x77, 0, 0, 0x22, 3, 0))
+        self.sut.log_values['stabilizer.roll'] = 2.5
+        self.sut.log_values['stabilizer.thrust'] = 1000
+        block = self.sut._blocks[1]
+
+        # Test
+        self.sut.send_log_data(block)
+
+        # Assert
+        actual = self.replies.pop()
+        self.assertEqual(2, actual.channel)
+        self.assertEqual(struct.pack('<fH', 2.5, 1000),
+                         bytes(actual.data[4:]))
+
+    def test_that_memory_read_out_of_range_fails(self):
+        # Fixture
+        # Test
+        actual = self._send(CRTPPort.MEM, 1,
+                            struct.pack('<BIB', 0, 0x1000 - 4, 8))
+
+        # Assert
+        self.assertEqual(errno.EIO, actual.data[5])
+
+    def test_that_memory_write_is_stored(self):
+        # Fixture
+        # Test
+        actual = self._send(CRTPPort.MEM, 2,
+                            struct.pack('<BI', 1, 10) + b'abc')
+
+        # Assert
+        self.assertEqual(0, actual.data[5])
+        self.assertEqual(b'abc', self.sut.memories[1][1][10:13])
+
+
+class SimulatedCrazyflieTest(unittest.TestCase):
+
+    def setUp(self):
+        self.classes_patch = patch.object(cflib.crtp, 'CLASSES', [SimDriver])
+        self.classes_patch.start()
+
+    def tearDown(self):
+        self.classes_patch.stop()
+        SimDriver.firmwares.clear()
+
+    def _assert_connect_and_log(self, uri):
+        cf = Crazyflie(rw_cache=None)
+        with SyncCrazyflie(uri, cf=cf):
+            firmware = cf.link.firmware
+            self.assertEqual(len(SimulatedFirmware.LOG_VARIABLES),
+                             cf.log.toc.nbr_of_elements())
+            self.assertEqual(len(SimulatedFirmware.PARAMS),
+                             cf.param.toc.nbr_of_elements())
+
+            values = cf.param.set_values({'ring.effect': 13}, timeout=5)
+            self.assertEqual({'ring.effect': '13'}, values)
+            self.assertEqual(13, firmware.param_values['ring.effect'])
+
+            firmware.log_values['pm.vbat'] = 3.75
+            received = []
+            enough = Event()
+
+            def data_received(timestamp, data, logconf):
+                received.append((timestamp, data))
+                if len(received) >= 3:
+                    enough.set()
+
+            log_config = LogConfig('test', 10)
+            log_config.add_variable('pm.vbat')
+            log_config.add_variable('sys.canfly')
+            log_config.data_received_cb.add_callback(data_received)
+            cf.log.add_config(log_config)
+            log_config.start()
+            self.assertTrue(enough.wait(5))
+            log_config.stop()
+
+            self.assertEqual({'pm.vbat': 3.75, 'sys.canfly': 0},
+                             received[0][1])
+            self.assertEqual(10, received[1][0] - received[0][0])
+
+    def test_connect_and_log_with_toc_v2(self):
+        self._assert_connect_and_log('sim://0')
+
+    def test_connect_and_log_with_toc_v1(self):
+        self._assert_connect_and_log('sim://0?protocol=3')
+
+    def test_memory_read(self):
+        # Fixture
+        cf = Crazyflie(rw_cache=None)
+        done = Event()
+
+        with SyncCrazyflie('sim://0', cf=cf):
+            mem = cf.mem.mems[0]
+
+            # Test
+            mem.read_data(100, 50, lambda mem: done.set())
+
+            # Assert
+            self.assertTrue(done.wait(5))
+            self.assertTrue(mem.readValidationSucess)
+
+
+if __name__ == '__main__':
+    unittest.main()
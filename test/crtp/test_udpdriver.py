@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2023 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+import os
+import socket
+import sys
+import threading
+import time
+import types
+import unittest
+from test.support.benchmark import benchmark
+from unittest.mock import patch
+
+import cflib.crtp
+from cflib.crtp.crtpdriver import CRTPDriver
+from cflib.crtp.crtpstack import CRTPPacket
+from cflib.crtp.exceptions import WrongUriType
+from cflib.crtp.udpdriver import UdpDriver
+
+
+class EchoServer(threading.Thread):
+    """UDP server that echoes all datagrams except the control messages"""
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.port = self.socket.getsockname()[1]
+        self.datagrams = []
+        self.control = []
+        self.client = None
+
+    def run(self):
+        while True:
+            try:
+                data, self.client = self.socket.recvfrom(2048)
+            except OSError:
+                return
+            if data[0] == 0xFF:
+                self.control.append(data)
+            else:
+                self.datagrams.append(data)
+                self.socket.sendto(data, self.client)
+
+    def send_to_client(self, data):
+        self.socket.sendto(data, self.client)
+
+    def close(self):
+        self.socket.close()
+
+
+def create_packet(port, channel, data):
+    pk = CRTPPacket()
+    pk.set_header(port, channel)
+    pk.data = data
+    return pk
+
+
+class UdpDriverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EchoServer()
+        self.server.start()
+        self.sut = UdpDriver()
+
+    def tearDown(self):
+        self.sut.close()
+        self.server.close()
+
+    def _connect(self, options=''):
+        self.sut.connect('udp://127.0.0.1:{}{}'.format(
+            self.server.port, options), None, None)
+
+    def test_that_other_uris_are_rejected(self):
+        # Fixture
+        # Test
+        # Assert
+        with self.assertRaises(WrongUriType):
+            self.sut.connect('radio://0/80/2M', None, None)
+
+    def test_that_uri_defaults_are_used(self):
+        # Fixture
+        # Test
+        actual = UdpDriver.parse_uri('udp://localhost')
+
+        # Assert
+        self.assertEqual(('localhost', 7777, 1, 1000), actual)
+
+    def test_that_uri_options_are_parsed(self):
+        # Fixture
+        # Test
+        actual = UdpDriver.parse_uri('udp://10.0.0.2:1234?coalesce=8&queue=5')
+
+        # Assert
+        self.assertEqual(('10.0.0.2', 1234, 8, 5), actual)
+
+    def test_that_packet_is_echoed(self):
+        # Fixture
+        self._connect()
+        pk = create_packet(5, 2, (1, 2, 3))
+
+        # Test
+        self.sut.send_packet(pk)
+        actual = self.sut.receive_packet(1)
+
+        # Assert
+        self.assertEqual(pk.header, actual.header)
+        self.assertEqual(bytearray((1, 2, 3)), actual.data)
+        self.assertEqual(bytes((0x5e, 1, 2, 3, 0x64)),
+                         self.server.datagrams[0])
+
+    def test_that_control_messages_are_sent(self):
+        # Fixture
+        self._connect()
+
+        # Test
+        self.sut.close()
+
+        # Assert
+        time.sleep(0.1)
+        self.assertEqual([b'\xFF\x01\x01\x01', b'\xFF\x01\x02\x02'],
+                         self.server.control)
+
+    def test_that_waiting_packets_are_coalesced(self):
+        # Fixture
+        self._connect('?coalesce=16')
+        packets = [create_packet(2, 1, (i, 0, i)) for i in range(40)]
+
+        # Test
+        for pk in packets:
+            self.sut.send_packet(pk)
+        actual = [self.sut.receive_packet(1) for _ in packets]
+
+        # Assert
+        self.assertEqual([bytearray(pk.data) for pk in packets],
+                         [pk.data for pk in actual])
+        self.assertLess(len(self.server.datagrams), len(packets))
+        self.assertEqual(0x2d, actual[0].header)
+
+    def test_that_frame_with_bad_checksum_is_dropped(self):
+        # Fixture
+        self._connect()
+        self.sut.send_packet(create_packet(0, 0, (1,)))
+        self.sut.receive_packet(1)
+
+        # Test
+        self.server.send_to_client(bytes((0x0c, 1, 0)))
+        self.server.send_to_client(bytes((0x0c, 2, 0x0e)))
+
+        # Assert
+        self.assertEqual(bytearray((2,)), self.sut.receive_packet(1).data)
+        self.assertEqual(1, self.sut.checksum_errors)
+
+    def test_that_oldest_packet_is_dropped_when_queue_is_full(self):
+        # Fixture
+        self._connect('?queue=2')
+        self.sut.send_packet(create_packet(0, 0, (0,)))
+        while len(self.server.datagrams) == 0:
+            time.sleep(0.01)
+
+        # Test
+        self.server.send_to_client(bytes((0x0c, 1, 0x0d)))
+        self.server.send_to_client(bytes((0x0c, 2, 0x0e)))
+        while self.sut.dropped_packets == 0:
+            time.sleep(0.01)
+
+        # Assert
+        self.assertEqual(bytearray((1,)), self.sut.receive_packet(1).data)
+        self.assertEqual(bytearray((2,)), self.sut.receive_packet(1).data)
+
+
+class AcceptAllDriver(CRTPDriver):
+    """Stand-in for the cflinkcpp driver, which accepts all URIs"""
+
+    def connect(self, uri, link_quality_callback, link_error_callback):
+        pass
+
+
+class UdpDriverRegistrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EchoServer()
+        self.server.start()
+        cpp_module = types.ModuleType('cflib.crtp.cflinkcppdriver')
+        cpp_module.CfLinkCppDriver = AcceptAllDriver
+        self.patches = [
+            patch.dict(sys.modules, {'cflib.crtp.cflinkcppdriver': cpp_module}),
+            patch.dict(os.environ, {'USE_CFLINK': 'cpp'}),
+            patch.object(cflib.crtp, 'CLASSES', []),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.server.close()
+
+    def test_that_udp_uri_is_not_taken_by_cpp_driver(self):
+        # Fixture
+        cflib.crtp.init_drivers()
+
+        # Test
+        actual = cflib.crtp.get_link_driver(
+            'udp://127.0.0.1:{}'.format(self.server.port))
+
+        # Assert
+        self.assertIsInstance(actual, UdpDriver)
+        actual.close()
+
+
+@benchmark
+class UdpDriverBenchmark(unittest.TestCase):
+
+    ITERATIONS = 2000
+    BATCH = 20
+
+    def setUp(self):
+        self.server = EchoServer()
+        self.server.start()
+
+    def tearDown(self):
+        self.server.close()
+
+    def _measure(self, options):
+        datagrams = len(self.server.datagrams)
+        sut = UdpDriver()
+        sut.connect('udp://127.0.0.1:{}{}'.format(self.server.port, options),
+                    None, None)
+        pk = create_packet(5, 2, bytes(range(20)))
+        try:
+            # Latency, one packet at a time
+            latencies = []
+            for _ in range(self.ITERATIONS // 10):
+                start = time.perf_counter()
+                sut.send_packet(pk)
+                sut.receive_packet(1)
+                latencies.append(time.perf_counter() - start)
+
+            # Throughput, a batch of packets in flight
+            received = 0
+            start = time.perf_counter()
+            for _ in range(self.ITERATIONS // self.BATCH):
+                for _ in range(self.BATCH):
+                    sut.send_packet(pk)
+                for _ in range(self.BATCH):
+                    if sut.receive_packet(1):
+                        received += 1
+            rate = received / (time.perf_counter() - start)
+        finally:
+            sut.close()
+
+        latencies.sort()
+        return {'rate': rate,
+                'median': latencies[len(latencies) // 2],
+                'p99': latencies[int(len(latencies) * 0.99)],
+                'datagrams': len(self.server.datagrams) - datagrams}
+
+    def test_echo_throughput_and_latency(self):
+        # Fixture
+        # Test
+        plain = self._measure('')
+        coalesced = self._measure('?coalesce=8')
+
+        # Assert
+        # Packets sent back to back share datagrams when coalescing
+        packets = self.ITERATIONS // 10 + self.ITERATIONS
+        self.assertEqual(packets, plain['datagrams'], plain)
+        self.assertLess(coalesced['datagrams'], packets / 2, coalesced)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  MA  02110-1301, USA.
+import os
+import time
+import unittest
+from unittest.mock import patch
+
+import cflib.crtp
+from cflib.crtp.simdriver import SimDriver
+
+# Benchmarks measure the speed of the host they run on and are only run when
+# asked for, with CFLIB_BENCHMARK=1
+benchmark = unittest.skipUnless(os.environ.get('CFLIB_BENCHMARK'),
+                                'Set CFLIB_BENCHMARK=1 to run benchmarks')
+
+
+def measure_rate(func, iterations):
+    """
+    Call func the given number of times and return the rate in calls per
+    second
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+
+    return iterations / elapsed
+
+
+class SimBenchmarkCase(unittest.TestCase):
+    """
+    Base class for benchmarks running against simulated Crazyflies. All URIs
+    are opened with the SimDriver and the simulated firmwares are removed
+    after each test.
+    """
+
+    def setUp(self):
+        classes_patch = patch.object(cflib.crtp, 'CLASSES', [SimDriver])
+        classes_patch.start()
+        self.addCleanup(classes_patch.stop)
+        self.addCleanup(SimDriver.firmwares.clear)
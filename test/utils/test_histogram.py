@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2023 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+import unittest
+
+from cflib.utils.histogram import LatencyHistogram
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = LatencyHistogram()
+
+    def test_that_empty_histogram_has_no_mean_or_percentile(self):
+        # Fixture
+        # Test
+        # Assert
+        self.assertIsNone(self.sut.mean())
+        self.assertIsNone(self.sut.percentile(50))
+
+    def test_that_latency_is_added_to_bucket(self):
+        # Fixture
+        # Test
+        self.sut.add(0.0015)
+        self.sut.add(0.003)
+        self.sut.add(3.0)
+
+        # Assert
+        actual = self.sut.as_dict()
+        self.assertEqual(1, actual['counts'][4])
+        self.assertEqual(1, actual['counts'][5])
+        self.assertEqual(1, actual['counts'][-1])
+        self.assertEqual(3, actual['count'])
+        self.assertEqual(3.0, actual['max'])
+
+    def test_that_percentile_is_upper_limit_of_bucket(self):
+        # Fixture
+        for _ in range(9):
+            self.sut.add(0.0003)
+        self.sut.add(0.03)
+
+        # Test
+        # Assert
+        self.assertEqual(0.0005, self.sut.percentile(50))
+        self.assertEqual(0.05, self.sut.percentile(99))
+
+    def test_that_reset_removes_values(self):
+        # Fixture
+        self.sut.add(0.01)
+
+        # Test
+        self.sut.reset()
+
+        # Assert
+        self.assertEqual(0, self.sut.count)
+        self.assertEqual(0, sum(self.sut.counts))
+
+
+if __name__ == '__main__':
+    unittest.main()